@@ -30,6 +30,7 @@ import argparse
 def parse_args():
   parser = argparse.ArgumentParser(description='Auto-profile HashFast boards in order to find optimal operating points.')
   parser.add_argument('-r', '--revision', dest='revision', type=int, default=3, help='HashFast board major revision number')
+  parser.add_argument('--resume', dest='resume', type=str, default=None, help='continue the interrupted session that wrote this CSV')
   return parser.parse_args()
 
 if __name__ == '__main__':
@@ -58,7 +59,6 @@ STEP_TIME = 4*60 # 4 minutes
 import sys
 import time
 import threading
-import csv
 
 from collections        import OrderedDict
 from abc                import ABCMeta, abstractmethod
@@ -71,6 +71,7 @@ from hf.load.routines   import settings
 from hf.load.routines   import thermal
 from hf.usb             import usbbulk
 from hf.usb             import usbctrl
+from hf.profiling       import store
 
 fn = OrderedDict([('die',None),('frequency',None),('voltage',None),('hashrate',None),('hashes',None),('jobs',None),('nonces',None),
                   ('lhw',None),('dhw',None),('chw',None),('temperature',None),('core_voltage',None),('thermal_cutoff',None),('elapsed',None),
@@ -84,26 +85,68 @@ class HFProfilerBase(object):
   def __init__(self):
     pass
 
+def moving_from_row(row):
+  # the moving stats of a point completed in an earlier run of the session
+  return {'hashes': row['moving_hashes'], 'hashrate': row['moving_hashrate'], 'noncerate': row['moving_noncerate'],
+          'lhwrate': row['moving_lhwrate'], 'dhwrate': row['moving_dhwrate']}
+
+def moving_stats(moving):
+  # the moving stats kept in the session journal
+  return {key: moving[key] for key in ['hashes', 'hashrate', 'noncerate', 'lhwrate', 'dhwrate']}
+
 class HFProfilerInteractive(HFProfilerBase):
-  def __init__(self):
+  def __init__(self, resume=None, serial=None):
     self.frequency = [None]*4
     self.voltage   = [None]*4
     self.recommend = [ [] for x in range(4)]
-    self.csvfilename  = 'auto_profiler_{}.csv'.format(int(time.time()))
-    with open(self.csvfilename, 'w') as csvfile:
-      csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
-      csvwriter.writeheader()
+    self.csvfilename  = resume or 'auto_profiler_{}.csv'.format(int(time.time()))
+    # points are (die, frequency, voltage)
+    self.journal = store.SessionJournal(store.journal_filename(self.csvfilename),
+                                        {'tool': 'auto-profiler', 'csv': self.csvfilename, 'serial': serial, 'started': int(time.time()),
+                                         'frequencies': FRQS, 'voltages': VLTS})
+    self.store = store.ResultStore(self.csvfilename, fn, self.journal)
+    # points recommended by earlier runs of the session
+    for stop in self.journal.events('stopped'):
+      self.recommend[stop['die']].append({'die': stop['die'], 'frq': stop['frequency'], 'vlt': stop['voltage'],
+                                          'sm': stop['moving'], 'em': stop['moving'], 's': True, 'c': True})
+
+  def stopped(self):
+    # [die, frequency] of each die that stopped testing at a frequency
+    return [[stop['die'], stop['frequency']] for stop in self.journal.events('stopped')]
 
   def start(self, ui, dev):
     talkusb.talkusb(hf.INIT, None, 0);
-    self.test(ui, dev)
+    try:
+      self.test(ui, dev)
+    finally:
+      self.store.close()
     self.confirm(ui)
     ui.prompt_enter("Check Die Settings on Left")
 
+  def frequency_done(self, frq, disabled_die):
+    if frq in self.journal.events('frequency'):
+      return True
+    stopped = self.stopped()
+    for di in range(4):
+      if di == disabled_die or [di, frq] in stopped:
+        continue
+      if not all(self.journal.is_done(di, frq, vlt) for vlt in VLTS):
+        return False
+    return True
+
   def test(self, ui, dev):
-    disabled_die = ui.prompt_int_single("Disabled Die? 0-3, 4=NO")
+    disabled = self.journal.events('disabled_die')
+    if disabled:
+      disabled_die = disabled[-1]
+      ui.log("Resuming {}, disabled die {}".format(self.csvfilename, disabled_die))
+    else:
+      disabled_die = ui.prompt_int_single("Disabled Die? 0-3, 4=NO")
+      self.journal.mark([{'disabled_die': disabled_die}])
     #option = ui.prompt_int_single("Option?")
     for frq in FRQS:
+      if self.frequency_done(frq, disabled_die):
+        ui.log("{} MHz done in an earlier run".format(frq))
+        continue
       ran_frq = False
       while not ran_frq:
         try:
@@ -123,6 +166,8 @@ class HFProfilerInteractive(HFProfilerBase):
           self.run(ui, dev, frq)
           # mark ready for next
           ran_frq = True
+          self.store.flush()
+          self.journal.mark([{'frequency': frq}])
 
           self.confirm(ui)
 
@@ -173,6 +218,15 @@ class HFProfilerInteractive(HFProfilerBase):
     rslt = True
 
     self.run_stats = [ [{'die':x, 'frq':option, 'vlt':vlt, 'sm':None, 'em':None, 's':False, 'c':False} for vlt in VLTS] for x in range(4)]
+    # skip the points completed by an earlier run of the session
+    for drs in self.run_stats:
+      for rs in drs:
+        row = self.journal.row(rs['die'], rs['frq'], rs['vlt'])
+        if row is not None:
+          rs['sm'] = rs['em'] = moving_from_row(row)
+          rs['s'] = rs['c'] = True
+    stopped = self.stopped()
+    self.die_stops = [[x, option] in stopped for x in range(4)]
 
     # thread
     thread = threading.Thread(target=self.monitor_temp, args={ui})
@@ -201,18 +255,15 @@ class HFProfilerInteractive(HFProfilerBase):
         if die['frequency'] is not None:
           self.frequency[x] = die['frequency']
     # write logfile
-    with open(self.csvfilename, 'a') as csvfile:
-      csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
-      for x in range(4):
-        if self.test.dies[x] is not None:
-          die = self.test.dies[x]
-          csvwriter.writerow(die)
+    for x in range(4):
+      if self.test.dies[x] is not None:
+        self.store.append(self.test.dies[x])
 
 
   def monitor_temp(self, ui):
     runtime = 0
     self.req_stop = False
-    die_stops = [False for x in range(4)]
+    die_stops = self.die_stops
     run_stats = self.run_stats
     # get dev
     dev = usbctrl.poll_hf_ctrl_device(printer=ui.log)
@@ -249,14 +300,12 @@ class HFProfilerInteractive(HFProfilerBase):
                 ## Record to CSV
                 ######
                 # write logfile
-                with open(self.csvfilename, 'a') as csvfile:
-                  this_die['moving_hashes']     = current_mv['hashes']
-                  this_die['moving_hashrate']   = current_mv['hashrate']
-                  this_die['moving_noncerate']  = current_mv['noncerate']
-                  this_die['moving_lhwrate']    = current_mv['lhwrate']
-                  this_die['moving_dhwrate']    = current_mv['dhwrate']
-                  csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
-                  csvwriter.writerow(this_die)
+                this_die['moving_hashes']     = current_mv['hashes']
+                this_die['moving_hashrate']   = current_mv['hashrate']
+                this_die['moving_noncerate']  = current_mv['noncerate']
+                this_die['moving_lhwrate']    = current_mv['lhwrate']
+                this_die['moving_dhwrate']    = current_mv['dhwrate']
+                self.store.append(this_die, point=(di, rs['frq'], rs['vlt']))
                 ###
                 ###
                 rs['em'] = current_mv
@@ -267,6 +316,9 @@ class HFProfilerInteractive(HFProfilerBase):
                   self.recommend[di].append(prev_rs)
                   # stop testing this die
                   die_stops[di] = True
+                  self.store.flush()
+                  self.journal.mark([{'stopped': {'die': di, 'frequency': rs['frq'], 'voltage': prev_rs['vlt'],
+                                                  'moving': moving_stats(prev_rs['sm'])}}])
                 else:  
                   continue
               else:
@@ -333,7 +385,9 @@ def main(args):
 
     ret = ui.prompt("HashFast Profiling Tool. Press 's' to start", "s")
     if ret:
-      profiler = HFProfilerInteractive()
+      # recorded in the session journal for profile-index.py
+      serial = dev.serial(0)
+      profiler = HFProfilerInteractive(args.resume, serial.hfserial() if serial.serial else None)
       profiler.start(ui, dev)
 
   finally:
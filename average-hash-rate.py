@@ -29,7 +29,6 @@
 
 import argparse
 import csv
-import fileinput
 import json
 import re
 import sys
@@ -167,6 +166,50 @@ from the log file and print it to standard output in a more widely
 accessible form.  The "--export" switch will output the data in JSON.
 The "--tabs", "--spaces", and "--csv" switches modify the export
 format in the expected way.
+
+Columns: "--columns FILE" writes the data to FILE in a compact binary
+form, a header followed by typed columns of device number, epoch time,
+search difficulty and zeros.  Such a file may be given to this program
+in place of the log, and every analysis then starts from the columns
+instead of parsing the text again:
+> $ ./average-hash-rate.py --columns some-log-file.audit some-log-file
+> $ ./average-hash-rate.py --verbose some-log-file.audit
+The loader in hf/audit/columns.py returns the columns as NumPy arrays
+when NumPy is installed.
+
+Large logs: The log is memory mapped and scanned in chunks of about
+64 MiB by a pool of processes, one per CPU unless "--jobs" says
+otherwise.  Only lines containing "Hash rate audit: " are parsed.
+
+Devices: With "--by-device" the program also reports the Effective
+Hash Rate of each device in the log, at the case chosen for that
+device the same way as above.  "--bucket SECS" further breaks each
+device's rate down into buckets of SECS seconds, e.g. "--bucket 3600"
+for the rate of every device in every hour, which shows which board
+underperforms and when:
+> $ ./average-hash-rate.py --bucket 3600 some-log-file
+> Collisions > 39 bits (672 cases of 1196), Effective Hash Rate: 404.19 Gh/s
+> HFB 0: Collisions > 39 bits (341 cases), Effective Hash Rate: 205.11 Gh/s
+> HFB 0 2014-04-17 14:00:00: Collisions > 39 bits (341 cases in 914 secs), Effective Hash Rate: 205.11 Gh/s
+> ...
+"--series FILE" writes the per device, per bucket counts and rates to
+FILE as comma separated values.  All of this comes from the same single
+pass over the log.  NumPy is used for the per device arrays when it is
+installed.
+
+Following: With "--follow" the program keeps reading the log as the
+miner writes it, and every "--interval" seconds prints each device's
+Effective Hash Rate over the last "--window" seconds together with a
+confidence interval for it, as well as the rate since it started
+following.  A rotated or truncated log is picked up again from the
+start of the new file.  With "--checkpoint FILE" the byte offset and
+the per device counts are saved to FILE after every update, so the
+program can be stopped and started again without rescanning the log:
+> $ ./average-hash-rate.py --follow --checkpoint audit.json cgminer.log
+> HFB 0: Collisions > 39 bits, last 600 secs (270 cases), Effective Hash Rate: 247.37 Gh/s (95% CI 218.89 - 278.57), overall 251.02 Gh/s (1612 cases)
+
+The interval shrinks with the number of cases, so a lower search
+difficulty gives a tighter estimate over the same window.
 """
 
 parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -179,10 +222,30 @@ parser.add_argument("--export", action="store_true", help="Parse log file and ex
 parser.add_argument("--tabs", action="store_true", help="When exporting, use tabs for delimiters.")
 parser.add_argument("--spaces", action="store_true", help="When exporting, use spaces for delimiters.")
 parser.add_argument("--csv", action="store_true", help="When exporting, use commas for delimiters.")
+parser.add_argument("--columns", type=str, default=None, help="Parse log file and write the data to this file in columnar binary form.")
+parser.add_argument("--jobs", type=int, default=None, help="Number of processes scanning the log, default one per CPU.")
+parser.add_argument("--by-device", action="store_true", help="Also report the rate of each device.")
+parser.add_argument("--bucket", type=int, default=None, help="Also report the rate of each device in buckets of this many seconds.")
+parser.add_argument("--series", type=str, default=None, help="Write per device, per bucket rates to this file as CSV.")
+parser.add_argument("--follow", action="store_true", help="Keep reading the log as it grows and report rates per device.")
+parser.add_argument("--checkpoint", type=str, default=None, help="When following, save the log offset and counts to this file.")
+parser.add_argument("--window", type=float, default=600.0, help="When following, seconds of log in the sliding window.")
+parser.add_argument("--interval", type=float, default=10.0, help="When following, seconds between reports.")
+parser.add_argument("--confidence", type=float, default=0.95, help="When following, confidence level of the reported interval.")
 args = parser.parse_args()
 
-roughmatch_fast = re.compile(r'.*\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] Hash rate audit: (.*)$')
-finematch_fast = re.compile(r'^(HFB \d+): (\d+\.\d{6}) Search Difficulty: (\d+) Zeros: (\d+)$')
+from hf.audit import scan
+from hf.audit import columns
+
+column_input = not args.follow and columns.is_column_file(args.logfile)
+
+if args.columns:
+    if column_input:
+        print("%s is already a column file." % (args.logfile))
+        sys.exit(1)
+    count = columns.export_columns(args.logfile, args.columns, processes=args.jobs)
+    print("Wrote %d records to %s" % (count, args.columns))
+    sys.exit(0)
 
 if args.export:
     if args.tabs:
@@ -191,56 +254,55 @@ if args.export:
         print("Device Epochal-Time Search-Difficulty Zeros")
     elif args.csv:
         print("Device,Epochal Time,Search Difficulty,Zeros")
-    for line in fileinput.input(files=(args.logfile)):
-        roughmatch = roughmatch_fast.match(line)
-        if roughmatch:
-            finematch = finematch_fast.match(roughmatch.group(1))
-            if not finematch:
-                raise Exception("Bad line: %s" % (line))
+    if column_input:
+        blocks = [columns.iter_records(columns.load_columns(args.logfile))]
+    else:
+        blocks = (records for _, records in scan.iter_chunks(args.logfile, processes=args.jobs, records=True))
+    for records in blocks:
+        for (device, time, search_difficulty, zeros) in records:
             if args.tabs:
-                print("%s\t%s\t%s\t%s" %
-                      (finematch.group(1), finematch.group(2), finematch.group(3), finematch.group(4)))
+                print("%s\t%s\t%s\t%s" % (device, time, search_difficulty, zeros))
             elif args.spaces:
-                device_space_escaped = re.sub(r' ', r'\ ', finematch.group(1))
-                print("%s %s %s %s" %
-                      (device_space_escaped, finematch.group(2), finematch.group(3), finematch.group(4)))
+                device_space_escaped = re.sub(r' ', r'\ ', device)
+                print("%s %s %s %s" % (device_space_escaped, time, search_difficulty, zeros))
             elif args.csv:
-                print("%s,%s,%s,%s" %
-                      (finematch.group(1), finematch.group(2), finematch.group(3), finematch.group(4)))
+                print("%s,%s,%s,%s" % (device, time, search_difficulty, zeros))
             else:
-                a = {'Device': finematch.group(1),
-                     'Epochal Time': finematch.group(2),
-                     'Search Difficulty': finematch.group(3),
-                     'Zeros': finematch.group(4)}
+                a = {'Device': device,
+                     'Epochal Time': time,
+                     'Search Difficulty': search_difficulty,
+                     'Zeros': zeros}
                 print(json.dumps(a))
     sys.exit(0)
 
-start_time = None
-stop_time = None
-zeros_count = {}
-max_search_difficulty = 0
-for line in fileinput.input(files=(args.logfile)):
-    roughmatch = roughmatch_fast.match(line)
-    if roughmatch:
-        finematch = finematch_fast.match(roughmatch.group(1))
-        if not finematch:
-            raise Exception("Bad line: %s" % (line))
-        device = finematch.group(1)
-        time = float(finematch.group(2))
-        search_difficulty = int(finematch.group(3))
-        zeros = int(finematch.group(4))
-        if start_time == None:
-            start_time = time
-        stop_time = time
-        if search_difficulty > zeros:
-            raise ("Search difficulty %d must not be larger than size of collision %d."
-                   % (search_difficulty, zeros))
-        if search_difficulty > max_search_difficulty:
-            max_search_difficulty = search_difficulty
-        if zeros in zeros_count:
-            zeros_count[zeros] = zeros_count[zeros] + 1
-        else:
-            zeros_count[zeros] = 1
+if args.follow:
+    import time
+    from hf.audit import follow
+    follower = follow.LogFollower(args.logfile, args.checkpoint, args.window)
+    try:
+        while True:
+            if follower.poll() > 0:
+                follower.save_checkpoint()
+                for line in follow.format_rates(follower.rates(args.confidence), args.confidence):
+                    print(line)
+                sys.stdout.flush()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        follower.save_checkpoint()
+    sys.exit(0)
+
+bucket_seconds = None
+if args.by_device or args.bucket or args.series:
+    # one bucket per day unless asked for finer ones
+    bucket_seconds = args.bucket or 86400
+if column_input:
+    audit = columns.scan_columns(args.logfile, bucket_seconds=bucket_seconds)
+else:
+    audit = scan.scan(args.logfile, processes=args.jobs, bucket_seconds=bucket_seconds)
+start_time = audit.start_time
+stop_time = audit.stop_time
+zeros_count = audit.zeros_count
+max_search_difficulty = audit.max_search_difficulty
 
 if start_time is not None and stop_time is not None:
     elapsed_time = stop_time - start_time
@@ -308,3 +370,25 @@ if start_time is not None and stop_time is not None:
         print("Collisions > %d bits (%d cases of %d), Effective Hash Rate: %.2f Gh/s" %
               (best_choice, zero_count_totals[best_choice], zero_count_totals[least_bits],
                average_hash_rate_Ghs))
+
+if audit.buckets is not None:
+    import datetime
+    from hf.audit import breakdown
+    devices = breakdown.Breakdown(audit.buckets)
+    for (device, case, nonces, elapsed, rate) in devices.device_rates(args.zerobits):
+        if rate is None:
+            print("%s: Collisions > %d bits (%d cases), no elapsed time" % (device, case, nonces))
+        else:
+            print("%s: Collisions > %d bits (%d cases), Effective Hash Rate: %.2f Gh/s" %
+                  (device, case, nonces, rate / 1000000000.0))
+    if args.bucket:
+        for (device, start, elapsed, case, nonces, rate) in devices.series_rows(args.zerobits):
+            print("%s %s: Collisions > %d bits (%d cases in %.0f secs), Effective Hash Rate: %.2f Gh/s" %
+                  (device, datetime.datetime.fromtimestamp(start).strftime('%Y-%m-%d %H:%M:%S'),
+                   case, nonces, elapsed, rate / 1000000000.0))
+    if args.series:
+        with open(args.series, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Device", "Bucket Start", "Elapsed", "Zeros", "Cases", "Effective Hash Rate"])
+            for row in devices.series_rows(args.zerobits):
+                writer.writerow(row)
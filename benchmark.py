@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Run microbenchmarks for the host side protocol and crypto hot paths.')
+  parser.add_argument('-o', '--output', dest='output', type=str, default=None, help='write JSON results to this file')
+  parser.add_argument('-b', '--baseline', dest='baseline', type=str, default=None, help='compare against JSON results stored in this file')
+  parser.add_argument('-t', '--tolerance', dest='tolerance', type=float, default=0.10, help='allowed fractional slowdown against the baseline')
+  parser.add_argument('-s', '--save-baseline', dest='save_baseline', action='store_true', help='store the results as the new baseline')
+  parser.add_argument('-m', '--min-time', dest='min_time', type=float, default=1.0, help='minimum seconds spent in each benchmark')
+  parser.add_argument('-k', '--only', dest='only', type=str, nargs='*', default=None, help='only run benchmarks whose name contains one of these strings')
+  parser.add_argument('-l', '--list', dest='list', action='store_true', help='list benchmarks and exit')
+  return parser.parse_args()
+
+if __name__ == '__main__':
+  # parse args before other imports
+  args = parse_args()
+
+import os
+import sys
+
+from hf.bench import harness
+from hf.bench import cases
+
+def main(args):
+  benchmarks = cases.benchmarks()
+  if args.only:
+    benchmarks = [b for b in benchmarks if any(o in b.name for o in args.only)]
+
+  if args.list:
+    for bench in benchmarks:
+      print(bench.name)
+    return 0
+
+  def printmsg(msg):
+    print(msg)
+
+  results = harness.run_benchmarks(benchmarks, min_time=args.min_time, printer=printmsg)
+
+  if args.output:
+    harness.save_results(results, args.output)
+    print("Results written to %s" % (args.output))
+
+  if args.baseline:
+    if args.save_baseline or not os.path.exists(args.baseline):
+      harness.save_results(results, args.baseline)
+      print("Baseline written to %s" % (args.baseline))
+      return 0
+    baseline = harness.load_results(args.baseline)
+    regressions = harness.compare_results(results, baseline, args.tolerance)
+    for r in regressions:
+      print("REGRESSION %s: %.1f ops/s vs baseline %.1f ops/s (%.0f%%)" %
+            (r['name'], r['ops_sec'], r['baseline_ops_sec'], 100 * r['ratio']))
+    if regressions:
+      return 1
+    print("No regressions beyond %.0f%% against %s" % (100 * args.tolerance, args.baseline))
+  return 0
+
+if __name__ == "__main__":
+   sys.exit(main(args))
@@ -31,6 +31,11 @@ def parse_args():
   parser = argparse.ArgumentParser(description='Run a theoretical hashrate test.')
   parser.add_argument('-c', '--clockrate', dest='clockrate', type=int, default=1, help='clockrate in MHz')
   parser.add_argument('-d', '--deterministic', dest='deterministic', action='store_true', help='run a deterministic test')
+  parser.add_argument('-i', '--instrument', dest='instrument', action='store_true', help='time each phase of the hashing cycle, dump with SIGUSR1')
+  parser.add_argument('-p', '--profile-every', dest='profile_every', type=int, default=0, help='with --instrument, run cProfile on one cycle in this many')
+  parser.add_argument('-n', '--nonce-rate', dest='nonce_rate', type=float, default=0, help='adapt the search difficulty of each die to return about this many nonces per second, 0 for a fixed difficulty')
+  parser.add_argument('-m', '--metrics-port', dest='metrics_port', type=int, default=0, help='serve Prometheus metrics on this port, 0 to disable')
+  parser.add_argument('--metrics-host', dest='metrics_host', type=str, default='127.0.0.1', help='interface to serve metrics on')
   return parser.parse_args()
 
 if __name__ == '__main__':
@@ -44,6 +49,7 @@ import threading
 
 from hf.load import hf
 from hf.load import talkusb
+from hf.load.metrics import MetricsExporter
 from hf.load.routines import simple
 
 running = False
@@ -59,6 +65,15 @@ def main(args):
 
   # init the test
   test = simple.SimpleRoutine(talkusb.talkusb, args.clockrate, printer=printmsg, deterministic=args.deterministic)
+  if args.instrument:
+    instrumentation = test.enable_instrumentation(profile_every=args.profile_every)
+    instrumentation.install_signal()
+  if args.nonce_rate > 0:
+    test.enable_difficulty_control(target_rate=args.nonce_rate)
+  exporter = None
+  if args.metrics_port:
+    exporter = MetricsExporter(test, args.metrics_port, host=args.metrics_host, printer=printmsg)
+    exporter.start()
 
   # thread
   thread = threading.Thread(target=monitor, args={test})
@@ -73,6 +88,9 @@ def main(args):
 
   running = False
 
+  if exporter is not None:
+    exporter.stop()
+  test.report_instrumentation()
   print("All done!")
 
 def monitor(test):
@@ -0,0 +1,222 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Per device, per time bucket audit counts.  The scanning processes count
+# (device, bucket, zeros) cases in dicts, and once the log is read the counts
+# are laid out in one dense device x bucket x zeros array, a NumPy array when
+# NumPy is installed, so queries across every device and bucket are cheap.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def device_number(device):
+    # "HFB 12" sorts after "HFB 2"
+    return int(device.split()[-1])
+
+class BucketCounts(object):
+    """Per device, per bucket counts for a contiguous part of a log."""
+
+    def __init__(self, bucket_seconds):
+        self.bucket_seconds = bucket_seconds
+        self.counts = {}          # (device, bucket, zeros) -> nonces
+        self.max_search = {}      # (device, bucket) -> max search difficulty
+        self.times = {}           # device -> [first time, last time]
+
+    def add(self, device, time, search_difficulty, zeros):
+        bucket = int(time) // self.bucket_seconds
+        key = (device, bucket, zeros)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if search_difficulty > self.max_search.get((device, bucket), 0):
+            self.max_search[(device, bucket)] = search_difficulty
+        if device in self.times:
+            self.times[device][1] = time
+        else:
+            self.times[device] = [time, time]
+
+    def add_matches(self, matches):
+        """Adds findall() results of scan.audit_line, in log order."""
+        bucket_seconds = self.bucket_seconds
+        cases = {}
+        first = {}
+        last = {}
+        for device, time, search_difficulty, zeros in matches:
+            # times are always written with six decimals
+            key = (device, int(time[:-7]) // bucket_seconds, zeros, search_difficulty)
+            cases[key] = cases.get(key, 0) + 1
+            if device not in first:
+                first[device] = time
+            last[device] = time
+        for (device, bucket, zeros, search_difficulty), count in cases.items():
+            device = device.decode('ascii')
+            search_difficulty = int(search_difficulty)
+            key = (device, bucket, int(zeros))
+            self.counts[key] = self.counts.get(key, 0) + count
+            if search_difficulty > self.max_search.get((device, bucket), 0):
+                self.max_search[(device, bucket)] = search_difficulty
+        for device, time in first.items():
+            times = [float(time), float(last[device])]
+            device = device.decode('ascii')
+            if device in self.times:
+                self.times[device][1] = times[1]
+            else:
+                self.times[device] = times
+
+    def merge(self, later):
+        """Merge the counts for the part of the log that follows this one."""
+        for key, count in later.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        for key, search_difficulty in later.max_search.items():
+            if search_difficulty > self.max_search.get(key, 0):
+                self.max_search[key] = search_difficulty
+        for device, times in later.times.items():
+            if device in self.times:
+                self.times[device][1] = times[1]
+            else:
+                self.times[device] = list(times)
+        return self
+
+class Breakdown(object):
+    """Dense per device, per bucket audit counts.
+
+    counts[d][b][z - zeros_base] is the number of nonces device d found in
+    bucket b with z zero bits, and elapsed[d][b] the seconds of bucket b
+    between device d's first and last nonce.  Bucket b starts at
+    bucket_start + b * bucket_seconds."""
+
+    def __init__(self, bucket_counts):
+        self.bucket_seconds = bucket_counts.bucket_seconds
+        self.devices = sorted(bucket_counts.times, key=device_number)
+        self.times = [tuple(bucket_counts.times[device]) for device in self.devices]
+        device_index = dict((device, d) for d, device in enumerate(self.devices))
+        if bucket_counts.counts:
+            buckets = [key[1] for key in bucket_counts.counts]
+            zeros = [key[2] for key in bucket_counts.counts]
+        else:
+            buckets = zeros = [0]
+        first_bucket = min(buckets)
+        self.bucket_start = first_bucket * self.bucket_seconds
+        self.zeros_base = min(zeros)
+        shape = (len(self.devices), max(buckets) - first_bucket + 1, max(zeros) - self.zeros_base + 1)
+        if numpy is not None:
+            self.counts = numpy.zeros(shape, dtype=numpy.int64)
+            self.max_search = numpy.zeros(shape[:2], dtype=numpy.int32)
+        else:
+            self.counts = [[[0] * shape[2] for b in range(shape[1])] for d in range(shape[0])]
+            self.max_search = [[0] * shape[1] for d in range(shape[0])]
+        for (device, bucket, zeros), count in bucket_counts.counts.items():
+            self.counts[device_index[device]][bucket - first_bucket][zeros - self.zeros_base] = count
+        for (device, bucket), search_difficulty in bucket_counts.max_search.items():
+            self.max_search[device_index[device]][bucket - first_bucket] = search_difficulty
+        self.elapsed = [[self.bucket_elapsed(d, b) for b in range(shape[1])] for d in range(shape[0])]
+        if numpy is not None:
+            self.elapsed = numpy.array(self.elapsed, dtype=numpy.float64).reshape(shape[:2])
+
+    def bucket_elapsed(self, d, b):
+        start, stop = self.times[d]
+        bucket_start = self.bucket_start + b * self.bucket_seconds
+        return max(0.0, min(bucket_start + self.bucket_seconds, stop) - max(bucket_start, start))
+
+    def buckets(self):
+        return len(self.elapsed[0]) if self.devices else 0
+
+    def device_zeros_count(self, d):
+        """The zeros_count histogram of one device over the whole log."""
+        totals = {}
+        for row in self.counts[d]:
+            for i, count in enumerate(row):
+                if count:
+                    totals[i + self.zeros_base] = totals.get(i + self.zeros_base, 0) + int(count)
+        return totals
+
+    def best_case(self, d):
+        """The case average-hash-rate.py would report for one device: the
+        least zero bits, at or above the device's highest search difficulty,
+        that has any nonces."""
+        zeros_count = self.device_zeros_count(d)
+        search_difficulty = int(max(self.max_search[d]))
+        for case in sorted(zeros_count):
+            if case >= search_difficulty:
+                return case
+        return search_difficulty
+
+    def cases(self, zerobits=None):
+        if zerobits is not None:
+            return [zerobits] * len(self.devices)
+        return [self.best_case(d) for d in range(len(self.devices))]
+
+    def nonces(self, cases):
+        """nonces[d][b] counts the nonces of device d in bucket b with at
+        least cases[d] zero bits."""
+        width = len(self.counts[0][0]) if self.devices else 0
+        lows = [min(max(case - self.zeros_base, 0), width) for case in cases]
+        if numpy is not None:
+            # tails[d, b, i] counts the nonces with at least zeros_base + i zero bits
+            tails = numpy.concatenate([self.counts[:, :, ::-1].cumsum(axis=2)[:, :, ::-1],
+                                       numpy.zeros(self.counts.shape[:2] + (1,), dtype=numpy.int64)], axis=2)
+            return tails[numpy.arange(len(cases))[:, None], numpy.arange(self.buckets())[None, :],
+                         numpy.array(lows, dtype=numpy.intp)[:, None]]
+        return [[sum(row[low:]) for row in self.counts[d]] for d, low in enumerate(lows)]
+
+    def rates(self, zerobits=None):
+        """Returns (cases, nonces, rates) where rates[d][b] is the effective
+        hash rate of device d over bucket b, None where the device was not
+        running in that bucket."""
+        cases = self.cases(zerobits)
+        nonces = self.nonces(cases)
+        if numpy is not None:
+            scale = numpy.array([2.0**case for case in cases])[:, None]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                rates = numpy.where(self.elapsed > 0, nonces * scale / self.elapsed, numpy.nan)
+            rates = [[None if numpy.isnan(rate) else float(rate) for rate in row] for row in rates]
+            nonces = nonces.tolist()
+        else:
+            rates = [[nonces[d][b] * 2.0**cases[d] / self.elapsed[d][b] if self.elapsed[d][b] > 0 else None
+                      for b in range(self.buckets())] for d in range(len(self.devices))]
+        return cases, nonces, rates
+
+    def device_rates(self, zerobits=None):
+        """Returns a list of (device, case, nonces, elapsed, rate) over the
+        whole log, rate None if the device logged only one instant."""
+        cases, nonces, _ = self.rates(zerobits)
+        results = []
+        for d, device in enumerate(self.devices):
+            start, stop = self.times[d]
+            total = int(sum(nonces[d]))
+            rate = total * 2.0**cases[d] / (stop - start) if stop > start else None
+            results.append((device, cases[d], total, stop - start, rate))
+        return results
+
+    def series_rows(self, zerobits=None):
+        """Yields (device, bucket start, elapsed, case, nonces, rate) for each
+        device and bucket the device was running in."""
+        cases, nonces, rates = self.rates(zerobits)
+        for d, device in enumerate(self.devices):
+            for b in range(self.buckets()):
+                if rates[d][b] is None:
+                    continue
+                yield (device, self.bucket_start + b * self.bucket_seconds, float(self.elapsed[d][b]),
+                       cases[d], int(nonces[d][b]), rates[d][b])
@@ -0,0 +1,213 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Columnar binary form of the audit lines of a log, so that repeated
+# analyses read fixed width columns instead of parsing the text again.
+#
+# All values are little endian.  The file starts with a header:
+#   8 bytes   MAGIC
+#   uint16    format version, FORMAT_VERSION
+#   uint16    reserved, 0
+# followed by blocks of records in log order, each:
+#   uint32    n, the number of records in the block
+#   uint16[n] device number, n of "HFB n"
+#   float64[n] epoch time
+#   uint8[n]  search difficulty
+#   uint8[n]  zeros
+# and ends with a block of 0 records.
+
+import struct
+import sys
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import scan
+
+MAGIC = b'HFAUDIT\x00'
+FORMAT_VERSION = 1
+header_struct = struct.Struct('<8sHH')
+count_struct = struct.Struct('<I')
+
+# (name, array typecode, numpy dtype)
+COLUMNS = [('device', 'H', '<u2'),
+           ('time', 'd', '<f8'),
+           ('search_difficulty', 'B', 'u1'),
+           ('zeros', 'B', 'u1')]
+
+WRITE_BUFFER = 1024 * 1024
+
+def is_column_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def column_bytes(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+def pack_block(records):
+    """Returns (number of records, block bytes) for a list of audit line
+    fields, as bytes or strings.  Runs in the scanning processes."""
+    if not records:
+        return (0, b'')
+    devices, times, search_difficulties, zeros = zip(*records)
+    return (len(records),
+            count_struct.pack(len(records)) +
+            column_bytes('H', [int(device[4:]) for device in devices]) +
+            column_bytes('d', map(float, times)) +
+            column_bytes('B', map(int, search_difficulties)) +
+            column_bytes('B', map(int, zeros)))
+
+class ColumnWriter(object):
+    """Writes audit records to a column file one block at a time."""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb', WRITE_BUFFER)
+        self.file.write(header_struct.pack(MAGIC, FORMAT_VERSION, 0))
+        self.records = 0
+
+    def write_block(self, block):
+        count, data = block
+        self.file.write(data)
+        self.records += count
+
+    def write(self, records):
+        """Writes a block of records as returned by scan.iter_chunks()."""
+        self.write_block(pack_block(records))
+
+    def close(self):
+        self.file.write(count_struct.pack(0))
+        self.file.close()
+
+def export_columns(logfile, path, processes=None):
+    """Writes the audit lines of logfile to the column file path in one
+    pass, returns the number of records."""
+    writer = ColumnWriter(path)
+    try:
+        for _, block in scan.iter_chunks(logfile, processes=processes, records=pack_block):
+            writer.write_block(block)
+    finally:
+        writer.close()
+    return writer.records
+
+def read_column(data, offset, typecode, dtype, n):
+    size = array(typecode).itemsize * n
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype=dtype, count=n, offset=offset), offset + size
+    column = array(typecode)
+    column.frombytes(data[offset:offset + size])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column, offset + size
+
+def load_columns(path):
+    """Returns a dict of the columns of a column file, NumPy arrays if NumPy
+    is installed and arrays otherwise."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, _ = header_struct.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise Exception("%s is not an audit column file" % (path))
+    if version != FORMAT_VERSION:
+        raise Exception("%s has unknown audit column format %d" % (path, version))
+    offset = header_struct.size
+    blocks = dict((name, []) for name, _, _ in COLUMNS)
+    while True:
+        (n,) = count_struct.unpack_from(data, offset)
+        offset += count_struct.size
+        if n == 0:
+            break
+        for name, typecode, dtype in COLUMNS:
+            column, offset = read_column(data, offset, typecode, dtype, n)
+            blocks[name].append(column)
+    columns = {}
+    for name, typecode, dtype in COLUMNS:
+        if numpy is not None:
+            columns[name] = numpy.concatenate(blocks[name]) if blocks[name] else numpy.zeros(0, dtype=dtype)
+        else:
+            columns[name] = array(typecode)
+            for column in blocks[name]:
+                columns[name].extend(column)
+    return columns
+
+def device_name(number):
+    return "HFB %d" % (number)
+
+def iter_records(columns):
+    """Yields the fields of each record as parse_audit_line() returns them."""
+    for device, time, search_difficulty, zeros in zip(columns['device'], columns['time'],
+                                                      columns['search_difficulty'], columns['zeros']):
+        yield (device_name(device), "%.6f" % (time), str(search_difficulty), str(zeros))
+
+def scan_columns(path, bucket_seconds=None):
+    """Like scan.scan() for a column file."""
+    columns = load_columns(path)
+    partial = scan.AuditPartial(bucket_seconds)
+    if numpy is None:
+        for device, time, search_difficulty, zeros in zip(columns['device'], columns['time'],
+                                                          columns['search_difficulty'], columns['zeros']):
+            partial.add(device_name(device), time, search_difficulty, zeros)
+        return partial
+    device = columns['device']
+    time = columns['time']
+    search_difficulty = columns['search_difficulty']
+    zeros = columns['zeros']
+    if len(time) == 0:
+        return partial
+    bad = numpy.nonzero(search_difficulty > zeros)[0]
+    if len(bad):
+        raise Exception("Search difficulty %d must not be larger than size of collision %d."
+                        % (search_difficulty[bad[0]], zeros[bad[0]]))
+    partial.start_time = float(time[0])
+    partial.stop_time = float(time[-1])
+    partial.max_search_difficulty = int(search_difficulty.max())
+    partial.nonces = len(time)
+    cases, counts = numpy.unique(zeros, return_counts=True)
+    partial.zeros_count = dict((int(case), int(count)) for case, count in zip(cases, counts))
+    if partial.buckets is not None:
+        buckets = partial.buckets
+        bucket = (time // bucket_seconds).astype(numpy.int64)
+        first_bucket = int(bucket.min())
+        # device, bucket and zeros packed into one int64 key per record
+        key = (device.astype(numpy.int64) << 40) | ((bucket - first_bucket) << 8)
+        keys, counts = numpy.unique(key | zeros, return_counts=True)
+        for k, count in zip(keys.tolist(), counts.tolist()):
+            buckets.counts[(device_name(k >> 40), ((k >> 8) & 0xffffffff) + first_bucket, k & 0xff)] = count
+        keys, inverse = numpy.unique(key, return_inverse=True)
+        highest = numpy.zeros(len(keys), dtype=numpy.int64)
+        numpy.maximum.at(highest, inverse.ravel(), search_difficulty)
+        for k, value in zip(keys.tolist(), highest.tolist()):
+            buckets.max_search[(device_name(k >> 40), ((k >> 8) & 0xffffffff) + first_bucket)] = value
+        numbers, first = numpy.unique(device, return_index=True)
+        _, last = numpy.unique(device[::-1], return_index=True)
+        for number, i, j in zip(numbers.tolist(), first.tolist(), last.tolist()):
+            buckets.times[device_name(number)] = [float(time[i]), float(time[len(time) - 1 - j])]
+    return partial
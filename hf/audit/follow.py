@@ -0,0 +1,207 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Follow mode for average-hash-rate.py: tails a growing cgminer log and keeps
+# per device audit counts, with a checkpoint file so a restart carries on
+# from the last byte read instead of rescanning the log.
+
+import json
+import math
+import os
+
+from collections import deque
+from statistics import NormalDist
+
+from . import scan
+from .breakdown import device_number
+
+READ_SIZE = 16 * 1024 * 1024
+
+def poisson_interval(n, confidence=0.95):
+    """Confidence interval for the mean of a Poisson count n, using Byar's
+    approximation to the exact interval."""
+    z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+    if n == 0:
+        lower = 0.0
+    else:
+        lower = n * (1.0 - 1.0 / (9.0 * n) - z / (3.0 * math.sqrt(n)))**3
+    m = n + 1
+    upper = m * (1.0 - 1.0 / (9.0 * m) + z / (3.0 * math.sqrt(m)))**3
+    return (lower, upper)
+
+class LogFollower(object):
+    """Reads the audit lines appended to a log since the last poll().
+
+    A log that is rotated (the path names a new file) is read to its end
+    before the new file is opened, and a truncated log is read again from
+    the start.  Only complete lines are consumed, so a line being written
+    is picked up by the next poll()."""
+
+    def __init__(self, path, checkpoint_path=None, window=600.0):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.window = window
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.latest = None # newest log time seen
+        self.devices = {}  # device -> scan.AuditPartial since the checkpoint began
+        self.recent = {}   # device -> deque of (time, zeros) in the window
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self.load_checkpoint()
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_path) as f:
+            state = json.load(f)
+        if state['path'] != os.path.abspath(self.path):
+            raise Exception("Checkpoint %s is for %s" % (self.checkpoint_path, state['path']))
+        self.inode = state['inode']
+        self.offset = state['offset']
+        self.latest = state['latest']
+        self.devices = dict((device, scan.AuditPartial.from_dict(partial))
+                            for device, partial in state['devices'].items())
+        self.recent = dict((device, deque(tuple(entry) for entry in entries))
+                           for device, entries in state['recent'].items())
+
+    def save_checkpoint(self):
+        if self.checkpoint_path is None:
+            return
+        state = {'path': os.path.abspath(self.path),
+                 'inode': self.inode,
+                 'offset': self.offset,
+                 'latest': self.latest,
+                 'devices': dict((device, partial.to_dict()) for device, partial in self.devices.items()),
+                 'recent': dict((device, list(entries)) for device, entries in self.recent.items())}
+        # replace the old checkpoint in one step, so a crash leaves one or the other
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, self.checkpoint_path)
+
+    def open(self):
+        try:
+            self.file = open(self.path, 'rb')
+        except (IOError, OSError):
+            # rotated away and not created again yet
+            return False
+        st = os.fstat(self.file.fileno())
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self.offset = 0
+        self.inode = st.st_ino
+        return True
+
+    def poll(self):
+        """Returns the number of audit lines read."""
+        if self.file is None and not self.open():
+            return 0
+        count = self.read_new()
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return count
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            # rotated or truncated: finish the old file, then start the new one
+            count += self.read_new()
+            self.file.close()
+            self.file = None
+            if self.open():
+                count += self.read_new()
+        return count
+
+    def read_new(self):
+        count = 0
+        while True:
+            self.file.seek(self.offset)
+            data = self.file.read(READ_SIZE)
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                break
+            _, records = scan.scan_buffer(data, 0, end, records=True)
+            for fields in records:
+                self.add(*scan.convert_fields(fields))
+            count += len(records)
+            self.offset += end
+            if len(data) < READ_SIZE:
+                break
+        self.trim()
+        return count
+
+    def add(self, device, time, search_difficulty, zeros):
+        if device not in self.devices:
+            self.devices[device] = scan.AuditPartial()
+            self.recent[device] = deque()
+        self.devices[device].add(device, time, search_difficulty, zeros)
+        self.recent[device].append((time, zeros))
+        if self.latest is None or time > self.latest:
+            self.latest = time
+
+    def trim(self):
+        if self.latest is None:
+            return
+        for entries in self.recent.values():
+            while entries and entries[0][0] < self.latest - self.window:
+                entries.popleft()
+
+    def rates(self, confidence=0.95):
+        """Effective hash rate of each device over the window and since the
+        checkpoint began, at the device's highest search difficulty.  The
+        window ends at the newest time in the log, so a device that stopped
+        reporting shows a falling rate."""
+        results = []
+        for device in sorted(self.devices, key=device_number):
+            partial = self.devices[device]
+            case = partial.max_search_difficulty
+            window_start = max(self.latest - self.window, partial.start_time)
+            elapsed = self.latest - window_start
+            nonces = sum(1 for time, zeros in self.recent[device] if zeros >= case)
+            total_nonces = sum(count for zeros, count in partial.zeros_count.items() if zeros >= case)
+            total_elapsed = partial.stop_time - partial.start_time
+            result = {'device': device, 'case': case, 'nonces': nonces, 'elapsed': elapsed,
+                      'rate': None, 'lower': None, 'upper': None,
+                      'total_nonces': total_nonces, 'total_rate': None}
+            if elapsed > 0:
+                lower, upper = poisson_interval(nonces, confidence)
+                result['rate'] = nonces * 2**case / elapsed
+                result['lower'] = lower * 2**case / elapsed
+                result['upper'] = upper * 2**case / elapsed
+            if total_elapsed > 0:
+                result['total_rate'] = total_nonces * 2**case / total_elapsed
+            results.append(result)
+        return results
+
+def format_rates(results, confidence=0.95):
+    lines = []
+    for r in results:
+        if r['rate'] is None:
+            lines.append("%s: not enough data yet" % (r['device']))
+            continue
+        line = ("%s: Collisions > %d bits, last %.0f secs (%d cases), Effective Hash Rate: %.2f Gh/s"
+                " (%.0f%% CI %.2f - %.2f)" %
+                (r['device'], r['case'], r['elapsed'], r['nonces'], r['rate'] / 1e9,
+                 100 * confidence, r['lower'] / 1e9, r['upper'] / 1e9))
+        if r['total_rate'] is not None:
+            line += ", overall %.2f Gh/s (%d cases)" % (r['total_rate'] / 1e9, r['total_nonces'])
+        lines.append(line)
+    return lines
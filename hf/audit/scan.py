@@ -0,0 +1,251 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Parallel scanner for cgminer hash audit logs, see average-hash-rate.py.
+# The log is memory mapped and split at line boundaries into chunks which a
+# process pool scans independently.  Lines are only looked at around a byte
+# search hit for the audit marker, so the regexes never see the rest of the
+# log, and the per-chunk partial results are merged in file order.
+
+import mmap
+import multiprocessing
+import os
+import re
+
+from .breakdown import BucketCounts
+
+MARKER = b'Hash rate audit: '
+
+roughmatch_fast = re.compile(br'.*\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] Hash rate audit: (.*?)\r?$')
+finematch_fast = re.compile(br'^(HFB \d+): (\d+\.\d{6}) Search Difficulty: (\d+) Zeros: (\d+)$')
+# Both of the above in one pattern which starts with the literal marker, so
+# the regex engine can search a whole chunk for it
+audit_line = re.compile(br'(?<=\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] )Hash rate audit: '
+                        br'(HFB \d+): (\d+\.\d{6}) Search Difficulty: (\d+) Zeros: (\d+)\r?$', re.MULTILINE)
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+class AuditPartial(object):
+    """Audit counts for a contiguous part of a log, and the per device
+    BucketCounts if bucket_seconds is given."""
+
+    def __init__(self, bucket_seconds=None):
+        self.zeros_count = {}
+        self.start_time = None
+        self.stop_time = None
+        self.max_search_difficulty = 0
+        self.nonces = 0
+        self.buckets = None
+        if bucket_seconds is not None:
+            self.buckets = BucketCounts(bucket_seconds)
+
+    def add(self, device, time, search_difficulty, zeros):
+        if self.start_time is None:
+            self.start_time = time
+        self.stop_time = time
+        if search_difficulty > zeros:
+            raise Exception("Search difficulty %d must not be larger than size of collision %d."
+                            % (search_difficulty, zeros))
+        if search_difficulty > self.max_search_difficulty:
+            self.max_search_difficulty = search_difficulty
+        self.zeros_count[zeros] = self.zeros_count.get(zeros, 0) + 1
+        self.nonces += 1
+        if self.buckets is not None:
+            self.buckets.add(device, time, search_difficulty, zeros)
+
+    def add_matches(self, matches):
+        """Adds findall() results of audit_line, in log order."""
+        if not matches:
+            return
+        if self.start_time is None:
+            self.start_time = float(matches[0][1])
+        self.stop_time = float(matches[-1][1])
+        pairs = {}
+        for match in matches:
+            pair = match[2:]
+            pairs[pair] = pairs.get(pair, 0) + 1
+        for (search_difficulty, zeros), count in pairs.items():
+            search_difficulty = int(search_difficulty)
+            zeros = int(zeros)
+            if search_difficulty > zeros:
+                raise Exception("Search difficulty %d must not be larger than size of collision %d."
+                                % (search_difficulty, zeros))
+            if search_difficulty > self.max_search_difficulty:
+                self.max_search_difficulty = search_difficulty
+            self.zeros_count[zeros] = self.zeros_count.get(zeros, 0) + count
+        self.nonces += len(matches)
+        if self.buckets is not None:
+            self.buckets.add_matches(matches)
+
+    def to_dict(self):
+        return {'zeros_count': dict((str(zeros), count) for zeros, count in self.zeros_count.items()),
+                'start_time': self.start_time,
+                'stop_time': self.stop_time,
+                'max_search_difficulty': self.max_search_difficulty,
+                'nonces': self.nonces}
+
+    @classmethod
+    def from_dict(cls, state):
+        partial = cls()
+        partial.zeros_count = dict((int(zeros), count) for zeros, count in state['zeros_count'].items())
+        partial.start_time = state['start_time']
+        partial.stop_time = state['stop_time']
+        partial.max_search_difficulty = state['max_search_difficulty']
+        partial.nonces = state['nonces']
+        return partial
+
+    def merge(self, later):
+        """Merge the partial for the part of the log that follows this one."""
+        if later.start_time is None:
+            return self
+        if self.start_time is None:
+            self.start_time = later.start_time
+        self.stop_time = later.stop_time
+        self.max_search_difficulty = max(self.max_search_difficulty, later.max_search_difficulty)
+        for zeros, count in later.zeros_count.items():
+            self.zeros_count[zeros] = self.zeros_count.get(zeros, 0) + count
+        self.nonces += later.nonces
+        if self.buckets is not None and later.buckets is not None:
+            self.buckets.merge(later.buckets)
+        return self
+
+def parse_audit_line(line):
+    """Returns the (device, time, search difficulty, zeros) fields of an
+    audit line as they are written, None for any other line."""
+    roughmatch = roughmatch_fast.match(line)
+    if not roughmatch:
+        return None
+    finematch = finematch_fast.match(roughmatch.group(1))
+    if not finematch:
+        raise Exception("Bad line: %s" % (line.decode('utf-8', 'replace')))
+    return tuple(field.decode('ascii') for field in finematch.groups())
+
+def convert_fields(fields):
+    device, time, search_difficulty, zeros = fields
+    return (device, float(time), int(search_difficulty), int(zeros))
+
+def iter_audit_lines(buf, start, end):
+    """Yields the audit lines of buf which start in [start, end)."""
+    pos = buf.find(MARKER, start, end)
+    while pos >= 0:
+        line_start = buf.rfind(b'\n', 0, pos) + 1
+        line_end = buf.find(b'\n', pos)
+        if line_end < 0:
+            line_end = len(buf)
+        if line_start >= start:
+            yield buf[line_start:line_end]
+        pos = buf.find(MARKER, line_end, end)
+
+def chunk_bounds(buf, chunk_size=CHUNK_SIZE):
+    """Splits buf into (start, end) pairs of about chunk_size bytes that
+    begin and end at line boundaries."""
+    bounds = []
+    start = 0
+    size = len(buf)
+    while start < size:
+        end = buf.find(b'\n', min(start + chunk_size, size) - 1)
+        end = size if end < 0 else end + 1
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+def open_log(path):
+    """Memory maps a log, returns None for an empty file."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def scan_chunk(task):
+    path, start, end, records, bucket_seconds = task
+    buf = open_log(path)
+    try:
+        return scan_buffer(buf, start, end, records, bucket_seconds)
+    finally:
+        buf.close()
+
+def scan_buffer(buf, start, end, records=False, bucket_seconds=None):
+    """Scans the complete lines in buf[start:end], returns (AuditPartial,
+    records) like iter_chunks()."""
+    partial = AuditPartial(bucket_seconds)
+    found = []
+    matches = audit_line.findall(buf, start, end)
+    if len(matches) == buf[start:end].count(MARKER):
+        partial.add_matches(matches)
+        if callable(records):
+            return partial, records(matches)
+        if records:
+            found = [tuple(field.decode('ascii') for field in match) for match in matches]
+    else:
+        # a marker outside an audit line, or a bad audit line to report
+        for line in iter_audit_lines(buf, start, end):
+            fields = parse_audit_line(line)
+            if fields is not None:
+                partial.add(*convert_fields(fields))
+                if records:
+                    found.append(fields)
+    if callable(records):
+        return partial, records(found)
+    return partial, found
+
+def iter_chunks(path, processes=None, chunk_size=CHUNK_SIZE, records=False, bucket_seconds=None):
+    """Yields (AuditPartial, records) for each chunk of the log in file
+    order.  If asked for, records lists the fields of each audit line as
+    returned by parse_audit_line().  If records is a function it is called
+    in the scanning process with the list of fields, as bytes or strings,
+    and its result is yielded in place of the list.  With bucket_seconds
+    each AuditPartial carries per device BucketCounts for buckets of that
+    many seconds."""
+    buf = open_log(path)
+    if buf is None:
+        return
+    try:
+        bounds = chunk_bounds(buf, chunk_size)
+    finally:
+        buf.close()
+    tasks = [(path, start, end, records, bucket_seconds) for start, end in bounds]
+    if processes == 1 or len(tasks) == 1:
+        for task in tasks:
+            yield scan_chunk(task)
+        return
+    # fork where possible: average-hash-rate.py has no __main__ guard for
+    # spawned workers to import it by
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    pool = context.Pool(processes)
+    try:
+        for result in pool.imap(scan_chunk, tasks):
+            yield result
+    finally:
+        pool.terminate()
+
+def scan(path, processes=None, chunk_size=CHUNK_SIZE, bucket_seconds=None):
+    """Scans a whole log, returns its merged AuditPartial."""
+    total = AuditPartial(bucket_seconds)
+    for partial, _ in iter_chunks(path, processes, chunk_size, bucket_seconds=bucket_seconds):
+        total.merge(partial)
+    return total
@@ -0,0 +1,212 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import random
+
+from .harness import Benchmark, BenchmarkSkipped
+
+from ..load import crc
+from ..load import sha256
+from ..load import hf
+from ..protocol.frame import HF_Frame, FrameEncoder, opcodes, encode_frame, encode_frames
+from ..protocol.op_usb_init import decode_op_status_job_map
+
+# All inputs are derived from a fixed seed so that runs are comparable.
+SEED = 0x48465348
+
+def fixed_bytes(count, seed=SEED):
+  rnd = random.Random(seed)
+  return [rnd.randrange(256) for x in range(count)]
+
+def header_bytes(job, nonce):
+  return hf.int_to_lebytes(job['version'], 4) + job['previous block hash'] + job['merkle tree root'] + \
+    hf.int_to_lebytes(job['timestamp'], 4) + hf.int_to_lebytes(job['bits'], 4) + hf.int_to_lebytes(nonce, 4)
+
+def op_nonce_frame(die, sequence, nonces):
+  data = []
+  for nonce in nonces:
+    data += hf.reverse_every_four_bytes(hf.int_to_lebytes(nonce, 4)) + hf.int_to_lebytes(sequence, 2) + [0, 0]
+  return HF_Frame({'operation_code': opcodes['OP_NONCE'], 'chip_address': die, 'data': data}).framebytes
+
+def op_status_frame(die, sequence):
+  # 16 bytes of monitor data followed by a 96 core active/pending map
+  data = [0x80, 0x0a, 0xc0, 0, 0, 0, 0, 0] + fixed_bytes(24, seed=SEED + die)
+  return HF_Frame({'operation_code': opcodes['OP_STATUS'], 'chip_address': die, 'hdata': sequence, 'data': data}).framebytes
+
+def rx_stream():
+  # A representative receive burst: nonces and status from each of four die.
+  stream = []
+  for die in range(4):
+    stream += op_nonce_frame(die, 100 + die, [3184732951, 0x01234567])
+    stream += op_status_frame(die, 100 + die)
+  return stream
+
+def setup_cgminer_regen_hash():
+  eighty_bytes = header_bytes(hf.known_job(), 3184732951)
+  def op():
+    sha256.cgminer_regen_hash(eighty_bytes)
+  return op
+
+def setup_check_nonce_work():
+  job = hf.known_job()
+  def op():
+    hf.check_nonce_work(job, 3184732951)
+  return op
+
+def setup_crc8():
+  header = fixed_bytes(6)
+  def op():
+    crc.crc8(header)
+  return op
+
+def setup_crc8_header():
+  header = fixed_bytes(6)
+  hdata = header[3] | (header[4] << 8)
+  def op():
+    crc.crc8_header(header[0], header[1], header[2], hdata, header[5])
+  return op
+
+CRC32_BLOCK = 4096
+
+def crc32_setup(accumulate):
+  def setup():
+    data = bytearray(fixed_bytes(CRC32_BLOCK))
+    def op():
+      accumulate(crc.CRC_INITIAL, data)
+    return op
+  return setup
+
+def rx_stream_crc32():
+  # The same burst with a CRC32 after each frame's data, as on a serial line.
+  stream = []
+  for die in range(4):
+    for frame in [op_nonce_frame(die, 100 + die, [3184732951, 0x01234567]), op_status_frame(die, 100 + die)]:
+      stream += list(frame) + crc.crc32_to_bytelist(crc.crc32(frame[8:]))
+  return stream
+
+def setup_hf_parse_input_crc32():
+  stream = rx_stream_crc32()
+  def op():
+    parser = hf.HF_Parse(check_crc32=True)
+    parser.input(stream)
+    while parser.has_token():
+      parser.next_token()
+  return op
+
+def setup_hf_parse_input():
+  stream = rx_stream()
+  def op():
+    parser = hf.HF_Parse()
+    parser.input(stream)
+    while parser.has_token():
+      parser.next_token()
+  return op
+
+def setup_hf_frame_buildframe():
+  data = fixed_bytes(60)
+  def op():
+    HF_Frame({'operation_code': opcodes['OP_HASH'], 'chip_address': 2, 'core_address': 17, 'hdata': 4242, 'data': data})
+  return op
+
+def setup_encode_frame():
+  data = bytearray(fixed_bytes(60))
+  def op():
+    encode_frame(opcodes['OP_HASH'], 2, 17, 4242, data)
+  return op
+
+HASH_BATCH = 96
+
+def setup_encode_frames():
+  # one OP_HASH per core of a die into a reused buffer
+  data = bytearray(fixed_bytes(60))
+  frames = [(opcodes['OP_HASH'], 2, core, 4242 + core, data) for core in range(HASH_BATCH)]
+  encoder = FrameEncoder()
+  def op():
+    encode_frames(frames, encoder)
+  return op
+
+def setup_prepare_hf_hash_serial():
+  job = hf.known_job()
+  def op():
+    hf.prepare_hf_hash_serial(job, 32)
+  return op
+
+def setup_decode_op_status_job_map():
+  jobmap = fixed_bytes(24)
+  def op():
+    decode_op_status_job_map(jobmap, 96)
+  return op
+
+def jobregistry():
+  # The stratum proxy libraries need twisted and stratum, which may not be
+  # installed on a bench host.
+  try:
+    from ..mining_libs import jobs
+  except (ImportError, SyntaxError) as e:
+    raise BenchmarkSkipped("mining libraries not available: %s" % (e))
+  registry = jobs.JobRegistry(None, cmd='', no_midstate=True, real_target=False)
+  registry.set_extranonce('f8002c90', 4)
+  # BLOCK 125552 style broadcast with a short merkle branch
+  job = jobs.Job.build_from_broadcast('bench',
+    '4d16b6f85af6e2198f44ae2a6de67f78487ae5611b77c6c0440b921e00000000',
+    '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff20020862062f503253482f04b8864e5008',
+    '072f736c7573682f000000000100f2052a010000001976a914d23fcdf86f7e756a64a7a9688ef9903327048ed988ac00000000',
+    ['57351e8569cb9d036187a79fd1844fd930c1309efcd16c46af9bb9713b6ee734',
+     '936ab9c33420f187acae660fcdb07ffdffa081273674f0f41e6ecc1347451d23'],
+    '00000002', '1c2ac4af', '504e86b9')
+  registry.add_template(job, False)
+  return registry
+
+def setup_jobregistry_getwork():
+  registry = jobregistry()
+  def op():
+    registry.getwork()
+  return op
+
+GETWORK_BATCH = 96
+
+def setup_jobregistry_getwork_batch():
+  registry = jobregistry()
+  def op():
+    registry.getwork_batch(GETWORK_BATCH)
+  return op
+
+def benchmarks():
+  return [Benchmark('sha256.cgminer_regen_hash',      setup_cgminer_regen_hash,     nbytes=80),
+          Benchmark('check_nonce_work',               setup_check_nonce_work,       nbytes=80),
+          Benchmark('crc.crc8',                       setup_crc8,                   nbytes=6),
+          Benchmark('crc.crc8_header',                setup_crc8_header,            nbytes=6),
+          Benchmark('crc.crc32 table',                crc32_setup(crc.crcAccumulate_table),  nbytes=CRC32_BLOCK),
+          Benchmark('crc.crc32 slice4',               crc32_setup(crc.crcAccumulate_slice4), nbytes=CRC32_BLOCK),
+          Benchmark('crc.crc32 zlib',                 crc32_setup(crc.crcAccumulate_zlib),   nbytes=CRC32_BLOCK),
+          Benchmark('HF_Parse.input',                 setup_hf_parse_input,         nbytes=len(rx_stream())),
+          Benchmark('HF_Parse.input check_crc32',     setup_hf_parse_input_crc32,   nbytes=len(rx_stream_crc32())),
+          Benchmark('HF_Frame.buildframe',            setup_hf_frame_buildframe,    nbytes=68),
+          Benchmark('encode_frame',                   setup_encode_frame,           nbytes=68),
+          Benchmark('encode_frames x96',              setup_encode_frames,          nbytes=68 * HASH_BATCH),
+          Benchmark('prepare_hf_hash_serial',         setup_prepare_hf_hash_serial),
+          Benchmark('decode_op_status_job_map',       setup_decode_op_status_job_map),
+          Benchmark('JobRegistry.getwork',            setup_jobregistry_getwork),
+          Benchmark('JobRegistry.getwork_batch x96',  setup_jobregistry_getwork_batch)]
@@ -0,0 +1,148 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import platform
+import sys
+import time
+
+# Fix: time.perf_counter is Python 3 only.
+clock = getattr(time, 'perf_counter', time.time)
+
+PERCENTILES = [50, 90, 99]
+
+class Benchmark():
+  # setup() is called once and returns the callable that is timed.  When
+  # nbytes is given, throughput is also reported in MB/s.
+  def __init__(self, name, setup, nbytes=None):
+    self.name = name
+    self.setup = setup
+    self.nbytes = nbytes
+
+class BenchmarkSkipped(Exception):
+  pass
+
+def percentile(samples, pct):
+  assert len(samples) > 0
+  assert pct >= 0 and pct <= 100
+  ordered = sorted(samples)
+  index = int(round((pct / 100.0) * (len(ordered) - 1)))
+  return ordered[index]
+
+# Very short operations are timed in batches of 'inner' calls so that the
+# clock overhead does not dominate; latencies are reported per call.
+def calibrate(op, target=20e-6, max_inner=10**4):
+  inner = 1
+  while inner < max_inner:
+    t0 = clock()
+    for i in range(inner):
+      op()
+    if clock() - t0 >= target:
+      break
+    inner *= 2
+  return inner
+
+def run_benchmark(bench, min_time=1.0, min_samples=10, warmup=3):
+  op = bench.setup()
+  for i in range(warmup):
+    op()
+  inner = calibrate(op)
+  loop = range(inner)
+  samples = []
+  start = clock()
+  elapsed = 0
+  while elapsed < min_time or len(samples) < min_samples:
+    t0 = clock()
+    for i in loop:
+      op()
+    t1 = clock()
+    samples.append((t1 - t0) / inner)
+    elapsed = t1 - start
+  ops = len(samples) * inner
+  total = sum(samples) * inner
+  result = {'name':      bench.name,
+            'ops':       ops,
+            'inner':     inner,
+            'total':     total,
+            'ops_sec':   ops / total if total > 0 else 0.0,
+            'mean_us':   10**6 * total / ops,
+            'min_us':    10**6 * min(samples),
+            'max_us':    10**6 * max(samples)}
+  for pct in PERCENTILES:
+    result['p{}_us'.format(pct)] = 10**6 * percentile(samples, pct)
+  if bench.nbytes is not None:
+    result['mb_sec'] = (bench.nbytes * ops) / total / 10**6 if total > 0 else 0.0
+  return result
+
+def run_benchmarks(benchmarks, min_time=1.0, printer=None):
+  results = {'python':    platform.python_version(),
+             'platform':  platform.platform(),
+             'time':      time.time(),
+             'benchmarks': {},
+             'skipped':   {}}
+  for bench in benchmarks:
+    try:
+      result = run_benchmark(bench, min_time=min_time)
+    except BenchmarkSkipped as e:
+      results['skipped'][bench.name] = str(e)
+      if printer is not None:
+        printer("{0:32s} skipped: {1}".format(bench.name, e))
+      continue
+    results['benchmarks'][bench.name] = result
+    if printer is not None:
+      printer(format_result(result))
+  return results
+
+def format_result(result):
+  string = "{0:32s} {1:12.1f} ops/s  p50 {2:9.2f} us  p90 {3:9.2f} us  p99 {4:9.2f} us".format(
+    result['name'], result['ops_sec'], result['p50_us'], result['p90_us'], result['p99_us'])
+  if 'mb_sec' in result:
+    string += "  {0:8.2f} MB/s".format(result['mb_sec'])
+  return string
+
+def save_results(results, filename):
+  with open(filename, 'w') as f:
+    json.dump(results, f, indent=2, sort_keys=True)
+
+def load_results(filename):
+  with open(filename, 'r') as f:
+    return json.load(f)
+
+# Compares ops/sec against a stored baseline.  A benchmark regresses when it
+# runs slower than (1 - tolerance) times the baseline rate.  Benchmarks that
+# are missing from either side are ignored.
+def compare_results(results, baseline, tolerance=0.10):
+  assert tolerance >= 0 and tolerance < 1
+  regressions = []
+  for name, result in sorted(results['benchmarks'].items()):
+    if name not in baseline['benchmarks']:
+      continue
+    base = baseline['benchmarks'][name]
+    if base['ops_sec'] <= 0:
+      continue
+    ratio = result['ops_sec'] / base['ops_sec']
+    if ratio < (1.0 - tolerance):
+      regressions.append({'name': name, 'ops_sec': result['ops_sec'], 'baseline_ops_sec': base['ops_sec'], 'ratio': ratio})
+  return regressions
@@ -25,6 +25,8 @@
 
 # Fix: Need to indicate that this is a Python3 library.
 
+import zlib
+
 class CRC_Error(Exception):
     pass
 
@@ -45,12 +47,23 @@ def build_crc8_table():
 
 crc8_table = build_crc8_table()
 
-def crc8(bytes):
+# Works on lists of ints as well as bytes and bytearray.
+def crc8(bytes, table=crc8_table):
     crc = 0xff
     for byte in bytes:
-        crc = crc8_table[crc ^ byte]
+        crc = table[crc ^ byte]
     return crc
 
+# Fast path for the six bytes covered by a frame header crc8, unrolled so
+# that frame building does not have to assemble a list first.
+def crc8_header(operation_code, chip_address, core_address, hdata, data_length_field, table=crc8_table):
+    crc = table[0xff ^ operation_code]
+    crc = table[crc ^ chip_address]
+    crc = table[crc ^ core_address]
+    crc = table[crc ^ (hdata & 0xff)]
+    crc = table[crc ^ ((hdata >> 8) & 0xff)]
+    return table[crc ^ data_length_field]
+
 # The crc32_table was almost directly copied from tools/utils/crc.c with this comment:
 # /*
 #    The crc produced by this function is bit-reversed from my standard
@@ -130,12 +143,59 @@ crc32_table = [0x00000000, 0x04c11db7, 0x09823b6e, 0x0d4326d9,
 
 CRC_INITIAL = 0xffffffff
 
-def crcAccumulate(crc, bytes):
+# Reference implementation, one table lookup per byte.
+def crcAccumulate_table(crc, bytes):
     newcrc = crc
     for byte in bytes:
         newcrc = crc32_table[((newcrc >> 24) ^ byte) & 0xff] ^ ((newcrc << 8) & 0xffffffff)
     return newcrc
 
+# Slice-by-4: crc32_slice_tables[k][i] is the crc of byte i followed by k
+# zero bytes, so four input bytes cost four lookups and one xor chain.
+def build_crc32_slice_tables(n=4):
+    tables = [crc32_table]
+    for k in range(1, n):
+        last = tables[-1]
+        tables.append([((last[i] << 8) & 0xffffffff) ^ crc32_table[last[i] >> 24] for i in range(256)])
+    return tables
+
+crc32_slice_tables = build_crc32_slice_tables()
+
+def crcAccumulate_slice4(crc, bytes):
+    t0, t1, t2, t3 = crc32_slice_tables
+    data = bytearray(bytes)
+    end = len(data) - (len(data) % 4)
+    newcrc = crc
+    for i in range(0, end, 4):
+        newcrc ^= (data[i] << 24) | (data[i+1] << 16) | (data[i+2] << 8) | data[i+3]
+        newcrc = t3[newcrc >> 24] ^ t2[(newcrc >> 16) & 0xff] ^ t1[(newcrc >> 8) & 0xff] ^ t0[newcrc & 0xff]
+    return crcAccumulate_table(newcrc, data[end:])
+
+# This crc is CRC-32/MPEG-2: polynomial 0x04c11db7, not reflected, no final
+# xor.  zlib computes the reflected form of the same polynomial, so feeding
+# it bit-reversed bytes and bit-reversing the state in and out gives the same
+# result at C speed.
+def bit_reverse(value, bits):
+    result = 0
+    for i in range(bits):
+        result = (result << 1) | ((value >> i) & 1)
+    return result
+
+bit_reverse_list = [bit_reverse(i, 8) for i in range(256)]
+# translate() table, str on Python 2 and bytes on Python 3
+bit_reverse_table = bytes(bytearray(bit_reverse_list))
+
+def bit_reverse32(value):
+    rev = bit_reverse_list
+    return (rev[value & 0xff] << 24) | (rev[(value >> 8) & 0xff] << 16) | (rev[(value >> 16) & 0xff] << 8) | rev[value >> 24]
+
+def crcAccumulate_zlib(crc, bytes):
+    data = bytearray(bytes).translate(bit_reverse_table)
+    reflected = zlib.crc32(data, bit_reverse32(crc) ^ 0xffffffff) & 0xffffffff
+    return bit_reverse32(reflected ^ 0xffffffff)
+
+crcAccumulate = crcAccumulate_zlib
+
 def crc32(bytes):
     return crcAccumulate(CRC_INITIAL, bytes)
 
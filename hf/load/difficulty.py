@@ -0,0 +1,89 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import math
+import time
+
+# OP_HASH search difficulty bounds.  Below about 24 bits the die spends more
+# time reporting nonces than hashing.
+MIN_SEARCH_DIFFICULTY = 24
+MAX_SEARCH_DIFFICULTY = 48
+
+# Largest change in one adjustment, in bits.
+MAX_STEP = 4
+
+class DifficultyController():
+  # Chooses the OP_HASH search difficulty for each die so that it returns
+  # about target_rate nonces per second.  Every interval seconds the nonce
+  # rate seen since the last adjustment moves the difficulty by the nearest
+  # whole number of bits, so rates within a factor of sqrt(2) of the target
+  # leave it alone.  ceiling, if given, is called for an upper bound, e.g.
+  # the zero bits of the pool share target when mining, so that the die
+  # never filters out a share.
+  #
+  # The state lives in the die stats: 'search_difficulty' is the current
+  # value, and each work item records the difficulty it was sent with so
+  # hashes are credited at the right rate across changes.
+  def __init__(self, target_rate=10.0, interval=8.0, min_difficulty=MIN_SEARCH_DIFFICULTY,
+               max_difficulty=MAX_SEARCH_DIFFICULTY, ceiling=None):
+    assert target_rate > 0
+    assert min_difficulty >= 0 and min_difficulty <= max_difficulty and max_difficulty < 256
+    self.target_rate = target_rate
+    self.interval = interval
+    self.min_difficulty = min_difficulty
+    self.max_difficulty = max_difficulty
+    self.ceiling = ceiling
+
+  def clamp(self, difficulty):
+    high = self.max_difficulty
+    if self.ceiling is not None:
+      high = min(high, self.ceiling())
+    return max(min(difficulty, high), min(self.min_difficulty, high))
+
+  def adjust(self, difficulty, nonces, elapsed):
+    rate = nonces / elapsed
+    if rate == 0:
+      step = -1
+    else:
+      step = int(round(math.log(rate / self.target_rate, 2)))
+      step = max(-MAX_STEP, min(step, MAX_STEP))
+    return difficulty + step
+
+  def search_difficulty(self, this_die, now=None):
+    if now is None:
+      now = time.time()
+    if 'difficulty_time' not in this_die:
+      this_die['difficulty_time'] = now
+      this_die['difficulty_nonces'] = this_die['nonces']
+    else:
+      elapsed = now - this_die['difficulty_time']
+      if elapsed >= self.interval:
+        nonces = this_die['nonces'] - this_die['difficulty_nonces']
+        this_die['search_difficulty'] = self.adjust(this_die['search_difficulty'], nonces, elapsed)
+        this_die['difficulty_time'] = now
+        this_die['difficulty_nonces'] = this_die['nonces']
+    # the ceiling can drop at any time, e.g. when the pool lowers difficulty
+    this_die['search_difficulty'] = self.clamp(this_die['search_difficulty'])
+    return this_die['search_difficulty']
@@ -23,8 +23,11 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import binascii
 import ctypes
+import hashlib
 import random
+import struct
 import sys
 import time
 
@@ -83,6 +86,7 @@ class Send():
     self.talkusb = talkusb
     self.queue = []
     self.max_send = self.talkusb(SEND_MAX, None, 0)
+    self.bytes_sent = 0
 
   # Fix: Maybe schedule -> send, and send -> transmit.
   def schedule(self, byteslist):
@@ -92,11 +96,17 @@ class Send():
       self.queue = self.queue + byteslist
 
   def send(self, byteslist):
-    assert len(byteslist) == 0 or {x >= 0 and x < 256 for x in byteslist} == set([True])
+    # Encoded frames (bytes, bytearray, or a memoryview of one, e.g. from
+    # pack_frame_into()) are in range by construction and are sliced as
+    # they are; lists of ints are checked and copied.
+    if isinstance(byteslist, (bytes, bytearray, memoryview)):
+      mybyteslist = byteslist
+    else:
+      assert len(byteslist) == 0 or {x >= 0 and x < 256 for x in byteslist} == set([True])
+      mybyteslist = list(byteslist)
 #        if byteslist != None and len(byteslist) > 0:
 #            self.queue = self.queue + byteslist
     sendsize = 0
-    mybyteslist = list(byteslist)
     while len(mybyteslist) > 0:
       sendsize = min(self.max_send, len(mybyteslist))
 #            sendstuff = ctypes.create_string_buffer(bytes(mybyteslist[0:sendsize]))
@@ -105,11 +115,17 @@ class Send():
 #            print("Send:send(): Queue: %d bytes  Sending %d bytes. Bytes: %s"
 #                  % (len(self.queue), sendsize, ["0x%02x" % (x) for x in self.queue[0:sendsize]]))
       while len(sendstuff) > 0:
-        sendstuff_package = list(sendstuff) #ctypes.create_string_buffer(bytes(sendstuff))
+        if isinstance(sendstuff, memoryview):
+          sendstuff_package = sendstuff.tobytes()
+        elif isinstance(sendstuff, (bytes, bytearray)):
+          sendstuff_package = sendstuff
+        else:
+          sendstuff_package = list(sendstuff) #ctypes.create_string_buffer(bytes(sendstuff))
         rslt = self.talkusb(SEND, sendstuff_package, sendsize)
         if rslt > 0:
 #                self.queue = self.queue[rslt:]
           sendstuff = sendstuff[rslt:]
+          self.bytes_sent += rslt
         elif rslt == 0:
           pass
         else:
@@ -151,6 +167,7 @@ class Receive():
     self.talkusb = talkusb
     self.queue = []
     self.max_receive = self.talkusb(RECEIVE_MAX, None, 0)
+    self.bytes_received = 0
 
   def receive(self):
 #        print("Receive:receive() called.")
@@ -168,6 +185,7 @@ class Receive():
 #            print("Receive:receive(): got %d bytes" % (rslt))
       if rslt > 0:
         self.queue = self.queue + list(buf[0:rslt])
+        self.bytes_received += rslt
         break
       elif rslt == 0:
         pass
@@ -188,9 +206,13 @@ class Garbage():
 
 # Fix: Returns a full frame or garbage that could not be parsed.
 class HF_Parse():
-  def __init__(self):
+  # check_crc32 expects four little-endian CRC32 bytes after the frame data,
+  # as sent on the serial line, and turns frames that fail it into Garbage.
+  def __init__(self, check_crc32=False):
     self.state = 'out of sync'
     self.tokens = []
+    self.check_crc32 = check_crc32
+    self.crc32_errors = 0
     self.clear_frame()
 
   def clear_frame(self):
@@ -198,8 +220,7 @@ class HF_Parse():
     self.frame_header = []
     self.data_length = 0
     self.frame_data = []
-    # Fix: Restore when using serial line directly
-    # self.frame_crc32 = []
+    self.frame_crc32 = []
 
   def tokenize_frame(self, bytes):
     next_token = None
@@ -232,7 +253,8 @@ class HF_Parse():
         if len(self.frame_header) < 7:
           self.frame_header = self.frame_header + [byte]
         elif len(self.frame_header) == 7:
-          if byte == crc.crc8(self.frame_header[1:]):
+          header = self.frame_header
+          if byte == crc.crc8_header(header[1], header[2], header[3], header[4] | (header[5] << 8), header[6]):
             self.frame_header = self.frame_header + [byte]
             self.data_length = 4 * self.frame_header[6]
             if self.data_length == 0:
@@ -255,35 +277,33 @@ class HF_Parse():
                        "should be possible." % (len(self.frame)))
       elif self.state == 'parsing data':
         self.frame_data = self.frame_data + [byte]
-        # Fix: Restore when using serial line directly
-#                if len(self.frame_data) == self.data_length:
-#                    self.state = 'reading CRC32'
-#                if len(self.frame_data) == self.data_length:
-#                    self.state = 'reading CRC32'
-        # Fix: This should be removed when using CRC32 check again.
         if len(self.frame_data) == self.data_length:
-          next_token = self.tokenize_frame(self.frame_header + self.frame_data)
-          self.tokens = self.tokens + [next_token]
-          self.clear_frame()
-          self.state = 'next frame'
+          if self.check_crc32:
+            self.state = 'reading CRC32'
+          else:
+            next_token = self.tokenize_frame(self.frame_header + self.frame_data)
+            self.tokens = self.tokens + [next_token]
+            self.clear_frame()
+            self.state = 'next frame'
         elif len(self.frame_data) > self.data_length:
           raise HF_InternalError("Length of self.frame_data (%d) > self.data_length (%d)" %
                        (len(self.frame_data), self.data_length))
-        # Fix: Restore when using serial line directly
-#            elif self.state == 'reading CRC32':
-#                self.frame_crc32 = self.frame_crc32 + [byte]
-#                if len(self.frame_crc32) == 4:
-#                    expected_crc32 = crc.crc32_to_bytelist(crc.crc32(self.frame_data))
-#                    if self.frame_crc32 == expected_crc32:
-#                        self.tokens = self.tokens + [HF_Frame(self.frame_header + self.frame_data + self.frame_crc32)]
-#                        self.clear_frame()
-#                        self.state = 'next frame'
-#                    else:
-#                        self.tokens = self.tokens + [Garbage(self.frame_header + self.frame_data + self.frame_crc32)]
-#                        self.clear_frame()
-#                        self.state = 'out of sync'
-#                elif len(self.frame_crc32) > 4:
-#                    raise HF_InternalError("%d bytes in CRC32 field.  Should not happen." % (len(self.frame_crc32)))
+      elif self.state == 'reading CRC32':
+        self.frame_crc32 = self.frame_crc32 + [byte]
+        if len(self.frame_crc32) == 4:
+          expected_crc32 = crc.crc32_to_bytelist(crc.crc32(self.frame_data))
+          if self.frame_crc32 == expected_crc32:
+            # the protocol classes parse header and data only
+            self.tokens = self.tokens + [self.tokenize_frame(self.frame_header + self.frame_data)]
+            self.clear_frame()
+            self.state = 'next frame'
+          else:
+            self.crc32_errors += 1
+            self.tokens = self.tokens + [Garbage(self.frame_header + self.frame_data + self.frame_crc32)]
+            self.clear_frame()
+            self.state = 'out of sync'
+        elif len(self.frame_crc32) > 4:
+          raise HF_InternalError("%d bytes in CRC32 field.  Should not happen." % (len(self.frame_crc32)))
       elif self.state == 'next frame':
         if byte == 0xaa:
           self.frame_header = [0xaa]
@@ -394,18 +414,45 @@ def det_job(rnd, amount=32):
   job['library_number'] = library_number
   return job
 
-def check_nonce_work(job, nonce):
-  assert check_job(job)
+# A job covers nonces from 'starting nonce' for 'nonce loops' nonces, or all
+# 2^32 of them when 'nonce loops' is 0.
+def nonce_in_range(job, nonce):
+  if job['nonce loops'] == 0:
+    return True
+  return ((nonce - job['starting nonce']) % 2**32) < job['nonce loops']
+
+# version, previous block hash, merkle tree root, timestamp, bits, nonce
+header_struct = struct.Struct('<I32s32sIII')
+
+# The 80 byte block header for a nonce.  ntime_offset is
+# hf_candidate_nonce.ntime_offset, the number of times the core rolled ntime
+# before finding the nonce.
+def nonce_header(job, nonce, ntime_offset=0):
   assert nonce >= 0 and nonce < 4294967296 # 32 bits
-  feed_to_regen_hash = int_to_lebytes(job['version'], 4) + \
-    job['previous block hash'] + \
-    job['merkle tree root'] + \
-    int_to_lebytes(job['timestamp'], 4) + \
-    int_to_lebytes(job['bits'], 4) + \
-    int_to_lebytes(nonce, 4)
-  regen_hash = sha256.cgminer_regen_hash(feed_to_regen_hash)
-  regen_hash_expanded = list(regen_hash)
-  zerobits = count_leading_zeros(regen_hash_expanded)
+  assert ntime_offset >= 0 and job['timestamp'] + ntime_offset < 4294967296
+  return header_struct.pack(job['version'], bytes(bytearray(job['previous block hash'])),
+                            bytes(bytearray(job['merkle tree root'])), job['timestamp'] + ntime_offset,
+                            job['bits'], nonce)
+
+# Double SHA-256 of the header, the same bytes as sha256.cgminer_regen_hash()
+# but computed by hashlib.
+def nonce_hash(job, nonce, ntime_offset=0):
+  return hashlib.sha256(hashlib.sha256(nonce_header(job, nonce, ntime_offset)).digest()).digest()
+
+# The hash as a 256 bit little endian integer, for comparing with a pool
+# target.
+def hash_value(hash_bin):
+  return int(binascii.hexlify(hash_bin[::-1]), 16)
+
+# Same as count_leading_zeros() on the hash bytes.
+def hash_zero_bits(hash_bin):
+  return 256 - hash_value(hash_bin).bit_length()
+
+def check_nonce_work(job, nonce, ntime_offset=0):
+  assert check_job(job)
+  regen_hash = nonce_hash(job, nonce, ntime_offset)
+  regen_hash_expanded = list(bytearray(regen_hash))
+  zerobits = hash_zero_bits(regen_hash)
   return [zerobits, regen_hash_expanded]
 
 def check_job(job):
@@ -0,0 +1,256 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import cProfile
+import pstats
+import signal
+import time
+
+from bisect import bisect_left
+
+try:
+  # python 3
+  from io import StringIO
+except ImportError:
+  # python 2
+  from StringIO import StringIO
+
+from ..protocol.frame import opnames
+
+# Fix: time.perf_counter is Python 3 only.
+clock = getattr(time, 'perf_counter', time.time)
+
+# Bucket upper bounds in seconds: 1 us doubling up to about 8 s.
+DEFAULT_BOUNDS = [10**-6 * 2**i for i in range(24)]
+
+# Phases of BaseRoutine.one_cycle() that are timed.  'hash' is building one
+# OP_HASH frame, 'send' one USB write, which for OP_HASH carries a batch of
+# frames, and 'cycle' is the whole of one_cycle().
+PHASES = ['receive', 'parse', 'nonce', 'status', 'hash', 'send', 'cycle']
+
+class Histogram():
+  # Fixed buckets and a preallocated count list, so recording a value is a
+  # bisect and an increment.
+  def __init__(self, bounds=DEFAULT_BOUNDS):
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def record(self, value):
+    self.counts[bisect_left(self.bounds, value)] += 1
+    self.count += 1
+    self.total += value
+    if value > self.max:
+      self.max = value
+
+  def reset(self):
+    for i in range(len(self.counts)):
+      self.counts[i] = 0
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def mean(self):
+    if self.count == 0:
+      return 0.0
+    return self.total / self.count
+
+  # Returns the upper bound of the bucket holding the percentile (capped at
+  # the largest value seen), so the result is an overestimate by at most one
+  # bucket, a factor of two.
+  def percentile(self, pct):
+    assert pct >= 0 and pct <= 100
+    if self.count == 0:
+      return 0.0
+    rank = pct / 100.0 * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank and count > 0:
+        if i < len(self.bounds):
+          return min(self.bounds[i], self.max)
+        return self.max
+    return self.max
+
+def timed(function, histogram):
+  def wrapper(*args, **kwargs):
+    t0 = clock()
+    try:
+      return function(*args, **kwargs)
+    finally:
+      histogram.record(clock() - t0)
+  wrapper.instrumented = True
+  return wrapper
+
+class Instrumentation():
+  def __init__(self, profile_every=0):
+    assert profile_every >= 0
+    self.histograms = dict((phase, Histogram()) for phase in PHASES)
+    self.frames_in = [0] * 256
+    self.frames_out = [0] * 256
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.cycles = 0
+    self.start = time.time()
+    # cProfile sampling: profile one cycle in every profile_every cycles.
+    self.profile_every = profile_every
+    self.profile = None
+    if profile_every > 0:
+      self.profile = cProfile.Profile()
+    self.dump_requested = False
+
+  # Wraps the routine's phases with timers.  This is called again from
+  # BaseRoutine.defaults(), which builds a new parser, transmitter and
+  # receiver, so the per-object wrappers need reapplying but the routine's
+  # own methods are only wrapped once.
+  def attach(self, routine):
+    self.routine = routine
+    hist = self.histograms
+    routine.receiver.receive = timed(routine.receiver.receive, hist['receive'])
+    routine.parser.input = self.wrap_parse(routine.parser.input, hist['parse'])
+    routine.parser.tokenize_frame = self.wrap_tokenize(routine.parser.tokenize_frame)
+    routine.transmitter.send = self.wrap_send(routine.transmitter.send, hist['send'])
+    if not getattr(routine.process_op_nonce, 'instrumented', False):
+      routine.process_op_nonce = timed(routine.process_op_nonce, hist['nonce'])
+      routine.process_op_status = timed(routine.process_op_status, hist['status'])
+      routine.action_op_hash = timed(routine.action_op_hash, hist['hash'])
+      routine.one_cycle = self.wrap_cycle(routine.one_cycle, hist['cycle'])
+
+  def wrap_parse(self, function, histogram):
+    def wrapper(rawbytes):
+      self.bytes_in += len(rawbytes)
+      t0 = clock()
+      try:
+        return function(rawbytes)
+      finally:
+        histogram.record(clock() - t0)
+    return wrapper
+
+  def wrap_tokenize(self, function):
+    def wrapper(bytes):
+      self.frames_in[bytes[1]] += 1
+      return function(bytes)
+    return wrapper
+
+  def wrap_send(self, function, histogram):
+    def wrapper(byteslist):
+      self.count_frames_out(byteslist)
+      self.bytes_out += len(byteslist)
+      t0 = clock()
+      try:
+        return function(byteslist)
+      finally:
+        histogram.record(clock() - t0)
+    return wrapper
+
+  # A write may hold several frames back to back, e.g. a batch of OP_HASH.
+  def count_frames_out(self, byteslist):
+    offset = 0
+    while offset + 8 <= len(byteslist) and byteslist[offset] == 0xaa:
+      self.frames_out[byteslist[offset + 1]] += 1
+      offset += 8 + 4 * byteslist[offset + 6]
+
+  def wrap_cycle(self, function, histogram):
+    def wrapper(*args, **kwargs):
+      self.cycles += 1
+      profile = None
+      if self.profile is not None and self.cycles % self.profile_every == 0:
+        profile = self.profile
+      t0 = clock()
+      try:
+        if profile is not None:
+          profile.enable()
+        return function(*args, **kwargs)
+      finally:
+        if profile is not None:
+          profile.disable()
+        histogram.record(clock() - t0)
+        if self.dump_requested:
+          self.dump_requested = False
+          self.report(self.routine.printer)
+    wrapper.instrumented = True
+    return wrapper
+
+  # The handler only sets a flag; the summary is printed by the hashing
+  # thread at the end of the current cycle.  Must be called from the main
+  # thread.
+  def install_signal(self, signum=signal.SIGUSR1):
+    def handler(signum, frame):
+      self.dump_requested = True
+    signal.signal(signum, handler)
+
+  def reset(self):
+    for histogram in self.histograms.values():
+      histogram.reset()
+    for i in range(256):
+      self.frames_in[i] = 0
+      self.frames_out[i] = 0
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.cycles = 0
+    self.start = time.time()
+    if self.profile is not None:
+      self.profile = cProfile.Profile()
+
+  def summary_lines(self):
+    elapsed = max(time.time() - self.start, 10**-6)
+    lines = ["Instrumentation: {0:d} cycles in {1:.1f} sec".format(self.cycles, elapsed)]
+    lines.append("{0:8s} {1:>10s} {2:>10s} {3:>10s} {4:>10s} {5:>10s} {6:>10s} {7:>8s}".format(
+      'phase', 'count', 'mean us', 'p50 us', 'p90 us', 'p99 us', 'max us', 'total s'))
+    for phase in PHASES:
+      h = self.histograms[phase]
+      lines.append("{0:8s} {1:10d} {2:10.1f} {3:10.1f} {4:10.1f} {5:10.1f} {6:10.1f} {7:8.2f}".format(
+        phase, h.count, 10**6 * h.mean(), 10**6 * h.percentile(50), 10**6 * h.percentile(90),
+        10**6 * h.percentile(99), 10**6 * h.max, h.total))
+    lines.append("bytes in: {0:d} ({1:.1f} B/s)  bytes out: {2:d} ({3:.1f} B/s)".format(
+      self.bytes_in, self.bytes_in / elapsed, self.bytes_out, self.bytes_out / elapsed))
+    for direction, frames in (('in', self.frames_in), ('out', self.frames_out)):
+      counts = ["{0} {1:d}".format(opnames.get(op, op), count) for op, count in enumerate(frames) if count > 0]
+      lines.append("frames {0}: {1}".format(direction, ", ".join(counts)))
+    return lines
+
+  def profile_lines(self, limit=20, sort='cumulative'):
+    if self.profile is None:
+      return []
+    stream = StringIO()
+    try:
+      stats = pstats.Stats(self.profile, stream=stream)
+    except TypeError:
+      # no samples yet
+      return []
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue().splitlines()
+
+  def report(self, printer):
+    for line in self.summary_lines():
+      printer(line)
+    for line in self.profile_lines():
+      printer(line)
+
+  def dump_profile(self, filename):
+    if self.profile is not None:
+      self.profile.dump_stats(filename)
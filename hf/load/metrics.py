@@ -0,0 +1,169 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import time
+
+try:
+  # python 3
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+  # python 2
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (metric name, stats key, type, help)
+ROUTINE_METRICS = [
+  ('hf_hashes_total',               'hashes',   'counter', 'Hashes credited from valid nonces.'),
+  ('hf_hashrate_hashes_per_second', 'hashrate', 'gauge',   'Average hashrate since the test started.'),
+  ('hf_nonces_total',               'nonces',   'counter', 'Valid nonces returned.'),
+  ('hf_lhw_total',                  'lhw',      'counter', 'Nonces that failed the difficulty check.'),
+  ('hf_dhw_total',                  'dhw',      'counter', 'Deterministic solutions that were never returned.'),
+  ('hf_chw_total',                  'chw',      'counter', 'Nonces with an unknown sequence number.'),
+  ('hf_stale_total',                'stale',    'counter', 'Nonces for work dropped by a work restart.')]
+
+DIE_METRICS = [
+  ('hf_die_hashrate_hashes_per_second', 'hashrate',     'gauge',   'Average die hashrate since the test started.'),
+  ('hf_die_nonces_total',               'nonces',       'counter', 'Valid nonces returned by the die.'),
+  ('hf_die_lhw_total',                  'lhw',          'counter', 'Die nonces that failed the difficulty check.'),
+  ('hf_die_dhw_total',                  'dhw',          'counter', 'Die deterministic solutions that were never returned.'),
+  ('hf_die_chw_total',                  'chw',          'counter', 'Die nonces with an unknown sequence number.'),
+  ('hf_die_stale_total',                'stale',        'counter', 'Die nonces for work dropped by a work restart.'),
+  ('hf_die_temperature_celsius',        'temperature',  'gauge',   'Die temperature from the last OP_STATUS.'),
+  ('hf_die_core_voltage_volts',         'core_voltage', 'gauge',   'Die core voltage from the last OP_STATUS.'),
+  ('hf_die_active_cores',               'active',       'gauge',   'Active cores in the last OP_STATUS core map.'),
+  ('hf_die_pending_cores',              'pending',      'gauge',   'Pending cores in the last OP_STATUS core map.'),
+  ('hf_die_outstanding_jobs',           'jobs',         'gauge',   'Work items sent to the die and still tracked.'),
+  ('hf_die_throttle_cores',             'throttle',     'gauge',   'Idle cores the thermal controller leaves without work.'),
+  ('hf_die_search_difficulty_bits',     'search_difficulty', 'gauge', 'OP_HASH search difficulty for new work.')]
+
+def format_value(value):
+  if value is None:
+    return 'NaN'
+  return repr(float(value))
+
+def render_metrics(routine):
+  lines = []
+  def family(name, kind, help):
+    lines.append('# HELP {0} {1}'.format(name, help))
+    lines.append('# TYPE {0} {1}'.format(name, kind))
+
+  for name, key, kind, help in ROUTINE_METRICS:
+    family(name, kind, help)
+    lines.append('{0} {1}'.format(name, format_value(routine.stats[key])))
+
+  # dies is truncated to the dies present once OP_USB_INIT arrives
+  dies = list(routine.dies[:routine.number_of_die])
+  for name, key, kind, help in DIE_METRICS:
+    family(name, kind, help)
+    for this_die in dies:
+      lines.append('{0}{{die="{1:d}"}} {2}'.format(name, this_die['die'], format_value(this_die[key])))
+  family('hf_die_moving_hashrate_hashes_per_second', 'gauge', 'Die hashrate over the last moving interval.')
+  for this_die in dies:
+    moving = this_die['moving']
+    value = moving[-1]['hashrate'] if moving else None
+    lines.append('hf_die_moving_hashrate_hashes_per_second{{die="{0:d}"}} {1}'.format(this_die['die'], format_value(value)))
+
+  # transport counters restart from zero when the routine restarts
+  family('hf_usb_bytes_sent_total', 'counter', 'Bytes written to the USB transport.')
+  lines.append('hf_usb_bytes_sent_total {0}'.format(format_value(routine.transmitter.bytes_sent)))
+  family('hf_usb_bytes_received_total', 'counter', 'Bytes read from the USB transport.')
+  lines.append('hf_usb_bytes_received_total {0}'.format(format_value(routine.receiver.bytes_received)))
+
+  family('hf_state', 'gauge', 'Current routine state.')
+  lines.append('hf_state{{state="{0}"}} 1'.format(routine.global_state))
+  family('hf_snapshot_timestamp_seconds', 'gauge', 'Time the metrics snapshot was taken.')
+  lines.append('hf_snapshot_timestamp_seconds {0}'.format(format_value(time.time())))
+  return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] not in ['/', '/metrics']:
+      self.send_error(404)
+      return
+    body = self.server.exporter.snapshot.encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class MetricsExporter():
+  # Serves Prometheus text metrics for a routine.  A refresh thread renders
+  # the routine state into a cached string every interval seconds; requests
+  # only ever read that string, so a scrape never touches the routine or
+  # holds up the hashing loop.
+  # collectors are functions returning further lines of metrics text, e.g.
+  # PoolManager.metrics_lines.
+  def __init__(self, routine, port, host='127.0.0.1', interval=2.0, printer=None, collectors=None):
+    self.routine = routine
+    self.collectors = collectors or []
+    self.host = host
+    self.port = port
+    self.interval = interval
+    self.printer = printer
+    self.snapshot = ''
+    self.running = False
+    self.server = None
+
+  def refresh(self):
+    try:
+      snapshot = render_metrics(self.routine)
+      for collector in self.collectors:
+        snapshot += '\n'.join(collector()) + '\n'
+      self.snapshot = snapshot
+    except (RuntimeError, KeyError, IndexError, AttributeError) as e:
+      # the hashing thread changed the routine under us, e.g. during a
+      # restart; keep the last snapshot and try again next interval
+      if self.printer is not None:
+        self.printer("Metrics snapshot skipped: %s" % (e))
+
+  def refresher(self):
+    while self.running:
+      self.refresh()
+      time.sleep(self.interval)
+
+  def start(self):
+    self.refresh()
+    self.server = HTTPServer((self.host, self.port), MetricsHandler)
+    self.server.exporter = self
+    self.running = True
+    for target in [self.refresher, self.server.serve_forever]:
+      thread = threading.Thread(target=target)
+      thread.daemon = True
+      thread.start()
+    if self.printer is not None:
+      self.printer("Serving metrics on http://%s:%d/metrics" % (self.host, self.port))
+
+  def stop(self):
+    self.running = False
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
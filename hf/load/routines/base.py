@@ -35,11 +35,14 @@ from ..hf import Send, Receive
 from ..hf import HF_Parse, Garbage
 from ..hf import SHUTDOWN
 from ..hf import rand_job, det_job, known_job
-from ..hf import check_nonce_work, sequence_a_leq_b, prepare_hf_hash_serial
+from ..hf import check_nonce_work, sequence_a_le_b, sequence_a_leq_b, prepare_hf_hash_serial, nonce_in_range
+from ..instrument import Instrumentation
+from ..difficulty import DifficultyController
+from ..thermal_control import ThermalController
 
 from ...errors                    import HF_Error, HF_Thermal, HF_InternalError, HF_NotConnectedError
 from ...util                      import with_metaclass, int_to_lebytes, lebytes_to_int, reverse_every_four_bytes
-from ...protocol.frame            import HF_Frame, opcodes, opnames
+from ...protocol.frame            import HF_Frame, FrameEncoder, opcodes, opnames
 from ...protocol.op_settings      import HF_OP_SETTINGS, hf_settings, hf_die_settings
 from ...protocol.op_power         import HF_OP_POWER
 from ...protocol.op_usb_init      import HF_OP_USB_INIT, decode_op_status_job_map, list_available_cores
@@ -65,12 +68,19 @@ from ...protocol.op_fan           import HF_OP_FAN
 def noprint(x):
   pass
 
+# OP_HASH frames sent in one USB write when stocking a die's cores, with a
+# receive between writes.
+HASH_BATCH = 10
+
 class BaseRoutine(with_metaclass(ABCMeta, object)):
-  def __init__(self, talkusb, clockrate, printer=noprint, deterministic=False):
+  def __init__(self, talkusb, clockrate, printer=noprint, deterministic=False, instrument=False):
     self.talkusb = talkusb
     self.clockrate = clockrate
     self.printer = printer
     self.deterministic = deterministic
+    self.instrumentation = None
+    self.difficulty_controller = None
+    self.thermal_controller = None
 
     # call defults
     self.defaults()
@@ -78,6 +88,10 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
     # call user initialize
     self.initialize()
 
+    # opt-in per-phase timing
+    if instrument:
+      self.enable_instrumentation()
+
   def defaults(self):
     self.max_die = 4*5
     self.max_cores_per_die = 96
@@ -104,14 +118,16 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
     self.parser = HF_Parse()
     self.transmitter = Send(self.talkusb)
     self.receiver = Receive(self.talkusb)
+    self.hash_frames = FrameEncoder()
 
     # setup stats
-    self.stats = {'hashes':0, 'hashrate':0, 'nonces':0, 'lhw':0, 'dhw':0, 'chw':0}
+    self.stats = {'hashes':0, 'hashrate':0, 'nonces':0, 'lhw':0, 'dhw':0, 'chw':0, 'stale':0}
 
     # setup die stats
     self.dies = [{'die':i, 'sequence':0, 'work':{}, 'hashes':0, 'jobs':0, 'hashrate':0.0, 'nonces':0, 'lhw':0, 'dhw':0, 'chw':0,
+                  'search_difficulty':self.search_difficulty, 'restart_sequence':None, 'stale':0,
                   'pending_slots':{}, 'active_slots':{}, 'core_sequence':{}, 'last_sequence':None, 'active':0, 'pending':0, 'moving':None,
-                  'thermal_cutoff':0, 'frequency':0, 'voltage':0, 'temperature':0, 'core_voltage':0, 'vin':0, 'vout':0, 'elapsed':0}
+                  'thermal_cutoff':0, 'throttle':0, 'frequency':0, 'voltage':0, 'temperature':0, 'core_voltage':0, 'vin':0, 'vout':0, 'elapsed':0}
                   for i in range(self.max_die)]
 
     # setup core stats
@@ -120,10 +136,58 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
     for core in self.cores:
       core['work'] = deque([])    
 
+    # new parser, transmitter and receiver need timing again
+    if self.instrumentation is not None:
+      self.instrumentation.attach(self)
+
   @abstractmethod
   def initialize(self):
     pass
 
+  def enable_instrumentation(self, profile_every=0):
+    if self.instrumentation is None:
+      self.instrumentation = Instrumentation(profile_every=profile_every)
+      self.instrumentation.attach(self)
+    return self.instrumentation
+
+  # Adapt the search difficulty of each die to hold a nonce rate, see
+  # DifficultyController.
+  def enable_difficulty_control(self, **kwargs):
+    if self.difficulty_controller is None:
+      self.difficulty_controller = DifficultyController(**kwargs)
+    return self.difficulty_controller
+
+  def die_search_difficulty(self, this_die):
+    if self.difficulty_controller is None:
+      return self.search_difficulty
+    return self.difficulty_controller.search_difficulty(this_die)
+
+  # Throttle dispatch to each die, and optionally drive the fan, to hold a
+  # die temperature, see ThermalController.
+  def enable_thermal_control(self, **kwargs):
+    if self.thermal_controller is None:
+      self.thermal_controller = ThermalController(max_throttle=self.max_cores_per_die, **kwargs)
+    return self.thermal_controller
+
+  def die_throttle(self, this_die):
+    if self.thermal_controller is None:
+      return 0
+    return self.thermal_controller.throttle(this_die)
+
+  def thermal_control(self, this_die, cutoff=False):
+    if cutoff:
+      self.thermal_controller.cutoff(this_die)
+    else:
+      self.thermal_controller.update(this_die)
+    speed = self.thermal_controller.fan_change()
+    if speed is not None:
+      op_fan = HF_OP_FAN(speed=speed)
+      self.transmitter.send(op_fan.framebytes)
+
+  def report_instrumentation(self):
+    if self.instrumentation is not None:
+      self.instrumentation.report(self.printer)
+
   def get_die(self, idie):
     return self.dies[idie]
 
@@ -171,8 +235,9 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
     if self.calculate_hashrate():
       self.printer(  "avg hashrate: {0:6.2f} GH/s, nonces {1:d}".format((self.stats['hashrate']/10**9), self.stats['nonces']))
       for this_die in self.dies:
-        self.printer("Die {2:d}, avg hashrate: {0:6.2f} GH/s, nonces: {1:d}, {3}sec moving {4:6.2f} GH/s"
-          .format((this_die['hashrate']/10**9), this_die['nonces'], this_die['die'], self.moving_interval, (this_die['moving'][-1]['hashrate']/10**9)))
+        self.printer("Die {2:d}, avg hashrate: {0:6.2f} GH/s, nonces: {1:d}, {3}sec moving {4:6.2f} GH/s, difficulty: {5:d}"
+          .format((this_die['hashrate']/10**9), this_die['nonces'], this_die['die'], self.moving_interval, (this_die['moving'][-1]['hashrate']/10**9),
+                  this_die['search_difficulty']))
 
   def report_errors(self):
     self.printer(  "Errors:    LHW: {0:d}   DHW: {1:d}   CHW: {2:d}".format(self.stats['lhw'], self.stats['dhw'], self.stats['chw']))
@@ -195,18 +260,26 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
     if self.test_start is None:
       self.test_start = time.time()
 
-  def is_valid_nonce(self, this_job, nonce):
+  # search_difficulty is the difficulty the job was sent with, by default
+  # self.search_difficulty.
+  def is_valid_nonce(self, this_job, nonce, ntime_offset=0, search_difficulty=None):
+    if search_difficulty is None:
+      search_difficulty = self.search_difficulty
     # check nonce
     if self.deterministic:
       return (nonce in this_job['solutions'])
+    elif ntime_offset > this_job['ntime loops'] or not nonce_in_range(this_job, nonce):
+      # core claims to have rolled ntime further than it was allowed to,
+      # or returned a nonce from another core's part of the job
+      return False
     else:
-      zerobits, regen_hash_expanded = check_nonce_work(this_job, nonce)
+      zerobits, regen_hash_expanded = check_nonce_work(this_job, nonce, ntime_offset)
       #self.printer(this_job)
       #self.printer('req: ' + ''.join('{:02x}'.format(x) for x in int_to_lebytes(3184732951, 4)))
       #self.printer('got: ' + ''.join('{:02x}'.format(x) for x in int_to_lebytes(nonce, 4)))
       #self.printer(zerobits)
       #self.printer(regen_hash_expanded)
-      return (zerobits >= self.search_difficulty)
+      return (zerobits >= search_difficulty)
 
   def process_op_nonce(self, op_nonce):
     # calculate hashrate here
@@ -223,13 +296,14 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
         core = this_work['core']
         this_core = self.get_core(die, core)
         # check nonce
-        if self.is_valid_nonce(this_job, nonce.nonce):
+        search_difficulty = this_work['search_difficulty']
+        if self.is_valid_nonce(this_job, nonce.nonce, nonce.ntime_offset, search_difficulty):
           # start timing hashrate
           if self.hash_rate_start is None:
             self.hash_rate_start = time.time()
           # hashes
-          self.stats['hashes']  += 2**self.search_difficulty
-          this_die['hashes']    += 2**self.search_difficulty
+          self.stats['hashes']  += 2**search_difficulty
+          this_die['hashes']    += 2**search_difficulty
           # nonces
           self.stats['nonces']  += 1
           this_die['nonces']    += 1
@@ -245,6 +319,11 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
           this_core['lhw']      += 1
           #self.printer("!BAD NNC (%08x) die: %d core: %d seq: %d" % (nonce.nonce, die, core, nonce.sequence))
 
+      elif this_die['restart_sequence'] is not None and sequence_a_le_b(nonce.sequence, this_die['restart_sequence']):
+        # work dropped by invalidate_work()
+        self.stats['stale']     += 1
+        this_die['stale']       += 1
+
       else:
         # sequence number corrupted
         self.stats['chw']       += 1
@@ -257,6 +336,8 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
     # check thermal
     if op_status.thermal_cutoff:
       this_die['thermal_cutoff'] = op_status.thermal_cutoff
+      if self.thermal_controller is not None:
+        self.thermal_control(this_die, cutoff=True)
       raise HF_Thermal("THERMAL CUTOFF, die %d" % (die))
     # last sequence seen
     this_die['last_sequence'] = op_status.last_sequence_number
@@ -283,6 +364,8 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
     # die measured temperature and voltage
     this_die['temperature']   = op_status.monitor_data.die_temperature
     this_die['core_voltage']  = op_status.monitor_data.core_voltage_main
+    if self.thermal_controller is not None:
+      self.thermal_control(this_die)
     # op_status message
     if this_die['active'] is not 96:
       self.printer("OP_STATUS die: %d active: %s pending: %s" % (die, this_die['active'], this_die['pending']))
@@ -309,19 +392,28 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
       job = rand_job(self.rndsrc)
       return job
 
-  def action_op_hash(self, die, core):
+  # Sends OP_HASH to the core, or adds it to frames, a FrameEncoder, to be
+  # sent with others.
+  def action_op_hash(self, die, core, frames=None):
     this_die  = self.get_die(die)
     this_core = self.get_core(die, core)
     # current sequence
     sequence = this_die['sequence']
     # get job
     job = self.get_job(die, core)
+    if job is None:
+      # no work to give out, the core is offered again by the next OP_STATUS
+      return
     # generate OP_HASH
-    op_hash = HF_OP_HASH(die, core, sequence, prepare_hf_hash_serial(job, self.search_difficulty))
+    search_difficulty = self.die_search_difficulty(this_die)
+    hash_serial = prepare_hf_hash_serial(job, search_difficulty)
     # generate work
-    work = {'time':time.time(), 'job':job, 'die':die, 'core':core, 'recieved':0}
+    work = {'time':time.time(), 'job':job, 'die':die, 'core':core, 'recieved':0, 'search_difficulty':search_difficulty}
     # send OP_HASH
-    self.transmitter.send(op_hash.framebytes)
+    if frames is None:
+      self.transmitter.send(HF_OP_HASH(die, core, sequence, hash_serial).framebytes)
+    else:
+      frames.add(opcodes['OP_HASH'], die, core, sequence, hash_serial.frame_data)
     # Fix: overwrites previous core_sequence
     this_die['core_sequence'][core] = sequence
     this_die['work'][sequence] = work
@@ -339,6 +431,34 @@ class BaseRoutine(with_metaclass(ABCMeta, object)):
         this_die['dhw']   += ndhw
         this_core['dhw']  += ndhw
 
+  # Sends OP_HASH to each of the die's cores, HASH_BATCH frames at a time.
+  def stock_slots(self, die, cores):
+    frames = self.hash_frames
+    frames.reset()
+    count = 0
+    for core in cores:
+      self.action_op_hash(die, core, frames)
+      count += 1
+      if count % HASH_BATCH == 0:
+        self.send_frames(frames)
+        self.receiver.receive()
+    self.send_frames(frames)
+
+  def send_frames(self, frames):
+    if frames.length > 0:
+      self.transmitter.send(frames.view())
+      frames.reset()
+
+  # Forget the work sent to a die, after the die was told to drop it.
+  # Nonces still in flight for it count as stale rather than CHW.
+  def invalidate_work(self, this_die):
+    this_die['restart_sequence'] = this_die['sequence']
+    this_die['work'].clear()
+    this_die['core_sequence'].clear()
+    this_die['jobs'] = 0
+    for core in range(self.cores_per_die):
+      self.get_core(this_die['die'], core)['work'].clear()
+
   @abstractmethod
   def one_cycle(self):
     pass
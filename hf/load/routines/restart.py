@@ -51,6 +51,9 @@ from ...protocol.op_nonce         import HF_OP_NONCE
 from ...protocol.op_status        import HF_OP_STATUS
 from ...protocol.op_usb_notice    import HF_OP_USB_NOTICE
 from ...protocol.op_fan           import HF_OP_FAN
+from ...protocol.op_work_restart  import HF_OP_WORK_RESTART
+
+from ..instrument import Histogram
 
 from .base import BaseRoutine
 
@@ -58,12 +61,40 @@ class RestartRoutine(BaseRoutine):
 
   def initialize(self):
     self.global_state = 'settings'
+    # time of the last request_work_restart() not yet acted on
+    self.work_restart_requested = None
+    self.work_restart_started = None
+    # seconds from request_work_restart() to every core having new work
+    self.work_restart_latency = Histogram()
 
   def restart(self):
     self.printer('Restarting...')
     self.defaults()
     self.global_state = 'restart'
 
+  # Ask for new work on every core, e.g. on a new block.  Unlike restart(),
+  # this keeps the device running.  May be called from any thread; the
+  # OP_WORK_RESTART goes out on the next cycle.
+  def request_work_restart(self):
+    self.work_restart_requested = time.time()
+
+  def work_restart(self):
+    op_work_restart = HF_OP_WORK_RESTART()
+    self.transmitter.send(op_work_restart.framebytes)
+    # every core is idle now, give each an active and a pending job
+    cores = list(range(self.cores_per_die))
+    for die in range(self.number_of_die):
+      this_die = self.dies[die]
+      self.invalidate_work(this_die)
+      this_die['active_slots']  = random.sample(cores, len(cores))
+      this_die['pending_slots'] = random.sample(cores, len(cores))
+
+  def report_work_restart(self, latency):
+    self.work_restart_latency.record(latency)
+    self.printer("Work restart: new work on all cores {0:.1f} ms after request, {1:d} restarts, p50 {2:.1f} ms, max {3:.1f} ms"
+      .format(1000 * latency, self.work_restart_latency.count, 1000 * self.work_restart_latency.percentile(50),
+              1000 * self.work_restart_latency.max))
+
   def one_cycle(self):
     try:
       ####################
@@ -149,30 +180,28 @@ class RestartRoutine(BaseRoutine):
               self.printer("Garbage: %d bytes" % (len(token.garbage)))
             else:
               raise HF_Error("Unexpected token type: %s" % (token))
+        # after the tokens, so an OP_STATUS from before the restart does
+        # not replace the slot lists
+        requested = self.work_restart_requested
+        if requested is not None:
+          self.work_restart_requested = None
+          self.work_restart_started = requested
+          self.work_restart()
         # first stock the active slots.
         for die in range(self.number_of_die):
           this_die = self.dies[die]
-          receiver_throttle_counter = 0
-          for core in this_die['active_slots']:
-            # send op_hash
-            self.action_op_hash(die, core)
-            # Fix: throttled reciever
-            receiver_throttle_counter += 1
-            if receiver_throttle_counter % 10 is 0:
-              self.receiver.receive()
+          # send op_hash
+          self.stock_slots(die, this_die['active_slots'])
           this_die['active_slots'] = []
         # next stock the pending slots.
         for die in range(self.number_of_die):
           this_die = self.dies[die]
-          receiver_throttle_counter = 0
-          for core in this_die['pending_slots']:
-            # send op_hash
-            self.action_op_hash(die, core)
-            # Fix: throttled reciever
-            receiver_throttle_counter += 1
-            if receiver_throttle_counter % 10 is 0:
-              self.receiver.receive()
+          # send op_hash
+          self.stock_slots(die, this_die['pending_slots'])
           this_die['pending_slots'] = []
+        if self.work_restart_started is not None:
+          self.report_work_restart(time.time() - self.work_restart_started)
+          self.work_restart_started = None
 
       ####################
       # SHUTDOWN
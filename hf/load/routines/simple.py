@@ -135,26 +135,14 @@ class SimpleRoutine(BaseRoutine):
         # first stock the active slots.
         for die in range(self.number_of_die):
           this_die = self.dies[die]
-          receiver_throttle_counter = 0
-          for core in this_die['active_slots']:
-            # send op_hash
-            self.action_op_hash(die, core)
-            # Fix: throttled reciever
-            receiver_throttle_counter += 1
-            if receiver_throttle_counter % 10 is 0:
-              self.receiver.receive()
+          # send op_hash
+          self.stock_slots(die, this_die['active_slots'])
           this_die['active_slots'] = []
         # next stock the pending slots.
         for die in range(self.number_of_die):
           this_die = self.dies[die]
-          receiver_throttle_counter = 0
-          for core in this_die['pending_slots']:
-            # send op_hash
-            self.action_op_hash(die, core)
-            # Fix: throttled reciever
-            receiver_throttle_counter += 1
-            if receiver_throttle_counter % 10 is 0:
-              self.receiver.receive()
+          # send op_hash
+          self.stock_slots(die, this_die['pending_slots'])
           this_die['pending_slots'] = []
 
       ####################
@@ -132,29 +132,23 @@ class ThermalRoutine(BaseRoutine):
               self.printer("Garbage: %d bytes" % (len(token.garbage)))
             else:
               raise HF_Error("Unexpected token type: %s" % (token))
-        # first stock the active slots.
+        # first stock the active slots, less any cores the thermal
+        # controller holds back.
         for die in range(self.number_of_die):
           this_die = self.dies[die]
-          receiver_throttle_counter = 0
-          for core in this_die['active_slots']:
-            # send op_hash
-            self.action_op_hash(die, core)
-            # Fix: throttled reciever
-            receiver_throttle_counter += 1
-            if receiver_throttle_counter % 10 is 0:
-              self.receiver.receive()
+          for i in range(self.die_throttle(this_die)):
+            if len(this_die['active_slots']) > 0:
+              this_die['active_slots'].pop()
+          # send op_hash
+          self.stock_slots(die, this_die['active_slots'])
           this_die['active_slots'] = []
         # next stock the pending slots.
         for die in range(self.number_of_die):
           this_die = self.dies[die]
-          receiver_throttle_counter = 0
-          for core in this_die['pending_slots']:
-            # send op_hash
-            self.action_op_hash(die, core)
-            # Fix: throttled reciever
-            receiver_throttle_counter += 1
-            if receiver_throttle_counter % 10 is 0:
-              self.receiver.receive()
+          if self.die_throttle(this_die) >= 1:
+            continue
+          # send op_hash
+          self.stock_slots(die, this_die['pending_slots'])
           this_die['pending_slots'] = []
 
       ####################
@@ -59,7 +59,10 @@ class ThrottledRoutine(BaseRoutine):
   def initialize(self):
     self.global_state = 'settings'
 
-  def one_cycle(self, throttle):
+  # throttle is the number of idle cores of each die left without work; a
+  # die with any throttle is not given pending work either.  None takes the
+  # throttle of each die from the thermal controller.
+  def one_cycle(self, throttle=None):
     try:
       # Fix: Every time we send, we want also to receive (to make sure nothing
       #      deadlocks), so the send and receive objects should be combined.
@@ -132,34 +135,26 @@ class ThrottledRoutine(BaseRoutine):
               self.printer("Garbage: %d bytes" % (len(token.garbage)))
             else:
               raise HF_Error("Unexpected token type: %s" % (token))
+        throttles = [throttle] * self.number_of_die
+        if throttle is None:
+          throttles = [self.die_throttle(self.dies[die]) for die in range(self.number_of_die)]
         # first stock the active slots.
         for die in range(self.number_of_die):
           this_die = self.dies[die]
-          receiver_throttle_counter = 0
-          for i in range(throttle):
+          for i in range(throttles[die]):
             if len(this_die['active_slots']) > 0:
               this_die['active_slots'].pop()
-          for core in this_die['active_slots']:
-            # send op_hash
-            self.action_op_hash(die, core)
-            # Fix: throttled reciever
-            receiver_throttle_counter += 1
-            if receiver_throttle_counter % 10 is 0:
-              self.receiver.receive()
+          # send op_hash
+          self.stock_slots(die, this_die['active_slots'])
           this_die['active_slots'] = []
         # next stock the pending slots.
-        if throttle < 1:
-          for die in range(self.number_of_die):
-            this_die = self.dies[die]
-            receiver_throttle_counter = 0
-            for core in this_die['pending_slots']:
-              # send op_hash
-              self.action_op_hash(die, core)
-              # Fix: throttled reciever
-              receiver_throttle_counter += 1
-              if receiver_throttle_counter % 10 is 0:
-                self.receiver.receive()
-            this_die['pending_slots'] = []
+        for die in range(self.number_of_die):
+          if throttles[die] >= 1:
+            continue
+          this_die = self.dies[die]
+          # send op_hash
+          self.stock_slots(die, this_die['pending_slots'])
+          this_die['pending_slots'] = []
 
       ####################
       # SHUTDOWN
@@ -207,7 +202,11 @@ class ThrottledRoutine(BaseRoutine):
       return False
 
     except HF_Thermal:
-      self.printer("Generic exception handler: (%s, %s, %s)" % (sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
+      self.printer("Thermal!: (%s, %s, %s)" % (sys.exc_info()[0], sys.exc_info()[1], sys.exc_info()[2]))
+      if self.thermal_controller is not None:
+        # the controller has throttled the die fully, keep going and let it
+        # back off as the die cools
+        return True
       self.end()
       return False
 
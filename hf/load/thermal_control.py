@@ -0,0 +1,186 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+# Die temperatures in C.  Cutoff trips at about 105 C; soak.py used to
+# throttle hard above LIMIT.
+SETPOINT = 95.0
+LIMIT = 104.0
+
+# Fan speed bounds in percent, see HF_OP_FAN.
+MIN_FAN = 30
+MAX_FAN = 99
+
+class PID():
+  # A PID loop on one measurement.  The derivative is taken on the
+  # measurement rather than the error, and low pass filtered, so a setpoint
+  # change or a noisy reading does not kick the output.  The integral is
+  # clamped so that it alone never drives the output past its bounds.
+  def __init__(self, kp, ki, kd, setpoint, output_min, output_max, bias=0.0, derivative_filter=0.5):
+    assert output_min < output_max
+    assert derivative_filter >= 0 and derivative_filter < 1
+    self.kp = kp
+    self.ki = ki
+    self.kd = kd
+    self.setpoint = setpoint
+    self.output_min = output_min
+    self.output_max = output_max
+    self.bias = bias
+    self.derivative_filter = derivative_filter
+    self.reset()
+
+  def reset(self):
+    self.integral = 0.0
+    self.derivative = 0.0
+    self.error = 0.0
+    self.output = self.clamp(self.bias)
+    self.measurement = None
+    self.time = None
+    self.updates = 0
+
+  def clamp(self, value):
+    return max(self.output_min, min(value, self.output_max))
+
+  def update(self, measurement, now):
+    self.error = measurement - self.setpoint
+    if self.time is not None and now > self.time:
+      dt = now - self.time
+      rate = (measurement - self.measurement) / dt
+      self.derivative = self.derivative_filter * self.derivative + (1 - self.derivative_filter) * rate
+      self.integral += self.ki * self.error * dt
+    # anti-windup
+    self.integral = max(self.output_min - self.bias, min(self.integral, self.output_max - self.bias))
+    self.output = self.clamp(self.bias + self.kp * self.error + self.integral + self.kd * self.derivative)
+    self.measurement = measurement
+    self.time = now
+    self.updates += 1
+    return self.output
+
+  # Start from the top of the output range, e.g. after a thermal cutoff, and
+  # let the integral bring it back down.
+  def saturate(self, now):
+    self.integral = self.output_max - self.bias
+    self.output = self.output_max
+    self.time = now
+
+  def state(self):
+    return {'setpoint': self.setpoint, 'measurement': self.measurement, 'error': self.error,
+            'p': self.kp * self.error, 'i': self.integral, 'd': self.kd * self.derivative,
+            'output': self.output, 'updates': self.updates}
+
+class ThermalController():
+  # Holds each die near setpoint by throttling its dispatch.  Every OP_STATUS
+  # feeds the die temperature to that die's PID loop, whose output is the
+  # number of idle cores left without work until the next OP_STATUS, see
+  # ThrottledRoutine.one_cycle().  At limit or on thermal cutoff the die is
+  # throttled fully at once.
+  #
+  # With fan=True a second loop sets the board fan from the hottest die,
+  # holding it fan_margin below setpoint so the fan takes up heat before the
+  # dies are throttled.
+  #
+  # The throttle of a die is kept in its stats as 'throttle'; state() gives
+  # the terms of every loop for tuning.
+  def __init__(self, setpoint=SETPOINT, limit=LIMIT, kp=4.0, ki=0.5, kd=8.0, max_throttle=96,
+               fan=False, fan_margin=5.0, fan_kp=4.0, fan_ki=0.2, fan_kd=0.0, min_fan=MIN_FAN, max_fan=MAX_FAN, fan_step=5):
+    assert setpoint < limit
+    self.setpoint = setpoint
+    self.limit = limit
+    self.kp = kp
+    self.ki = ki
+    self.kd = kd
+    self.max_throttle = max_throttle
+    self.loops = {}
+    self.fan = None
+    self.fan_speed = None
+    self.fan_step = fan_step
+    self.temperatures = {}
+    if fan:
+      self.fan = PID(fan_kp, fan_ki, fan_kd, setpoint - fan_margin, min_fan, max_fan, bias=min_fan)
+
+  def loop(self, die):
+    if die not in self.loops:
+      self.loops[die] = PID(self.kp, self.ki, self.kd, self.setpoint, 0, self.max_throttle)
+    return self.loops[die]
+
+  def update(self, this_die, now=None):
+    if now is None:
+      now = time.time()
+    pid = self.loop(this_die['die'])
+    temperature = this_die['temperature']
+    pid.update(temperature, now)
+    if temperature >= self.limit:
+      pid.saturate(now)
+    this_die['throttle'] = int(round(pid.output))
+    self.temperatures[this_die['die']] = temperature
+    if self.fan is not None:
+      self.fan.update(max(self.temperatures.values()), now)
+    return this_die['throttle']
+
+  def cutoff(self, this_die, now=None):
+    if now is None:
+      now = time.time()
+    self.loop(this_die['die']).saturate(now)
+    this_die['throttle'] = self.max_throttle
+    if self.fan is not None:
+      self.fan.saturate(now)
+
+  def throttle(self, this_die):
+    return this_die.get('throttle', 0)
+
+  # A new fan speed to send, or None while it is within fan_step of the last
+  # one sent.
+  def fan_change(self):
+    if self.fan is None:
+      return None
+    speed = int(round(self.fan.output))
+    if self.fan_speed is None or abs(speed - self.fan_speed) >= self.fan_step or \
+       (speed != self.fan_speed and speed in (self.fan.output_min, self.fan.output_max)):
+      self.fan_speed = speed
+      return speed
+    return None
+
+  def state(self):
+    state = []
+    for die in sorted(self.loops):
+      s = self.loops[die].state()
+      s['die'] = die
+      s['throttle'] = int(round(s['output']))
+      state.append(s)
+    if self.fan is not None:
+      s = self.fan.state()
+      s['die'] = None
+      s['fan_speed'] = self.fan_speed
+      state.append(s)
+    return state
+
+  def report(self, printer):
+    for s in self.state():
+      name = 'fan' if s['die'] is None else 'die {:d}'.format(s['die'])
+      if s['measurement'] is None:
+        continue
+      printer("Thermal {}: {:.1f} C error {:+.1f} p {:+.1f} i {:+.1f} d {:+.1f} output {:.0f}".format(
+        name, s['measurement'], s['error'], s['p'], s['i'], s['d'], s['output']))
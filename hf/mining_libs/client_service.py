@@ -43,6 +43,7 @@ log = stratum.logger.get_logger('proxy')
 
 class ClientMiningService(GenericEventHandler):
     job_registry = None # Reference to JobRegistry instance
+    pool_manager = None # Reference to PoolManager instance, if any
     timeout = None # Reference to IReactorTime object
     
     @classmethod
@@ -65,50 +66,64 @@ class ClientMiningService(GenericEventHandler):
         cls.reset_timeout()
         cls.job_registry.f.reconnect()
                 
+    @classmethod
+    def on_notify(cls, params):
+        '''Proxy just received information about new mining job'''
+        
+        (job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs) = params[:9]
+        #print len(str(params)), len(merkle_branch)
+        
+        '''
+        log.debug("Received new job #%s" % job_id)
+        log.debug("prevhash = %s" % prevhash)
+        log.debug("version = %s" % version)
+        log.debug("nbits = %s" % nbits)
+        log.debug("ntime = %s" % ntime)
+        log.debug("clean_jobs = %s" % clean_jobs)
+        log.debug("coinb1 = %s" % coinb1)
+        log.debug("coinb2 = %s" % coinb2)
+        log.debug("merkle_branch = %s" % merkle_branch)
+        '''
+    
+        # Broadcast to Stratum clients
+        stratum_listener.MiningSubscription.on_template(
+                        job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs)
+        
+        # Broadcast to getwork clients
+        job = Job.build_from_broadcast(job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime)
+        log.info("New job %s for prevhash %s, clean_jobs=%s" % \
+             (job.job_id, utils.format_hash(job.prevhash), clean_jobs))
+
+        cls.job_registry.add_template(job, clean_jobs)
+        if cls.pool_manager is not None:
+            cls.pool_manager.job_received()
+
+    @classmethod
+    def on_difficulty(cls, difficulty):
+        log.info("Setting new difficulty: %s" % difficulty)
+        
+        stratum_listener.DifficultySubscription.on_new_difficulty(difficulty)
+        cls.job_registry.set_difficulty(difficulty)
+                
     def handle_event(self, method, params, connection_ref):
         '''Handle RPC calls and notifications from the pool'''
 
+        if self.pool_manager is not None:
+            # every pool's latest job and difficulty, replayed on a switch to it
+            self.pool_manager.record_event(method, params, connection_ref)
+            # backup pools only keep them
+            if not self.pool_manager.is_active(connection_ref):
+                return self.pool_manager.handle_standby_event(method, params, connection_ref)
+
         # Yay, we received something from the pool,
         # let's restart the timeout.
         self.reset_timeout()
         
         if method == 'mining.notify':
-            '''Proxy just received information about new mining job'''
-            
-            (job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs) = params[:9]
-            #print len(str(params)), len(merkle_branch)
-            
-            '''
-            log.debug("Received new job #%s" % job_id)
-            log.debug("prevhash = %s" % prevhash)
-            log.debug("version = %s" % version)
-            log.debug("nbits = %s" % nbits)
-            log.debug("ntime = %s" % ntime)
-            log.debug("clean_jobs = %s" % clean_jobs)
-            log.debug("coinb1 = %s" % coinb1)
-            log.debug("coinb2 = %s" % coinb2)
-            log.debug("merkle_branch = %s" % merkle_branch)
-            '''
-        
-            # Broadcast to Stratum clients
-            stratum_listener.MiningSubscription.on_template(
-                            job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs)
-            
-            # Broadcast to getwork clients
-            job = Job.build_from_broadcast(job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime)
-            log.info("New job %s for prevhash %s, clean_jobs=%s" % \
-                 (job.job_id, utils.format_hash(job.prevhash), clean_jobs))
-
-            self.job_registry.add_template(job, clean_jobs)
-            
-            
+            self.on_notify(params)
             
         elif method == 'mining.set_difficulty':
-            difficulty = params[0]
-            log.info("Setting new difficulty: %s" % difficulty)
-            
-            stratum_listener.DifficultySubscription.on_new_difficulty(difficulty)
-            self.job_registry.set_difficulty(difficulty)
+            self.on_difficulty(params[0])
                     
         elif method == 'client.reconnect':
             (hostname, port, wait) = params[:3]
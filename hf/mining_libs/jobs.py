@@ -30,12 +30,16 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import binascii
+import hashlib
 import time
 import struct
 import subprocess
+import threading
 import weakref
 import array
 
+from collections import deque
+
 from twisted.internet import defer
 
 import utils
@@ -60,6 +64,68 @@ except ImportError:
         calculateMidstate = None
         log.exception("No midstate generator available. Some old miners won't work properly.")
 
+# Pools reject shares with ntime more than about 7000 seconds past the
+# ntime the job was broadcast with (ckpool uses exactly that).
+MAX_NTIME_ROLL = 7000
+# hf_candidate_nonce reports the ntime offset in 12 bits
+MAX_NTIME_LOOPS = 0x0fff
+
+# Block header in binary: version, prevhash, merkle root, ntime, bits, nonce
+header_struct = struct.Struct('<I32s32sIII')
+
+class MerkleIndex(object):
+    '''Binary merkle root -> (job, extranonce2) for jobs built by
+    getwork_batch(). Holds at most size roots, oldest dropped first, and
+    drop_jobs() removes the roots of jobs the pool has cleared.
+
+    add() is called from the mining thread and drop_jobs() from the
+    reactor, so both hold the lock.'''
+
+    def __init__(self, size=65536):
+        self.size = size
+        self.entries = {}
+        self.order = deque()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, job, merkles):
+        '''merkles is a list of (merkle_root, extranonce2), oldest first'''
+        with self.lock:
+            for merkle_root, extranonce2 in merkles:
+                self.entries[merkle_root] = (job, extranonce2)
+                self.order.append(merkle_root)
+            while len(self.order) > self.size:
+                self.entries.pop(self.order.popleft(), None)
+
+    def get(self, merkle_root):
+        with self.lock:
+            return self.entries.get(merkle_root)
+
+    def drop_jobs(self, keep):
+        keep = set(id(job) for job in keep)
+        with self.lock:
+            self.entries = dict((k, v) for k, v in self.entries.iteritems() if id(v[0]) in keep)
+            self.order = deque(k for k in self.order if k in self.entries)
+
+def split_nonce_range(newjob, parts):
+    '''Split a load-format job into parts jobs covering disjoint nonce
+    ranges of the same header, one per core.'''
+    if parts <= 1:
+        return [newjob]
+    size = 2**32 // parts
+    newjobs = []
+    for i in xrange(parts):
+        part = dict(newjob)
+        part['starting nonce'] = i * size
+        if i < parts - 1:
+            part['nonce loops'] = size
+        else:
+            part['nonce loops'] = 2**32 - i * size
+        newjobs.append(part)
+    return newjobs
+
 class Job(object):
     def __init__(self):
         self.job_id = None
@@ -69,11 +135,19 @@ class Job(object):
         self.merkle_branch = []
         self.version = 1
         self.nbits = 0
+        self.ntime = 0
         self.ntime_delta = 0
         
         self.extranonce2 = 0
         self.merkle_to_extranonce2 = {} # Relation between merkle_hash and extranonce2
 
+        # Header fields in the format used by hf.load, see getwork_batch()
+        self.version_int = 1
+        self.nbits_int = 0
+        self.prevhash_load = []
+        self.prevhash_bin = ''
+        self.coinbase_prefix = (None, None) # (extranonce1_bin, sha256 state)
+
     @classmethod
     def build_from_broadcast(cls, job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime):
         '''Build job object from Stratum server broadcast'''
@@ -85,15 +159,33 @@ class Job(object):
         job.merkle_branch = [ binascii.unhexlify(tx) for tx in merkle_branch ]
         job.version = version
         job.nbits = nbits
-        job.ntime_delta = int(ntime, 16) - int(time.time()) 
+        job.ntime = int(ntime, 16)
+        job.ntime_delta = job.ntime - int(time.time()) 
+        job.version_int = int(version, 16)
+        job.nbits_int = int(nbits, 16)
+        # prevhash is broadcast with every four bytes swapped
+        prevhash_bin = binascii.unhexlify(prevhash)
+        job.prevhash_bin = ''.join([ prevhash_bin[i*4:i*4+4][::-1] for i in range(0, 8) ])
+        job.prevhash_load = list(bytearray(job.prevhash_bin))
         return job
 
+    def ntime_loops(self, ntime, ntime_roll):
+        '''How far the board may roll ntime from ntime, at most ntime_roll.'''
+        return max(0, min(ntime_roll, MAX_NTIME_LOOPS, self.ntime + MAX_NTIME_ROLL - ntime))
+
     def increase_extranonce2(self):
         self.extranonce2 += 1
         return self.extranonce2
 
     def build_coinbase(self, extranonce):
         return self.coinb1_bin + extranonce + self.coinb2_bin
+
+    def coinbase_hash_state(self, extranonce1_bin):
+        '''sha256 state after coinb1 and extranonce1, cached until
+        extranonce1 changes. Callers must copy() it before updating.'''
+        if self.coinbase_prefix[0] != extranonce1_bin:
+            self.coinbase_prefix = (extranonce1_bin, hashlib.sha256(self.coinb1_bin + extranonce1_bin))
+        return self.coinbase_prefix[1]
     
     def build_merkle_root(self, coinbase_hash):
         merkle_root = coinbase_hash
@@ -133,6 +225,10 @@ class JobRegistry(object):
         
         # Relation between merkle and job
         self.merkle_to_job= weakref.WeakValueDictionary()
+        # Same for getwork_batch(), keyed by the binary merkle root
+        self.merkle_index = MerkleIndex()
+        # submit() assembles headers here
+        self.header_buffer = bytearray(header_struct.size)
         
         # Hook for LP broadcasts
         self.on_block = defer.Deferred()
@@ -185,15 +281,30 @@ class JobRegistry(object):
             
         self.jobs.append(template)
         self.last_job = template
+
+        if clean_jobs:
+            self.merkle_index.drop_jobs(self.jobs)
                 
         if clean_jobs:
-            # Force miners to reload jobs
-            on_block = self.on_block
-            self.on_block = defer.Deferred()
-            on_block.callback(True)
+            self.new_block()
     
             # blocknotify-compatible call
             self.execute_cmd(template.prevhash)
+
+    def new_block(self):
+        # Force miners to reload jobs
+        on_block = self.on_block
+        self.on_block = defer.Deferred()
+        on_block.callback(True)
+
+    def clear_jobs(self):
+        '''Drop every job until the next add_template(), e.g. on a switch to
+        a pool that has not sent one yet, so no work is built from the
+        previous pool's coinbase. Miners drop their work as on a new block.'''
+        self.jobs = []
+        self.last_job = None
+        self.merkle_index.drop_jobs(self.jobs)
+        self.new_block()
           
     def register_merkle(self, job, merkle_hash, extranonce2):
         # merkle_to_job is weak-ref, so it is cleaned up automatically
@@ -201,6 +312,10 @@ class JobRegistry(object):
         self.merkle_to_job[merkle_hash] = job
         job.merkle_to_extranonce2[merkle_hash] = extranonce2
         
+    def register_merkles(self, job, merkles):
+        '''Register (merkle_root, extranonce2) pairs built by getwork_batch()'''
+        self.merkle_index.add(job, merkles)
+
     def get_job_from_header(self, header):
         '''Lookup for job and extranonce2 used for given blockheader (in hex)'''
         merkle_hash = header[72:136].lower()
@@ -290,61 +405,106 @@ class JobRegistry(object):
         #'''
         return newjob
         
-    def submit(self, newjob, nonce, worker_name):
+    def getwork_batch(self, n, ntime_roll=0):
+        '''Build n jobs for the hf.load routines from the latest job.
 
-        #job_id = newjob['library_number']
-        #merkle = newjob['solutions']
+        Unlike getwork(), the jobs are binary header fields in the load
+        format (header byte order, bits as int), the coinbase hash starts
+        from a cached sha256 state and the merkle roots are registered
+        by their binary value in one update. Use submit() for nonces found
+        on these jobs.
 
-        ntime = newjob['timestamp']
-        merkle = ''.join('{:02x}'.format(x) for x in newjob['merkle tree root'])
-        
-        # 2. Lookup for job and extranonce used for creating given block header
-        try:
-            (job, extranonce2) = self.get_job_from_merkle(merkle)
-        except KeyError:
-            log.info("Job not found from merkle")
-            return False
+        With ntime_roll the board may roll ntime up to that many seconds
+        itself, so each job covers that many more 2^32 nonce ranges.
+
+        Returns no jobs while there is no job from the pool.'''
+        job = self.last_job
+        if job is None:
+            return []
+        prefix = job.coinbase_hash_state(self.extranonce1_bin)
+        coinb2_bin = job.coinb2_bin
+        merkle_branch = job.merkle_branch
+        ntime = int(time.time()) + job.ntime_delta
+        ntime_loops = job.ntime_loops(ntime, ntime_roll)
 
-        ### GET HEADER
+        first = job.extranonce2 + 1
+        job.extranonce2 += n
 
-        header = job.serialize_header(merkle, ntime, nonce)
+        merkles = []
+        newjobs = []
+        for extranonce2 in xrange(first, first + n):
+            sha = prefix.copy()
+            sha.update(self.extranonce2_padding(extranonce2) + coinb2_bin)
+            merkle_root = hashlib.sha256(sha.digest()).digest()
+            for h in merkle_branch:
+                merkle_root = utils.doublesha(merkle_root + h)
+            merkles.append((merkle_root, extranonce2))
+            # prevhash_load is shared between jobs, nothing modifies it
+            newjobs.append({'version':             job.version_int,
+                            'previous block hash': job.prevhash_load,
+                            'merkle tree root':    list(bytearray(merkle_root)),
+                            'timestamp':           ntime,
+                            'bits':                job.nbits_int,
+                            'starting nonce':      0,
+                            'nonce loops':         0,
+                            'ntime loops':         ntime_loops})
+        if self.last_job is not job:
+            # replaced while building, maybe by a pool switch that also
+            # changed extranonce1; the caller builds from the new job
+            return []
+        self.register_merkles(job, merkles)
+        return newjobs
 
-        #print(header[:160])
+    def getwork_split(self, n, parts, ntime_roll=0):
+        '''n merkle roots from getwork_batch(), each split into parts jobs
+        with disjoint nonce ranges, n * parts jobs in all.'''
+        newjobs = []
+        for newjob in self.getwork_batch(n, ntime_roll):
+            newjobs.extend(split_nonce_range(newjob, parts))
+        return newjobs
 
-        ### BELOW IS LIKE SUBMIT(header, worker_name)
+    def share_zero_bits(self):
+        '''Leading zero bits every hash at or below the pool target has.'''
+        return 256 - self.target.bit_length()
 
-        # Drop unused padding
-        header = header[:160]
+    def meets_target(self, hash_bin):
+        '''True if a binary header hash is at or below the pool target.'''
+        return int(binascii.hexlify(hash_bin[::-1]), 16) <= self.target
 
-        # 1. Check if blockheader meets requested difficulty
-        header_bin = binascii.unhexlify(header[:160])
-        rev = ''.join([ header_bin[i*4:i*4+4][::-1] for i in range(0, 20) ])
-        hash_bin = utils.doublesha(rev)
-        block_hash = ''.join([ hash_bin[i*4:i*4+4][::-1] for i in range(0, 8) ])
-        
-        if utils.uint256_from_str(hash_bin) > self.target:
+    def submit(self, newjob, nonce, worker_name, ntime_offset=0, hash_bin=None):
+        '''Submit a nonce found on a job from getwork_batch(), ntime_offset
+        is the ntime roll reported with the nonce. hash_bin is the header
+        hash if the caller already computed it while checking the nonce.
+        Returns False if the job is unknown or cleared, True if the share is
+        below target, else the Deferred of the mining.submit call.'''
+
+        # 1. Lookup for job and extranonce used for creating given block header
+        merkle_root = bytes(bytearray(newjob['merkle tree root']))
+        entry = self.merkle_index.get(merkle_root)
+        if entry is None:
+            log.info("Job not found from merkle")
+            return False
+        (job, extranonce2) = entry
+
+        # 2. Check if blockheader meets requested difficulty
+        if ntime_offset > newjob['ntime loops']:
+            log.info("Nonce ntime offset %d is past ntime loops %d" % (ntime_offset, newjob['ntime loops']))
+            return False
+        ntime = newjob['timestamp'] + ntime_offset
+        if hash_bin is None:
+            header_struct.pack_into(self.header_buffer, 0, job.version_int, job.prevhash_bin, merkle_root,
+                                    ntime, job.nbits_int, nonce)
+            hash_bin = utils.doublesha(self.header_buffer)
+
+        # the difficulty may have changed since the caller checked the hash
+        if not self.meets_target(hash_bin):
             log.debug("Share is below expected target")
             return True
         else:
-            #log.info('!!! %s' % header[:160])
-            log.info("Submitting %s" % utils.format_hash(binascii.hexlify(block_hash)))
-        
-        # 2. Lookup for job and extranonce used for creating given block header
-        try:
-            (job, extranonce2) = self.get_job_from_header(header)
-        except KeyError:
-            log.info("Job not found from header")
-            return False
+            log.info("Submitting %s" % utils.format_hash(binascii.hexlify(hash_bin[::-1])))
 
         # 3. Format extranonce2 to hex string
         extranonce2_hex = binascii.hexlify(self.extranonce2_padding(extranonce2))
 
-        # 4. Parse ntime and nonce from header
-        ntimepos = 17*8 # 17th integer in datastring
-        noncepos = 19*8 # 19th integer in datastring       
-        ntime = header[ntimepos:ntimepos+8] 
-        nonce = header[noncepos:noncepos+8]
-            
-        # 5. Submit share to the pool
-        #print(worker_name, job.job_id, extranonce2_hex, ntime, nonce)
-        return self.f.rpc('mining.submit', [worker_name, job.job_id, extranonce2_hex, ntime, nonce])
+        # 4. Submit share to the pool
+        return self.f.rpc('mining.submit', [worker_name, job.job_id, extranonce2_hex, '%08x' % ntime, '%08x' % nonce])
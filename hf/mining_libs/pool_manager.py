@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+from twisted.internet import defer
+from stratum.socket_transport import SocketTransportClientFactory
+
+from hf.load.instrument import Histogram
+
+import client_service
+import stratum_listener
+import version as _version
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class Pool(object):
+    def __init__(self, host, port, priority):
+        self.host = host
+        self.port = port
+        self.priority = priority # 0 is the most preferred
+        self.factory = None
+        self.ready = False # connected and subscribed
+        self.extranonce1 = None
+        self.extranonce2_size = None
+        # latest difficulty and mining.notify params, replayed on switchover
+        self.difficulty = None
+        self.notify = None
+        self.failures = 0
+
+    def name(self):
+        return "%s:%d" % (self.host, self.port)
+
+class PoolManager(object):
+    '''Keeps the proxy mining on the most preferred pool that is up.
+
+    The active pool and up to standby backups stay connected and
+    subscribed. Every pool's latest difficulty and job are recorded, so
+    when the active pool drops the proxy switches to a backup without
+    waiting for a reconnect: JobRegistry gets the backup's factory and
+    extranonce, and its job is replayed as a clean job. With failback, a
+    more preferred pool takes over again as soon as it is back up.
+
+    ClientMiningService passes every event to record_event(), and events
+    from pools other than the active one to handle_standby_event().'''
+
+    def __init__(self, pools, job_registry, workers, standby=1, failback=True,
+                 custom_user=None, custom_password=None, debug=False):
+        assert len(pools) > 0 and standby >= 0
+        self.pools = [Pool(host, port, i) for i, (host, port) in enumerate(pools)]
+        self.job_registry = job_registry
+        self.workers = workers
+        self.standby = standby
+        self.failback = failback
+        self.custom_user = custom_user
+        self.custom_password = custom_password
+        self.debug = debug
+        self.active = None
+        self.on_active = defer.Deferred() # fires when the first pool is active
+        self.stats = {'switchovers': 0, 'failbacks': 0, 'disconnects': 0}
+        # seconds from losing the active pool to a job from the new one
+        self.switch_started = None
+        self.switch_latency = Histogram()
+
+    def start(self):
+        for pool in self.pools[:1 + self.standby]:
+            self.connect(pool)
+        return self.on_active
+
+    def stop(self):
+        for pool in self.pools:
+            if pool.factory is not None:
+                pool.factory.is_reconnecting = False # Don't let stratum factory to reconnect again
+
+    def connect(self, pool):
+        if pool.factory is not None:
+            return
+        log.warning("Trying to connect to Stratum pool at %s" % pool.name())
+        f = SocketTransportClientFactory(pool.host, pool.port,
+                debug=self.debug, proxy=None,
+                event_handler=client_service.ClientMiningService)
+        pool.factory = f
+        f.on_connect.addCallback(self._on_connect, pool)
+        f.on_disconnect.addCallback(self._on_disconnect, pool)
+
+    def connect_standby(self):
+        # connect further down the list while fewer than standby backups are up
+        backups = [pool for pool in self.pools if pool is not self.active and pool.ready]
+        for pool in self.pools:
+            if len(backups) >= self.standby:
+                break
+            if pool.factory is None:
+                self.connect(pool)
+                backups.append(pool)
+
+    def best_ready(self):
+        for pool in self.pools:
+            if pool.ready:
+                return pool
+        return None
+
+    @defer.inlineCallbacks
+    def _on_connect(self, f, pool):
+        '''Callback when proxy get connected to one of the pools'''
+        log.info("Connected to Stratum pool at %s:%d" % f.main_host)
+
+        # Hook to on_connect again
+        f.on_connect.addCallback(self._on_connect, pool)
+
+        # Subscribe for receiving jobs
+        pool.notify = None
+        (_, extranonce1, extranonce2_size) = (yield f.rpc('mining.subscribe', []))[:3]
+        pool.extranonce1 = extranonce1
+        pool.extranonce2_size = extranonce2_size
+        pool.ready = True
+
+        # the active pool reconnecting comes back with a new extranonce
+        if self.active is None or self.active is pool or not self.active.ready or \
+           (self.failback and pool.priority < self.active.priority):
+            self.activate(pool)
+        defer.returnValue(f)
+
+    def _on_disconnect(self, f, pool):
+        '''Callback when proxy get disconnected from one of the pools'''
+        log.info("Disconnected from Stratum pool at %s:%d" % f.main_host)
+        f.on_disconnect.addCallback(self._on_disconnect, pool)
+
+        pool.ready = False
+        pool.notify = None
+        pool.failures += 1
+        if pool is self.active:
+            self.stats['disconnects'] += 1
+            self.switch_started = time.time()
+            backup = self.best_ready()
+            if backup is not None:
+                self.activate(backup)
+            else:
+                # Nothing to switch to, reject miners until a pool is back
+                stratum_listener.MiningSubscription.disconnect_all()
+                self.workers.clear_authorizations()
+        self.connect_standby()
+        return f
+
+    def activate(self, pool):
+        previous = self.active
+        if previous is not None and previous is not pool:
+            if previous.ready:
+                self.stats['failbacks'] += 1
+            else:
+                self.stats['switchovers'] += 1
+            log.warning("Switching from pool %s to %s" % (previous.name(), pool.name()))
+            if self.switch_started is None:
+                self.switch_started = time.time()
+        self.active = pool
+
+        # Shares and authorizations go to the new pool
+        f = pool.factory
+        self.job_registry.f = f
+        self.workers.f = f
+        self.workers.clear_authorizations()
+        stratum_listener.StratumProxyService._set_upstream_factory(f)
+        client_service.ClientMiningService.reset_timeout()
+
+        # Re-seed extranonce, stratum miners hold the old one and must resubscribe.
+        # Without a job from the new pool yet, the previous pool's jobs must
+        # not be built with its extranonce, so there is no work until one comes.
+        if pool.notify is None:
+            self.job_registry.clear_jobs()
+        self.job_registry.set_extranonce(pool.extranonce1, pool.extranonce2_size)
+        stratum_listener.StratumProxyService._set_extranonce(pool.extranonce1, pool.extranonce2_size)
+        if previous is not None:
+            stratum_listener.MiningSubscription.disconnect_all()
+
+        if pool.difficulty is not None:
+            client_service.ClientMiningService.on_difficulty(pool.difficulty)
+        if pool.notify is not None:
+            # jobs from the previous pool are worthless, so always clean
+            client_service.ClientMiningService.on_notify(pool.notify[:8] + [True])
+
+        if self.custom_user:
+            log.warning("Authorizing custom user %s, password %s" % (self.custom_user, self.custom_password))
+            self.workers.authorize(self.custom_user, self.custom_password)
+
+        self.connect_standby()
+        if not self.on_active.called:
+            self.on_active.callback(self)
+
+    def is_active(self, connection_ref):
+        return self.active is not None and connection_ref().factory is self.active.factory
+
+    def job_received(self):
+        '''Called for each job from the active pool.'''
+        if self.switch_started is not None:
+            self.switch_latency.record(time.time() - self.switch_started)
+            self.switch_started = None
+
+    def pool_of(self, connection_ref):
+        factory = connection_ref().factory
+        for pool in self.pools:
+            if pool.factory is factory:
+                return pool
+        return None
+
+    def record_event(self, method, params, connection_ref):
+        '''Keep the latest job and difficulty of any pool, active or not,
+        for activate() to replay.'''
+        pool = self.pool_of(connection_ref)
+        if pool is None:
+            return
+        if method == 'mining.notify':
+            pool.notify = list(params[:9])
+        elif method == 'mining.set_difficulty':
+            pool.difficulty = params[0]
+
+    def handle_standby_event(self, method, params, connection_ref):
+        '''Answer a backup pool, its job and difficulty are recorded by
+        record_event().'''
+        pool = self.pool_of(connection_ref)
+        if pool is None:
+            return None
+
+        if method == 'client.get_version':
+            return "stratum-proxy/%s" % _version.VERSION
+        elif method not in ('mining.notify', 'mining.set_difficulty'):
+            log.debug("Ignoring %s from backup pool %s" % (method, pool.name()))
+        return None
+
+    def report(self, printer):
+        active = self.active.name() if self.active is not None else 'none'
+        backups = [pool.name() for pool in self.pools if pool.ready and pool is not self.active]
+        printer("Pools: active %s, backups ready: %s" % (active, ', '.join(backups) or 'none'))
+        printer("Pool switchovers %(switchovers)d failbacks %(failbacks)d disconnects %(disconnects)d" % self.stats)
+        if self.switch_latency.count:
+            printer("Switch latency: p50 %.0f ms max %.0f ms over %d switches" %
+                    (1000 * self.switch_latency.percentile(50), 1000 * self.switch_latency.max, self.switch_latency.count))
+
+    def metrics_lines(self):
+        '''Prometheus text lines, for MetricsExporter collectors.'''
+        lines = []
+        for key in ['switchovers', 'failbacks', 'disconnects']:
+            lines.append('# TYPE hf_pool_%s_total counter' % key)
+            lines.append('hf_pool_%s_total %d' % (key, self.stats[key]))
+        lines.append('# TYPE hf_pool_switch_latency_seconds summary')
+        for q in [50, 90, 99]:
+            lines.append('hf_pool_switch_latency_seconds{quantile="%s"} %r' %
+                         (q / 100.0, float(self.switch_latency.percentile(q))))
+        lines.append('hf_pool_switch_latency_seconds_sum %r' % float(self.switch_latency.total))
+        lines.append('hf_pool_switch_latency_seconds_count %d' % self.switch_latency.count)
+        lines.append('# TYPE hf_pool_up gauge')
+        for pool in self.pools:
+            lines.append('hf_pool_up{pool="%s",priority="%d"} %d' % (pool.name(), pool.priority, pool.ready))
+        lines.append('# TYPE hf_pool_active gauge')
+        for pool in self.pools:
+            lines.append('hf_pool_active{pool="%s",priority="%d"} %d' % (pool.name(), pool.priority, pool is self.active))
+        return lines
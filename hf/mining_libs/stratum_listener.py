@@ -31,8 +31,11 @@
 
 import time
 import binascii
+import json
 import struct
 
+from collections import deque
+
 from twisted.internet import defer
 
 from stratum.services import GenericService
@@ -57,6 +60,20 @@ class UpstreamServiceException(ServiceException):
 class SubmitException(ServiceException):
     code = -2
 
+def serialize_notification(method, params):
+    '''One JSON-RPC notification line, as the stratum protocol writes it.'''
+    return json.dumps({'id': None, 'method': method, 'params': params}) + '\n'
+
+def broadcast(event, line):
+    '''Write an already serialized notification to every subscriber of event,
+    instead of serializing it again for each connection like emit() does.
+    Lines go through the protocol's transport_write(), as its own replies
+    do, so they are never interleaved with them.'''
+    for subs in Pubsub.iterate_subscribers(event):
+        conn = subs.connection_ref()
+        if conn is not None and conn.transport is not None:
+            conn.transport_write(line)
+
 class DifficultySubscription(Subscription):
     event = 'mining.set_difficulty'
     difficulty = 1
@@ -64,7 +81,7 @@ class DifficultySubscription(Subscription):
     @classmethod
     def on_new_difficulty(cls, new_difficulty):
         cls.difficulty = new_difficulty
-        cls.emit(new_difficulty)
+        broadcast(cls.event, serialize_notification(cls.event, [new_difficulty]))
     
     def after_subscribe(self, *args):
         self.emit_single(self.difficulty)
@@ -87,7 +104,7 @@ class MiningSubscription(Subscription):
     def on_template(cls, job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs):
         '''Push new job to subscribed clients'''
         cls.last_broadcast = (job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs)
-        cls.emit(job_id, prevhash, coinb1, coinb2, merkle_branch, version, nbits, ntime, clean_jobs)
+        broadcast(cls.event, serialize_notification(cls.event, list(cls.last_broadcast)))
         
     def _finish_after_subscribe(self, result):
         '''Send new job to newly subscribed client'''
@@ -116,8 +133,8 @@ class StratumProxyService(GenericService):
     custom_password = None
     extranonce1 = None
     extranonce2_size = None
-    tail_iterator = 0
-    registered_tails= []
+    free_tails = None # deque of unused tails, least recently used first
+    registered_tails = set()
     
     @classmethod
     def _set_upstream_factory(cls, f):
@@ -138,28 +155,23 @@ class StratumProxyService(GenericService):
         '''Currently adds up to two bytes to extranonce1,
         limiting proxy for up to 65535 connected clients.'''
         
-        for _ in range(0, 0xffff):  # 0-65535
-            cls.tail_iterator += 1
-            cls.tail_iterator %= 0xffff
-
-            # Zero extranonce is reserved for getwork connections
-            if cls.tail_iterator == 0:
-                cls.tail_iterator += 1
-
+        if cls.free_tails is None:
+            # Zero extranonce is reserved for getwork connections,
             # var_int throws an exception when input is >= 0xffff
-            tail = var_int(cls.tail_iterator)
-            tail_len = len(tail)
-
-            if tail not in cls.registered_tails:
-                cls.registered_tails.append(tail)
-                return (binascii.hexlify(tail), cls.extranonce2_size - tail_len)
-            
-        raise Exception("Extranonce slots are full, please disconnect some miners!")
+            cls.free_tails = deque(range(1, 0xffff))
+        
+        if not cls.free_tails:
+            raise Exception("Extranonce slots are full, please disconnect some miners!")
+        
+        tail = var_int(cls.free_tails.popleft())
+        cls.registered_tails.add(tail)
+        return (binascii.hexlify(tail), cls.extranonce2_size - len(tail))
     
     def _drop_tail(self, result, tail):
         tail = binascii.unhexlify(tail)
         if tail in self.registered_tails:
             self.registered_tails.remove(tail)
+            self.free_tails.append(int(binascii.hexlify(tail), 16))
         else:
             log.error("Given extranonce is not registered1")
         return result
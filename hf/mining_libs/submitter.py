@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+
+from collections import deque
+
+from twisted.internet import reactor
+
+from hf.load.instrument import Histogram
+
+from stratum.custom_exceptions import RemoteServiceException
+
+import stratum.logger
+log = stratum.logger.get_logger('proxy')
+
+class Share(object):
+    def __init__(self, newjob, nonce, worker_name, ntime_offset=0, hash_bin=None, zerobits=None):
+        self.newjob = newjob # load-format job from JobRegistry.getwork_batch()
+        self.nonce = nonce
+        self.worker_name = worker_name
+        self.ntime_offset = ntime_offset
+        # result of checking the nonce, so the share is not hashed again
+        self.hash_bin = hash_bin
+        self.zerobits = zerobits
+        self.enqueued = time.time()
+
+class ShareSubmitter(object):
+    '''Submits shares found by the hashing thread to the pool.
+
+    enqueue() may be called from any thread; it wakes the reactor, which
+    keeps up to max_outstanding mining.submit calls in flight. Queued
+    shares are dropped as soon as the pool sends clean jobs, and
+    JobRegistry.submit() drops shares for jobs cleared since.'''
+
+    def __init__(self, job_registry, max_outstanding=8):
+        self.job_registry = job_registry
+        self.max_outstanding = max_outstanding
+        self.queue = deque()
+        self.outstanding = 0
+        self.stats = {'enqueued': 0, 'submitted': 0, 'accepted': 0, 'rejected': 0, 'errors': 0,
+                      'stale': 0, 'below_target': 0}
+        # seconds from enqueue() to the pool's response
+        self.latency = Histogram()
+        reactor.callFromThread(self._watch_blocks)
+
+    def _watch_blocks(self):
+        # add_template() replaces on_block with a new Deferred before firing
+        # the old one, so this hooks the next one too
+        self.job_registry.on_block.addCallback(self._on_block)
+
+    def _on_block(self, result):
+        self.stats['stale'] += len(self.queue)
+        self.queue.clear()
+        self._watch_blocks()
+        return result
+
+    def enqueue(self, share):
+        self.queue.append(share)
+        self.stats['enqueued'] += 1
+        reactor.callFromThread(self._dispatch)
+
+    def _dispatch(self):
+        while self.queue and self.outstanding < self.max_outstanding:
+            share = self.queue.popleft()
+            result = self.job_registry.submit(share.newjob, share.nonce, share.worker_name, share.ntime_offset,
+                                              share.hash_bin)
+            if result is True:
+                self.stats['below_target'] += 1
+            elif result is False:
+                # job cleared by the pool or evicted from the index
+                self.stats['stale'] += 1
+            else:
+                self.stats['submitted'] += 1
+                self.outstanding += 1
+                result.addCallbacks(self._on_response, self._on_error, callbackArgs=[share], errbackArgs=[share])
+
+    def _done(self, share):
+        self.outstanding -= 1
+        self.latency.record(time.time() - share.enqueued)
+        self._dispatch()
+
+    def _on_response(self, result, share):
+        if result == True:
+            self.stats['accepted'] += 1
+        else:
+            self.stats['rejected'] += 1
+        self._done(share)
+        return result
+
+    def _on_error(self, failure, share):
+        # the pool answers rejected shares with an error, e.g. duplicate,
+        # stale or low difficulty; anything else is a transport failure
+        # or a timeout
+        if failure.check(RemoteServiceException):
+            self.stats['rejected'] += 1
+            log.info("Share rejected: %s" % failure.getErrorMessage())
+        else:
+            self.stats['errors'] += 1
+            log.warning("Share submit failed: %s" % failure.getErrorMessage())
+        self._done(share)
+
+    def report(self, printer):
+        printer("Shares: enqueued %(enqueued)d submitted %(submitted)d accepted %(accepted)d rejected %(rejected)d "
+                "errors %(errors)d stale %(stale)d below target %(below_target)d" % self.stats)
+        printer("Share latency: p50 %.0f ms p90 %.0f ms p99 %.0f ms max %.0f ms, %d in flight, %d queued" %
+                (1000 * self.latency.percentile(50), 1000 * self.latency.percentile(90),
+                 1000 * self.latency.percentile(99), 1000 * self.latency.max, self.outstanding, len(self.queue)))
@@ -0,0 +1,187 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# SQLite index of the CSVs written by surface.py, profiler.py and
+# auto-profiler.py.  Files are ingested once per content hash; a file that
+# has grown since, e.g. a resumed session, replaces its earlier rows.  Rows
+# are keyed by board serial and die.
+#
+# auto-profiler's hashrate column is the average since its frequency step
+# started, so its points are ranked by their moving_hashrate instead.
+
+import csv
+import json
+import os
+import sqlite3
+import time
+
+from .store import file_hash, journal_filename
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+  id        INTEGER PRIMARY KEY,
+  sha1      TEXT UNIQUE NOT NULL,
+  path      TEXT NOT NULL,
+  tool      TEXT,
+  serial    TEXT,
+  ingested  REAL,
+  rows      INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+  file_id         INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+  serial          TEXT,
+  die             INTEGER,
+  frequency       REAL,
+  voltage         REAL,
+  hashrate        REAL,
+  hashes          REAL,
+  nonces          REAL,
+  lhw             REAL,
+  dhw             REAL,
+  chw             REAL,
+  temperature     REAL,
+  core_voltage    REAL,
+  thermal_cutoff  INTEGER,
+  elapsed         REAL,
+  moving_hashrate REAL
+);
+CREATE INDEX IF NOT EXISTS results_serial_die ON results (serial, die);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+'''
+
+# CSV columns copied into results, all optional
+COLUMNS = ['die', 'frequency', 'voltage', 'hashrate', 'hashes', 'nonces', 'lhw', 'dhw', 'chw',
+           'temperature', 'core_voltage', 'thermal_cutoff', 'elapsed', 'moving_hashrate']
+
+# the hashrate a point is ranked by
+HASHRATE = 'COALESCE(results.moving_hashrate, results.hashrate)'
+
+UNKNOWN_SERIAL = 'unknown'
+
+def number(value):
+  if value is None or value == '':
+    return None
+  try:
+    return float(value)
+  except ValueError:
+    return None
+
+def tool_name(path):
+  name = os.path.basename(path)
+  for tool in ['auto_profiler', 'profiler', 'surface']:
+    if name.startswith(tool + '_'):
+      return tool
+  return None
+
+def journal_serial(path):
+  # The serial recorded in a profiling session's journal header, if any.
+  journal = journal_filename(path)
+  if not os.path.exists(journal):
+    return None
+  with open(journal, 'r') as f:
+    try:
+      header = json.loads(f.readline())
+    except ValueError:
+      return None
+  return header.get('serial')
+
+def find_csvs(paths):
+  for path in paths:
+    if os.path.isdir(path):
+      for directory, _, names in os.walk(path):
+        for name in sorted(names):
+          if name.endswith('.csv'):
+            yield os.path.join(directory, name)
+    else:
+      yield path
+
+class ResultIndex():
+  def __init__(self, filename):
+    self.db = sqlite3.connect(filename)
+    self.db.row_factory = sqlite3.Row
+    self.db.execute('PRAGMA foreign_keys = ON')
+    self.db.executescript(SCHEMA)
+    columns = [r['name'] for r in self.db.execute('PRAGMA table_info(results)')]
+    if 'moving_hashrate' not in columns:
+      # an index from before moving_hashrate; its auto-profiler files are
+      # indexed again the next time they are given
+      with self.db:
+        self.db.execute('ALTER TABLE results ADD COLUMN moving_hashrate REAL')
+        self.db.execute("DELETE FROM files WHERE tool = 'auto_profiler'")
+
+  def close(self):
+    self.db.close()
+
+  def ingest(self, path, serial=None):
+    # Returns the number of rows added, 0 if the file is already indexed.
+    digest = file_hash(path)
+    if self.db.execute('SELECT 1 FROM files WHERE sha1 = ?', (digest,)).fetchone():
+      return 0
+    serial = serial or journal_serial(path) or UNKNOWN_SERIAL
+    rows = []
+    with open(path, 'r') as csvfile:
+      for row in csv.DictReader(csvfile):
+        values = [number(row.get(c)) for c in COLUMNS]
+        if values[0] is None:
+          continue
+        rows.append([serial] + values)
+    path = os.path.abspath(path)
+    with self.db:
+      # the file has changed since it was indexed
+      self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+      cursor = self.db.execute('INSERT INTO files (sha1, path, tool, serial, ingested, rows) VALUES (?, ?, ?, ?, ?, ?)',
+                               (digest, path, tool_name(path), serial, time.time(), len(rows)))
+      file_id = cursor.lastrowid
+      self.db.executemany('INSERT INTO results (file_id, serial, {0}) VALUES (?, ?, {1})'
+                          .format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                          [[file_id] + r for r in rows])
+    return len(rows)
+
+  def serials(self):
+    return [r[0] for r in self.db.execute('SELECT DISTINCT serial FROM results ORDER BY serial')]
+
+  def best(self, serial=None, max_temperature=None, efficiency=False, limit=1):
+    # The best points of each die of each board, by GH/s or by relative
+    # efficiency, leaving out points that hit thermal cutoff.  Efficiency is
+    # sweep.efficiency()'s hashes per frequency * voltage^2, a proxy for
+    # hashes per joule only comparable between points of the same board.
+    conditions = ['results.thermal_cutoff IS NOT 1', HASHRATE + ' > 0']
+    parameters = []
+    if serial is not None:
+      conditions.append('results.serial = ?')
+      parameters.append(serial)
+    if max_temperature is not None:
+      conditions.append('results.temperature < ?')
+      parameters.append(max_temperature)
+    if efficiency:
+      conditions.append('results.frequency > 0 AND results.voltage > 0')
+      score = '{0} / (results.frequency * results.voltage * results.voltage / 1000000.0)'.format(HASHRATE)
+    else:
+      score = HASHRATE
+    query = ('SELECT * FROM (SELECT results.*, files.path, {2} AS rate, {0} AS score, '
+             'ROW_NUMBER() OVER (PARTITION BY results.serial, results.die ORDER BY {0} DESC) AS rank '
+             'FROM results JOIN files ON files.id = results.file_id WHERE {1}) '
+             'WHERE rank <= ? ORDER BY serial, die, rank').format(score, ' AND '.join(conditions), HASHRATE)
+    return [dict(r) for r in self.db.execute(query, parameters + [limit])]
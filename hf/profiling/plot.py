@@ -0,0 +1,182 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Grids and renders the results of surface.py for surface-plot.py.  The
+# grids of a CSV are cached in a NumPy archive keyed by the CSV's hash, and
+# every die is rendered by its own gnuplot in a pool of processes.
+
+import csv
+import multiprocessing
+import os
+
+import numpy
+
+from .store import file_hash
+
+# frequency on the x-axis
+FRQ_MIN  = 800
+FRQ_MAX  = 1050
+FRQ_STEP = 12.5
+# voltage on the y-axis
+VLT_MIN  = 840
+VLT_MAX  = 1100
+VLT_STEP = 5
+
+DIES = 4
+
+# Results with fewer GH than this are not plotted.
+MIN_GHASHES = 30000
+
+CACHE_NAME = 'grid.npz'
+
+def output_dir(csvfilename):
+  return csvfilename[:-4]
+
+def read_columns(csvfilename, names):
+  with open(csvfilename, 'r') as csvfile:
+    reader = csv.reader(csvfile)
+    header = next(reader)
+    index = [header.index(name) for name in names]
+    rows = [[row[i] for i in index] for row in reader if row]
+  if not rows:
+    return dict((name, numpy.zeros(0)) for name in names)
+  columns = numpy.array(rows, dtype=object).T
+  return dict((name, columns[i]) for i, name in enumerate(names))
+
+def build_grid(csvfilename):
+  # Returns (frequencies, voltages, hashrate, temperature).  hashrate and
+  # temperature are [die, frequency, voltage] arrays in GH/s and C, nan
+  # where there is no usable result.  A later row for a point replaces an
+  # earlier one.
+  f = numpy.arange(FRQ_MIN, FRQ_MAX, FRQ_STEP)
+  v = numpy.arange(VLT_MIN, VLT_MAX, VLT_STEP)
+  hashrate = numpy.full((DIES, len(f), len(v)), numpy.nan)
+  temperature = numpy.full((DIES, len(f), len(v)), numpy.nan)
+  c = read_columns(csvfilename, ['die', 'frequency', 'voltage', 'hashrate', 'hashes', 'temperature', 'thermal_cutoff'])
+  if len(c['die']) == 0:
+    return f, v, hashrate, temperature
+  die = c['die'].astype(int)
+  frq = c['frequency'].astype(float).astype(int)
+  vlt = c['voltage'].astype(float).astype(int)
+  # frequencies are written truncated, e.g. 812 for 812.5
+  fi = ((frq - FRQ_MIN + 1) / FRQ_STEP).astype(int)
+  vi = (vlt - VLT_MIN) // VLT_STEP
+  inside = (die >= 0) & (die < DIES) & (frq >= FRQ_MIN) & (frq < FRQ_MAX) & (vlt >= VLT_MIN) & (vlt < VLT_MAX)
+  if not inside.all():
+    print("{0}: {1:d} results outside the plotted range".format(csvfilename, int((~inside).sum())))
+  # did the die compute enough hashes to compare, did it hit thermal
+  rate = c['hashrate'].astype(float) / 10**9
+  rate[c['hashes'].astype(float) / 10**9 <= MIN_GHASHES] = numpy.nan
+  temp = c['temperature'].astype(float)
+  temp[c['thermal_cutoff'].astype(float).astype(int) == 1] = numpy.nan
+  # fancy assignment keeps the last of repeated indices
+  hashrate[die[inside], fi[inside], vi[inside]] = rate[inside]
+  temperature[die[inside], fi[inside], vi[inside]] = temp[inside]
+  return f, v, hashrate, temperature
+
+def load_grid(csvfilename):
+  # build_grid() through the cache in the CSV's output directory.
+  digest = file_hash(csvfilename)
+  cache = os.path.join(output_dir(csvfilename), CACHE_NAME)
+  if os.path.exists(cache):
+    with numpy.load(cache) as archive:
+      if str(archive['sha1']) == digest:
+        return archive['f'], archive['v'], archive['hashrate'], archive['temperature']
+  f, v, hashrate, temperature = build_grid(csvfilename)
+  if not os.path.isdir(output_dir(csvfilename)):
+    os.makedirs(output_dir(csvfilename))
+  # write then rename, so a reader never sees half a cache
+  temporary = cache + '.tmp.npz'
+  numpy.savez(temporary, sha1=digest, f=f, v=v, hashrate=hashrate, temperature=temperature)
+  os.rename(temporary, cache)
+  return f, v, hashrate, temperature
+
+def render_die(task):
+  # Renders the plots of one die with its own gnuplot, without a display:
+  # plots go to the 'unknown' terminal and only hardcopies are drawn.
+  csvfilename, die, f, v, hashrate, temperature, eps = task
+  import Gnuplot
+  prefix = '{0}/{0}_die{1}'.format(output_dir(csvfilename), die)
+  g = Gnuplot.Gnuplot(debug=0)
+
+  g.title('HashFast HashRate Die {}'.format(die))
+  g.xlabel('Frequency (MHz)')
+  g.ylabel('Voltage (mV)')
+  g.zlabel('HR (GH/s)')
+  g('set parametric')
+  g('set style data pm3d')
+  g('set contour base')
+  g('set datafile missing "nan"')
+  g('set zrange [80:180]')
+  g('set xtics 25')
+  g('set mxtics 2')
+  g('set grid xtics mxtics ytics ztics')
+  g('set terminal unknown')
+  data_hashrate     = Gnuplot.GridData(hashrate, f, v, binary=0)
+  data_temperature  = Gnuplot.GridData(temperature, f, v, binary=0, with_="pm3d at b")
+  g.splot(data_hashrate, data_temperature)
+  if eps:
+    g.hardcopy(prefix + '.eps', enhanced=1, color=1, mode='eps')
+  g.hardcopy(prefix + '.png', terminal='png', fontsize='small')
+
+  g.reset()
+  g.title('HashFast HashRate Die {}'.format(die))
+  g.xlabel('Voltage (mV)')
+  g.ylabel('HashRate (GH/s)')
+  g('set style data lines')
+  g('set datafile missing "nan"')
+  g('set yrange [140:190]')
+  g('set key left')
+  g('set mxtics 4')
+  g('set mytics 10')
+  g('set grid xtics mxtics ytics lw 1')
+  g('set terminal unknown')
+  g.plot(*[Gnuplot.Data(v, hashrate[i], title='{}MHz'.format(int(frq))) for i, frq in enumerate(f)])
+  if eps:
+    g.hardcopy(prefix + '_flat.eps', enhanced=1, color=1, mode='eps')
+  g.hardcopy(prefix + '_flat.png', terminal='png', fontsize='small')
+  g.close()
+  return prefix
+
+def render(csvfilenames, processes=None, eps=True, printer=None):
+  # Renders every die of every CSV, processes at a time.
+  tasks = []
+  for csvfilename in csvfilenames:
+    f, v, hashrate, temperature = load_grid(csvfilename)
+    for die in range(DIES):
+      tasks.append((csvfilename, die, f, v, hashrate[die], temperature[die], eps))
+  if processes == 1:
+    for task in tasks:
+      prefix = render_die(task)
+      if printer is not None:
+        printer('Saved plots {}'.format(prefix))
+    return
+  pool = multiprocessing.Pool(processes)
+  try:
+    for prefix in pool.imap_unordered(render_die, tasks):
+      if printer is not None:
+        printer('Saved plots {}'.format(prefix))
+  finally:
+    pool.terminate()
@@ -0,0 +1,151 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from .sweep import OK, ERRORS, THERMAL
+
+def measurement_delta(measurement, baseline):
+  # The part of a die's running totals since baseline was taken.
+  delta = dict(measurement)
+  if baseline is not None:
+    for key in ['nonces', 'hashes', 'lhw', 'dhw', 'chw', 'elapsed']:
+      delta[key] = measurement[key] - baseline[key]
+  return delta
+
+class DieScheduler():
+  # Measures a different operating point on every die of a module at once.
+  #
+  # sweeps holds an AdaptiveSweep per die.  Giving every die the same sweep
+  # splits one surface across the dies, so a four die module measures four
+  # of its points per step; giving each die its own sweep finds each die's
+  # own surface.
+  #
+  # A step starts with next_step(), which returns the (frequency, voltage)
+  # for each die, or None for a die with nothing to measure, which should
+  # be left at its last point.  Frequencies take an OP_SETTINGS, but the
+  # voltage of a die can be changed while hashing, so a die that is done
+  # with its point goes on to the next point at the same frequency, if
+  # there is one.  poll() takes each die's running totals and returns the
+  # (die, voltage) changes to make; the step is over when step_done().
+  #
+  # Dies of a module heat each other, so every result records the points
+  # and temperatures of the other dies in 'neighbours'.
+  def __init__(self, sweeps):
+    self.sweeps = sweeps
+    self.points = [None] * len(sweeps)
+    self.baselines = [None] * len(sweeps)
+    self.last_points = [None] * len(sweeps)
+    # frequency each die was set to for this step, and dies stopped by a
+    # thermal cutoff until the next step
+    self.frequencies = [None] * len(sweeps)
+    self.halted = [False] * len(sweeps)
+    self.steps = 0
+
+  def finished(self):
+    return all(s.finished() for s in self.sweeps) and all(p is None for p in self.points)
+
+  def next_step(self):
+    self.steps += 1
+    for die, s in enumerate(self.sweeps):
+      self.points[die] = s.next_point()
+      self.baselines[die] = None
+      self.halted[die] = False
+      if self.points[die] is not None:
+        self.last_points[die] = self.points[die]
+      self.frequencies[die] = self.last_points[die][0] if self.last_points[die] else None
+    return list(self.points)
+
+  def step_done(self):
+    return all(p is None for p in self.points)
+
+  def neighbours(self, die, measurements):
+    return [{'die': other, 'frequency': self.last_points[other][0] if self.last_points[other] else None,
+             'voltage': self.last_points[other][1] if self.last_points[other] else None,
+             'temperature': measurements[other]['temperature']}
+            for other in range(len(self.sweeps)) if other != die]
+
+  def module_columns(self, result):
+    # The point of every die of the module and its temperature when the
+    # result was recorded, as CSV columns.
+    columns = {}
+    for n in result['neighbours'] + [result]:
+      for key in ['frequency', 'voltage', 'temperature']:
+        columns['die{}_{}'.format(n['die'], key)] = n[key]
+    return columns
+
+  def finish(self, die, measurements, status):
+    point = self.points[die]
+    m = measurement_delta(measurements[die], self.baselines[die])
+    result = self.sweeps[die].record(point, m, status, self.neighbours(die, measurements))
+    result['die'] = die
+    self.points[die] = None
+    return result
+
+  def poll(self, measurements):
+    # Returns ([(die, voltage)], [results finished in this poll]).
+    changes = []
+    results = []
+    for die, point in enumerate(self.points):
+      if point is not None:
+        status = self.sweeps[die].should_stop(measurement_delta(measurements[die], self.baselines[die]))
+        if status is None:
+          continue
+        results.append(self.finish(die, measurements, status))
+        # a thermal cutoff stops the die until the next OP_SETTINGS
+        if status == THERMAL:
+          self.halted[die] = True
+      if self.halted[die] or self.frequencies[die] is None:
+        continue
+      following = self.sweeps[die].next_point()
+      if following is None:
+        continue
+      if following[0] != self.frequencies[die]:
+        self.sweeps[die].release(following)
+        continue
+      self.points[die] = following
+      self.last_points[die] = following
+      self.baselines[die] = measurements[die]
+      changes.append((die, following[1]))
+    return changes, results
+
+  def abandon_step(self):
+    # Puts back the points of a step that failed to run.
+    for die, point in enumerate(self.points):
+      if point is not None:
+        self.sweeps[die].release(point)
+        self.points[die] = None
+
+  def end_step(self, measurements, status=None):
+    # Records the dies still measuring when a step is cut short, with status
+    # if given and otherwise as their measurement stands.
+    results = []
+    for die, point in enumerate(self.points):
+      if point is None:
+        continue
+      m = measurement_delta(measurements[die], self.baselines[die])
+      outcome = status or self.sweeps[die].should_stop(m)
+      if outcome is None:
+        outcome = OK if m['nonces'] > 0 else ERRORS
+      results.append(self.finish(die, measurements, outcome))
+    return results
@@ -0,0 +1,181 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Crash safe results for the profiling tools.  Rows are appended to one open
+# CSV in batches, each batch flushed and fsync'd, and only then are the
+# points of the batch written to the session journal, so a point in the
+# journal always has its row on disk.  After a crash or a board reset the
+# journal says which points need not run again.
+
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+
+def journal_filename(csvfilename):
+  return csvfilename + '.journal'
+
+def file_hash(path):
+  h = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1024 * 1024), b''):
+      h.update(block)
+  return h.hexdigest()
+
+def truncate_partial_line(filename):
+  # Drops the partial last line a crash can leave, so the next append
+  # starts a line of its own.  Returns the content kept.
+  with open(filename, 'rb+') as f:
+    content = f.read()
+    end = content.rfind(b'\n') + 1
+    if end < len(content):
+      f.truncate(end)
+  return content[:end].decode('utf-8')
+
+class SessionJournal():
+  # An append only file of JSON lines: a header line describing the
+  # session, then one line per completed point and any other events.
+  # Points are (die, frequency, voltage).  Entries may be marked from any
+  # thread.
+  def __init__(self, filename, header=None):
+    self.filename = filename
+    self.header = None
+    self.entries = []
+    self.completed = {}
+    self.lock = threading.Lock()
+    if os.path.exists(filename):
+      for line in truncate_partial_line(filename).splitlines():
+        try:
+          entry = json.loads(line)
+        except ValueError:
+          continue
+        self.load_entry(entry)
+    self.file = open(filename, 'a')
+    # a new session, or one that crashed before its header was written
+    self.resumed = self.header is not None
+    if not self.resumed:
+      self.header = dict(header or {}, session=True)
+      self.write([self.header])
+
+  def load_entry(self, entry):
+    if entry.get('session'):
+      self.header = entry
+      return
+    self.entries.append(entry)
+    if 'point' in entry:
+      self.completed[tuple(entry['point'])] = entry.get('row')
+
+  def write(self, entries):
+    with self.lock:
+      for entry in entries:
+        self.file.write(json.dumps(entry) + '\n')
+      self.file.flush()
+      os.fsync(self.file.fileno())
+
+  def mark(self, entries):
+    # Appends entries, e.g. {'point': [die, frequency, voltage], 'row': {}}.
+    with self.lock:
+      for entry in entries:
+        self.load_entry(entry)
+    self.write(entries)
+
+  def is_done(self, die, frequency, voltage):
+    return (die, frequency, voltage) in self.completed
+
+  def row(self, die, frequency, voltage):
+    return self.completed.get((die, frequency, voltage))
+
+  def events(self, kind):
+    return [entry[kind] for entry in self.entries if kind in entry]
+
+  def last_points(self):
+    # die -> its most recently completed (frequency, voltage)
+    last = {}
+    for entry in self.entries:
+      if 'point' in entry:
+        die, frequency, voltage = entry['point']
+        last[die] = (frequency, voltage)
+    return last
+
+  def close(self):
+    self.file.close()
+
+class ResultStore():
+  # Appends CSV rows from any thread.  Rows are buffered and written every
+  # batch rows or interval seconds, whichever comes first, by append(), or
+  # by flush() and close().  A row given a point marks that point complete
+  # in the journal once the row is on disk.
+  def __init__(self, csvfilename, fieldnames, journal=None, batch=16, interval=10.0):
+    self.csvfilename = csvfilename
+    self.journal = journal
+    self.batch = batch
+    self.interval = interval
+    self.lock = threading.Lock()
+    self.rows = []
+    self.entries = []
+    self.last_flush = time.time()
+    new = not os.path.exists(csvfilename) or os.path.getsize(csvfilename) == 0
+    if not new:
+      # a crash can leave part of a row
+      truncate_partial_line(csvfilename)
+      new = os.path.getsize(csvfilename) == 0
+    self.file = open(csvfilename, 'a')
+    self.writer = csv.DictWriter(self.file, fieldnames, extrasaction='ignore')
+    if new:
+      self.writer.writeheader()
+      self.sync()
+
+  def sync(self):
+    self.file.flush()
+    os.fsync(self.file.fileno())
+
+  def append(self, row, point=None):
+    with self.lock:
+      # copy, the routine's die dicts keep changing
+      self.rows.append(dict(row))
+      if point is not None:
+        self.entries.append({'point': list(point), 'row': dict((k, row.get(k)) for k in self.writer.fieldnames)})
+      if len(self.rows) >= self.batch or time.time() - self.last_flush >= self.interval:
+        self._flush()
+
+  def flush(self):
+    with self.lock:
+      self._flush()
+
+  def _flush(self):
+    if self.rows:
+      self.writer.writerows(self.rows)
+      self.sync()
+      self.rows = []
+    if self.entries and self.journal is not None:
+      self.journal.mark(self.entries)
+    self.entries = []
+    self.last_flush = time.time()
+
+  def close(self):
+    self.flush()
+    self.file.close()
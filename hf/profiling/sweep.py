@@ -0,0 +1,244 @@
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import deque
+
+from ..audit.follow import poisson_interval
+
+# Longest time spent on one operating point, as the fixed step time of
+# surface.py.
+MAX_POINT_TIME = 4*60
+# Shortest time spent on a point before its estimate is trusted.
+MIN_POINT_TIME = 20
+
+# Point outcomes.  A point that fails thermally rules out every point at
+# the same or higher frequency and voltage; a point that fails with errors
+# rules out every point at the same or higher frequency and the same or
+# lower voltage.
+OK      = 'ok'
+THERMAL = 'thermal'
+ERRORS  = 'errors'
+
+def die_measurement(this_die):
+  # The running totals of one die of a routine, since hashing started, and
+  # its latest jobs, temperature and core voltage.
+  return {'nonces': this_die['nonces'], 'hashes': this_die['hashes'], 'lhw': this_die['lhw'], 'dhw': this_die['dhw'],
+          'chw': this_die['chw'], 'jobs': this_die['jobs'], 'temperature': this_die['temperature'],
+          'core_voltage': this_die['core_voltage'], 'thermal_cutoff': 1 if this_die['thermal_cutoff'] else 0,
+          'elapsed': this_die['elapsed']}
+
+def combine_measurements(measurements):
+  # One measurement for dies run at the same operating point.
+  combined = {'nonces': 0, 'hashes': 0, 'lhw': 0, 'dhw': 0, 'chw': 0, 'temperature': None, 'thermal_cutoff': 0, 'elapsed': 0}
+  for m in measurements:
+    for key in ['nonces', 'hashes', 'lhw', 'dhw', 'chw']:
+      combined[key] += m[key]
+    if m['temperature'] is not None:
+      combined['temperature'] = max(combined['temperature'] or m['temperature'], m['temperature'])
+    combined['thermal_cutoff'] = max(combined['thermal_cutoff'], m['thermal_cutoff'])
+    combined['elapsed'] = max(combined['elapsed'], m['elapsed'])
+  return combined
+
+def estimate(measurement, confidence=0.95):
+  # Returns (hashrate, lower, upper).  Each valid nonce credits the same
+  # number of hashes, so the rate is known to within the Poisson interval of
+  # the nonce count.
+  nonces = measurement['nonces']
+  elapsed = measurement['elapsed']
+  if nonces == 0 or elapsed <= 0:
+    return (0.0, 0.0, None)
+  hashes_per_nonce = float(measurement['hashes']) / nonces
+  lower, upper = poisson_interval(nonces, confidence)
+  return (measurement['hashes'] / elapsed, lower * hashes_per_nonce / elapsed, upper * hashes_per_nonce / elapsed)
+
+def efficiency(frequency, voltage, hashrate):
+  # Hashes per unit of dynamic power, which goes as frequency * voltage^2.
+  # Only meaningful to compare points of the same board.
+  return hashrate / (frequency * (voltage / 1000.0)**2)
+
+class AdaptiveSweep():
+  # Chooses the operating points of a frequency x voltage characterization.
+  #
+  # A coarse pass measures every coarse'th frequency and voltage.  Points
+  # ruled out by a failed neighbour are skipped.  The refine pass then
+  # bisects, at every frequency, between the highest voltage known to fail
+  # with errors and the lowest voltage known to run, so that only the points
+  # along the lowest stable voltage - the efficiency frontier - are measured
+  # at full resolution.  Each point runs until its hashrate confidence
+  # interval is within precision of the estimate, rather than for a fixed
+  # time.
+  #
+  # next_point() returns the next (frequency, voltage) or None when done,
+  # should_stop() is polled with the point's running measurement, and
+  # record() takes its final measurement and outcome.  Several points may
+  # be out being measured at once, e.g. on different dies; next_point()
+  # then returns None until their results decide what comes next, and
+  # finished() tells waiting from done.
+  def __init__(self, frequencies, voltages, coarse=2, precision=0.05, confidence=0.95,
+               min_time=MIN_POINT_TIME, max_time=MAX_POINT_TIME, max_temperature=100.0, max_error_fraction=0.2):
+    assert coarse >= 1
+    self.frequencies = sorted(frequencies)
+    self.voltages = sorted(voltages)
+    self.precision = precision
+    self.confidence = confidence
+    self.min_time = min_time
+    self.max_time = max_time
+    self.max_temperature = max_temperature
+    self.max_error_fraction = max_error_fraction
+    # (frequency, voltage) -> result
+    self.results = {}
+    # (frequency, voltage) -> the failed point that rules it out
+    self.skipped = {}
+    # points handed out by next_point() and not recorded yet
+    self.pending = set()
+    coarse_frequencies = self.frequencies[::coarse]
+    coarse_voltages = self.voltages[::coarse]
+    # include the ends of the grid
+    if coarse_frequencies[-1] != self.frequencies[-1]:
+      coarse_frequencies.append(self.frequencies[-1])
+    if coarse_voltages[-1] != self.voltages[-1]:
+      coarse_voltages.append(self.voltages[-1])
+    self.queue = deque((f, v) for f in coarse_frequencies for v in coarse_voltages)
+    self.phase = 'coarse'
+
+  def is_open(self, point):
+    return point not in self.results and point not in self.skipped and point not in self.pending
+
+  def next_point(self):
+    while True:
+      while self.queue:
+        point = self.queue.popleft()
+        if self.is_open(point):
+          self.pending.add(point)
+          return point
+      if self.pending:
+        # plan the next refinement from complete results
+        return None
+      self.phase = 'refine'
+      self.queue.extend(self.refine_points())
+      if not self.queue:
+        return None
+
+  def release(self, point):
+    # Puts back a point from next_point() that was not measured.
+    self.pending.discard(point)
+    self.queue.appendleft(point)
+
+  def finished(self):
+    if self.pending or any(self.is_open(point) for point in self.queue):
+      return False
+    return not self.refine_points()
+
+  def refine_points(self):
+    points = []
+    for f in self.frequencies:
+      # errors at (f', v) with f' <= f mean errors at (f, v); running at
+      # (f', v) with f' >= f means running at (f, v)
+      failing = [v for (pf, v), r in self.results.items() if r['status'] == ERRORS and pf <= f]
+      running = [v for (pf, v), r in self.results.items() if r['status'] == OK and pf >= f]
+      running_here = [v for (pf, v), r in self.results.items() if r['status'] == OK and pf == f]
+      low = max(failing) if failing else None
+      if running_here:
+        high = min(running_here)
+      elif running:
+        high = min(running)
+      else:
+        high = None
+      candidates = [v for v in self.voltages
+                    if (low is None or v > low) and (high is None or v <= high) and self.is_open((f, v))]
+      if running_here:
+        # the lowest running voltage measured here is already in the range
+        candidates = [v for v in candidates if v < high]
+      if candidates:
+        points.append((f, candidates[len(candidates) // 2]))
+    return points
+
+  def should_stop(self, measurement):
+    # Returns None while the point should keep running, otherwise its outcome.
+    if measurement['thermal_cutoff']:
+      return THERMAL
+    if measurement['temperature'] is not None and measurement['temperature'] > self.max_temperature:
+      return THERMAL
+    elapsed = measurement['elapsed']
+    if elapsed < self.min_time:
+      return None
+    bad = measurement['lhw'] + measurement['dhw']
+    total = measurement['nonces'] + bad
+    if total > 0 and float(bad) / total > self.max_error_fraction:
+      return ERRORS
+    hashrate, lower, upper = estimate(measurement, self.confidence)
+    if hashrate > 0 and (upper - lower) / 2 <= self.precision * hashrate:
+      return OK
+    if elapsed >= self.max_time:
+      if measurement['nonces'] == 0:
+        return ERRORS
+      return OK
+    return None
+
+  def record(self, point, measurement, status, neighbours=None):
+    # neighbours optionally describes what the other dies of the module were
+    # doing, for points measured side by side.
+    frequency, voltage = point
+    hashrate, lower, upper = estimate(measurement, self.confidence)
+    result = dict(measurement)
+    result.update({'frequency': frequency, 'voltage': voltage, 'status': status, 'phase': self.phase,
+                   'hashrate': hashrate, 'lower': lower, 'upper': upper,
+                   'efficiency': efficiency(frequency, voltage, hashrate) if status == OK else None,
+                   'neighbours': neighbours})
+    self.pending.discard(point)
+    self.results[point] = result
+    if status == THERMAL:
+      self.skip(point, lambda f, v: f >= frequency and v >= voltage)
+    elif status == ERRORS:
+      self.skip(point, lambda f, v: f >= frequency and v <= voltage)
+    return result
+
+  def skip(self, point, dominated):
+    for f in self.frequencies:
+      for v in self.voltages:
+        if dominated(f, v) and self.is_open((f, v)):
+          self.skipped[(f, v)] = point
+
+  def frontier(self):
+    # The measured lowest running voltage at each frequency.
+    points = []
+    for f in self.frequencies:
+      running = [r for (pf, v), r in self.results.items() if pf == f and r['status'] == OK]
+      if running:
+        points.append(min(running, key=lambda r: r['voltage']))
+    return points
+
+  def best(self):
+    # The running point with the best efficiency, None if nothing ran.
+    running = [r for r in self.results.values() if r['status'] == OK]
+    if not running:
+      return None
+    return max(running, key=lambda r: r['efficiency'])
+
+  def summary(self):
+    measured = len(self.results)
+    elapsed = sum(r['elapsed'] for r in self.results.values())
+    return ("{0:d} points measured, {1:d} skipped of {2:d}, {3:.0f} sec measuring"
+            .format(measured, len(self.skipped), len(self.frequencies) * len(self.voltages), elapsed))
@@ -23,8 +23,11 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import struct
+
 from abc import ABCMeta, abstractmethod
 
+from ..errors import HF_Error
 from ..load import crc
 from ..util import with_metaclass, int_to_lebytes, lebytes_to_int
 
@@ -111,6 +114,71 @@ def check_framebytes(framebytes):
 #        if crc32 != crc.crc32_to_bytelist(crc.crc32(data)):
 #            raise HF_Error("Bad CRC32 checksum.")
 
+# Frame header: 0xaa, operation_code, chip_address, core_address, hdata
+# (little-endian), data_length_field, crc8.
+frame_header_struct = struct.Struct('<BBBBHBB')
+FRAME_HEADER_LENGTH = frame_header_struct.size
+FRAME_MAX_DATA = 1020
+
+# Packs one frame into buffer at offset, which must have room for it, and
+# returns the offset just past it.  payload may be a list of ints, bytes or
+# bytearray; out of range fields raise HF_Error.
+def pack_frame_into(buffer, offset, operation_code, chip_address, core_address, hdata, payload=None):
+  length = 0 if payload is None else len(payload)
+  if length > FRAME_MAX_DATA or length % 4 != 0:
+    raise HF_Error("data length is not a multiple of 4 up to %d: %d" % (FRAME_MAX_DATA, length))
+  data_length_field = length >> 2
+  try:
+    crc8 = crc.crc8_header(operation_code, chip_address, core_address, hdata, data_length_field)
+    frame_header_struct.pack_into(buffer, offset, 0xaa, operation_code, chip_address, core_address,
+                                  hdata, data_length_field, crc8)
+    offset += FRAME_HEADER_LENGTH
+    if length:
+      buffer[offset:offset+length] = payload
+  except (struct.error, ValueError, IndexError, TypeError) as e:
+    raise HF_Error("Cannot encode frame: opcode %s chip %s core %s hdata %s: %s" %
+                   (operation_code, chip_address, core_address, hdata, e))
+  return offset + length
+
+def encode_frame(operation_code, chip_address=0, core_address=0, hdata=0, payload=None):
+  length = 0 if payload is None else len(payload)
+  frame = bytearray(FRAME_HEADER_LENGTH + length)
+  pack_frame_into(frame, 0, operation_code, chip_address, core_address, hdata, payload)
+  return frame
+
+# Encodes frames back to back into one buffer that is kept between calls, so
+# a batch of OP_HASH frames costs one allocation at most.
+class FrameEncoder():
+  def __init__(self, size=4096):
+    self.buffer = bytearray(size)
+    self.length = 0
+
+  def reset(self):
+    self.length = 0
+
+  def add(self, operation_code, chip_address=0, core_address=0, hdata=0, payload=None):
+    needed = self.length + FRAME_HEADER_LENGTH + (0 if payload is None else len(payload))
+    if needed > len(self.buffer):
+      self.buffer.extend(bytearray(max(needed, 2 * len(self.buffer)) - len(self.buffer)))
+    self.length = pack_frame_into(self.buffer, self.length, operation_code, chip_address, core_address, hdata, payload)
+
+  # Only valid until the next reset() or add().
+  def view(self):
+    return memoryview(self.buffer)[:self.length]
+
+  def getvalue(self):
+    return bytes(self.buffer[:self.length])
+
+# frames is an iterable of (operation_code, chip_address, core_address, hdata,
+# payload) tuples.  Returns a memoryview into the encoder's buffer.
+def encode_frames(frames, encoder=None):
+  if encoder is None:
+    encoder = FrameEncoder()
+  encoder.reset()
+  for frame in frames:
+    encoder.add(*frame)
+  return encoder.view()
+
 class hf_frame_data(with_metaclass(ABCMeta, object)):
   def __init__(self, bytes=None):
     self.initialize()
@@ -156,12 +224,14 @@ class hf_frame_data_base(hf_frame_data):
 #      and then have specific methods for that type.  Probably more trouble than
 #      its worth, but it would also let us have specific methods for parameters
 #      that just occupy a couple bits.
+legal_frame_fields = frozenset(['operation_code', 'chip_address', 'core_address', 'hdata', 'data'])
+
 class HF_Frame():
   def __init__(self, initial_state):
     self.initialize()
     if initial_state is None:
       pass
-    elif isinstance(initial_state, list):
+    elif isinstance(initial_state, (list, bytearray)):
       self.off_the_wire(initial_state)
     elif isinstance(initial_state, dict):
       self.buildframe(initial_state)
@@ -205,48 +275,35 @@ class HF_Frame():
 #       self.crc32 = crc.crc32(self.data)
 
   def construct_framebytes(self):
-    crc8_input  = [self.operation_code]
-    crc8_input += [self.chip_address]
-    crc8_input += [self.core_address]
-    crc8_input += int_to_lebytes(self.hdata, 2)
-    crc8_input += [self.data_length_field]
-    self.crc8 = crc.crc8(crc8_input)
-    frameheader = [0xaa, self.operation_code, self.chip_address, self.core_address] + \
-      int_to_lebytes(self.hdata, 2) + [self.data_length_field, self.crc8]
-    if self.data_length > 0:
 # Fix: Restore when using serial line directly
-#            return frameheader + self.data + crc.crc32_to_bytelist(self.crc32)
-      self.framebytes = frameheader + self.data
-    else:
-      self.framebytes = frameheader
+#            append crc.crc32_to_bytelist(self.crc32)
+    self.framebytes = encode_frame(self.operation_code, self.chip_address, self.core_address, self.hdata,
+                                   self.data if self.data_length > 0 else None)
+    self.crc8 = self.framebytes[7]
     return self.framebytes
 
-  def buildframe(self, framedict):
-    legal_fields = set(['operation_code', 'chip_address', 'core_address', 'hdata', 'data'])
-    received_fields = set(framedict.keys())
-    assert received_fields.issubset(legal_fields)
-    assert 'operation_code' in framedict
-    assert framedict['operation_code'] in opnames
-    self.operation_code = framedict['operation_code']
-    if 'chip_address' in framedict:
-      if framedict['chip_address'] < 0 or framedict['chip_address'] > 255:
-        raise HF_Error("chip_address is out of range: %d" % (framedict['chip_address']))
-      self.chip_address = framedict['chip_address']
-    if 'core_address' in framedict:
-      if framedict['core_address'] < 0 or framedict['core_address'] > 255:
-        raise HF_Error("core_address is out of range: %d" % (framedict['core_address']))
-      self.core_address = framedict['core_address']
-    if 'hdata' in framedict:
-      if framedict['hdata'] < 0 or framedict['hdata'] > 65535:
-        raise HF_Error("hdata is out of range: %d" % (framedict['hdata']))
-      self.hdata = framedict['hdata']
-    if 'data' in framedict:
-      assert len(framedict['data']) == 0 or {x >= 0 and x < 256 for x in framedict['data']} == set([True])
-      assert len(framedict['data']) <= 1020 and len(framedict['data']) % 4 == 0
-      if len(framedict['data']) > 0:
-        self.set_data(framedict['data'])
+  # Typed equivalent of buildframe() for callers that know their fields.
+  def build(self, operation_code, chip_address=0, core_address=0, hdata=0, data=None):
+    if operation_code not in opnames:
+      raise HF_Error("Unknown operation_code: %s" % (operation_code))
+    self.operation_code = operation_code
+    self.chip_address = chip_address
+    self.core_address = core_address
+    self.hdata = hdata
+    if data is not None and len(data) > 0:
+      self.set_data(data)
     return self.construct_framebytes()
 
+  def buildframe(self, framedict):
+    for field in framedict:
+      if field not in legal_frame_fields:
+        raise HF_Error("Unknown frame field: %s" % (field))
+    if 'operation_code' not in framedict:
+      raise HF_Error("operation_code is required")
+    # field ranges and data bytes are checked as the frame is encoded
+    return self.build(framedict['operation_code'], framedict.get('chip_address', 0), framedict.get('core_address', 0),
+                      framedict.get('hdata', 0), framedict.get('data'))
+
   def __str__(self):
     string  = ""
     #string += "framebytes:        {}\n".format(self.framebytes)
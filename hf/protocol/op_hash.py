@@ -82,8 +82,5 @@ class HF_OP_HASH(HF_Frame):
     assert sequence >= 0 and sequence < 2**16
     assert isinstance(job, hf_hash_serial)
     self.job = job
-    HF_Frame.__init__(self,{'operation_code': opcodes['OP_HASH'],
-                            'chip_address': chip_address,
-                            'core_address': core_address,
-                            'hdata': sequence,
-                            'data': self.job.frame_data})
\ No newline at end of file
+    HF_Frame.__init__(self, None)
+    self.build(opcodes['OP_HASH'], chip_address, core_address, sequence, self.job.frame_data)
\ No newline at end of file
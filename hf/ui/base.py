@@ -409,19 +409,19 @@ class BaseUI(with_metaclass(ABCMeta, object)):
       else:
         temp_row = 6
         if n%4 == 1 or n%4 == 2:
-         #wdie.addstr(1, 1,"SQ    {0:02d}%".format(int(di.throttle)))
           wdie.addstr(1, 1,"ACT    {0:02d}".format(di.active))
           wdie.addstr(2, 1,"PEND   {0:02d}".format(di.pending))
           wdie.addstr(3, 1,"LHW  {0:04d}".format(dd['lhw']))
           wdie.addstr(4, 1,"DHW  {0:04d}".format(dd['dhw']))
           wdie.addstr(5, 1,"NNC  {0:04d}".format(dd['nonces']))
           wdie.addstr(6, 1,"JOBS {0:04d}".format(dd['jobs']))
+          wdie.addstr(7, 1,"SQ   {0:3d}%".format(int(di.throttle)))
           temp_row = 8
           wdie.addstr(10,1,"VM   {0:.02f}".format(di.vm))
         else:
           wdie.addstr(2, 1,"VM   {0:.02f}".format(di.vm))
-         #wdie.addstr(9, 1,"SQ    {0:02d}%".format(int(di.throttle)))
           temp_row = 4
+          wdie.addstr(5, 1,"SQ   {0:3d}%".format(int(di.throttle)))
           wdie.addstr(6, 1,"ACT    {0:02d}".format(di.active))
           wdie.addstr(7, 1,"PEND   {0:02d}".format(di.pending))
           wdie.addstr(8 ,1,"LHW  {0:04d}".format(dd['lhw']))
@@ -34,11 +34,20 @@ import time
 import os
 import socket
 
+def pool_address(value):
+  host, _, port = value.rpartition(':')
+  if not host:
+    raise argparse.ArgumentTypeError("expected host:port, got %s" % (value))
+  return (host, int(port))
+
 def parse_args():
   parser = argparse.ArgumentParser(description='This proxy allows you to run getwork-based miners against Stratum mining pool.')
   parser.add_argument('-c', '--clockrate', dest='clockrate', type=int, default=1, help='Miner clockrate')
   parser.add_argument('-o', '--host', dest='host', type=str, default='stratum.bitcoin.cz', help='Hostname of Stratum mining pool')
   parser.add_argument('-p', '--port', dest='port', type=int, default=3333, help='Port of Stratum mining pool')
+  parser.add_argument('-b', '--backup-pool', dest='backup_pools', type=pool_address, action='append', default=[], help='Backup Stratum pool as host:port, in order of preference. May be repeated.')
+  parser.add_argument('--standby', dest='standby', type=int, default=1, help='Number of backup pools kept connected and subscribed')
+  parser.add_argument('--no-failback', dest='no_failback', action='store_true', help='Stay on a backup pool when a preferred pool comes back')
   parser.add_argument('-sh', '--stratum-host', dest='stratum_host', type=str, default='0.0.0.0', help='On which network interface listen for stratum miners. Use "localhost" for listening on internal IP only.')
   parser.add_argument('-sp', '--stratum-port', dest='stratum_port', type=int, default=3333, help='Port on which port listen for stratum miners.')
   parser.add_argument('-oh', '--getwork-host', dest='getwork_host', type=str, default='0.0.0.0', help='On which network interface listen for getwork miners. Use "localhost" for listening on internal IP only.')
@@ -56,6 +65,14 @@ def parse_args():
   parser.add_argument('-q', '--quiet', dest='quiet', action='store_true', help='Make output more quiet')
   parser.add_argument('-i', '--pid-file', dest='pid_file', type=str, help='Store process pid to the file')
   parser.add_argument('-l', '--log-file', dest='log_file', type=str, help='Log to specified file')
+  parser.add_argument('--work-batch', dest='work_batch', type=int, default=96, help='Number of jobs to build from the pool job at a time')
+  parser.add_argument('--ntime-roll', dest='ntime_roll', type=int, default=60, help='Let the board roll ntime up to this many seconds per job, 0 to disable')
+  parser.add_argument('--nonce-split', dest='nonce_split', type=int, default=8, help='Number of cores sharing each merkle root, each searching its own nonce range')
+  parser.add_argument('--nonce-rate', dest='nonce_rate', type=float, default=10, help='Adapt the search difficulty of each die to return about this many nonces per second, 0 for a fixed difficulty')
+  parser.add_argument('--work-restart', dest='work_restart', action='store_true', help='Send OP_WORK_RESTART and new work to every core when the pool sends clean jobs')
+  parser.add_argument('--max-submits', dest='max_submits', type=int, default=8, help='Maximum number of mining.submit calls waiting for the pool')
+  parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=0, help='Serve Prometheus metrics on this port, 0 to disable')
+  parser.add_argument('--metrics-host', dest='metrics_host', type=str, default='127.0.0.1', help='On which network interface serve metrics')
   parser.add_argument('-st', '--scrypt-target', dest='scrypt_target', action='store_true', help='Calculate targets for scrypt algorithm')
   return parser.parse_args()
 
@@ -85,54 +102,20 @@ from hf.mining_libs import client_service
 from hf.mining_libs import jobs
 from hf.mining_libs import worker_registry
 from hf.mining_libs import utils
+from hf.mining_libs import submitter as submitter_lib
+from hf.mining_libs import pool_manager as pool_manager_lib
 
 import stratum.logger
 log = stratum.logger.get_logger('proxy')
 
 running = True
 
-def on_shutdown(f):
+def on_shutdown(pool_manager):
   '''Clean environment properly'''
   global running
   running = False
   log.info("Shutting down proxy...")
-  f.is_reconnecting = False # Don't let stratum factory to reconnect again
-  
-@defer.inlineCallbacks
-def on_connect(f, workers, job_registry):
-  '''Callback when proxy get connected to the pool'''
-  log.info("Connected to Stratum pool at %s:%d" % f.main_host)
-  #reactor.callLater(30, f.client.transport.loseConnection)
-  
-  # Hook to on_connect again
-  f.on_connect.addCallback(on_connect, workers, job_registry)
-  
-  # Every worker have to re-autorize
-  workers.clear_authorizations() 
-     
-  # Subscribe for receiving jobs
-  log.info("Subscribing for mining jobs")
-  (_, extranonce1, extranonce2_size) = (yield f.rpc('mining.subscribe', []))[:3]
-  job_registry.set_extranonce(extranonce1, extranonce2_size)
-  stratum_listener.StratumProxyService._set_extranonce(extranonce1, extranonce2_size)
-  
-  if args.custom_user:
-    log.warning("Authorizing custom user %s, password %s" % (args.custom_user, args.custom_password))
-    workers.authorize(args.custom_user, args.custom_password)
-
-  defer.returnValue(f)
-   
-def on_disconnect(f, workers, job_registry):
-  '''Callback when proxy get disconnected from the pool'''
-  log.info("Disconnected from Stratum pool at %s:%d" % f.main_host)
-  f.on_disconnect.addCallback(on_disconnect, workers, job_registry)
-  
-  stratum_listener.MiningSubscription.disconnect_all()
-  
-  # Reject miners because we don't give a *job :-)
-  workers.clear_authorizations() 
-  
-  return f              
+  pool_manager.stop()
 
 def test_launcher(result, job_registry):
   def run_test():
@@ -162,33 +145,31 @@ def main(args):
     fp.write(str(os.getpid()))
     fp.close()
 
-  log.warning("Trying to connect to Stratum pool at %s:%d" % (args.host, args.port))        
-    
-  # Connect to Stratum pool
-  f = SocketTransportClientFactory(args.host, args.port,
-        debug=args.verbose, proxy=None,
-        event_handler=client_service.ClientMiningService)
-  
-  job_registry = jobs.JobRegistry(f, cmd=args.blocknotify_cmd, scrypt_target=args.scrypt_target,
+  job_registry = jobs.JobRegistry(None, cmd=args.blocknotify_cmd, scrypt_target=args.scrypt_target,
            no_midstate=args.no_midstate, real_target=args.real_target, use_old_target=args.old_target)
   client_service.ClientMiningService.job_registry = job_registry
   client_service.ClientMiningService.reset_timeout()
   
-  workers = worker_registry.WorkerRegistry(f)
-  f.on_connect.addCallback(on_connect, workers, job_registry)
-  f.on_disconnect.addCallback(on_disconnect, workers, job_registry)
+  workers = worker_registry.WorkerRegistry(None)
+
+  # Connect to Stratum pools, the active one hands its factory to job_registry and workers
+  pools = [(args.host, args.port)] + args.backup_pools
+  pool_manager = pool_manager_lib.PoolManager(pools, job_registry, workers, standby=args.standby,
+        failback=not args.no_failback, custom_user=args.custom_user, custom_password=args.custom_password,
+        debug=args.verbose)
+  client_service.ClientMiningService.pool_manager = pool_manager
 
   if args.test:
-    f.on_connect.addCallback(test_launcher, job_registry)
+    pool_manager.on_active.addCallback(test_launcher, job_registry)
   
   # Cleanup properly on shutdown
-  reactor.addSystemEventTrigger('before', 'shutdown', on_shutdown, f)
+  reactor.addSystemEventTrigger('before', 'shutdown', on_shutdown, pool_manager)
 
-  # Block until connect to the pool
-  yield f.on_connect
+  # Block until connect to a pool
+  yield pool_manager.start()
 
   # thread
-  thread = threading.Thread(target=mine, args=[args, job_registry, workers])
+  thread = threading.Thread(target=mine, args=[args, job_registry, workers, pool_manager])
   #thread.daemon = True
   thread.start()
 
@@ -198,8 +179,9 @@ from collections import deque
 from hf.load import hf
 from hf.load import talkusb
 from hf.load.routines import restart
+from hf.load.metrics import MetricsExporter
 
-def mine(args, job_registry, workers):
+def mine(args, job_registry, workers, pool_manager):
   time.sleep(1)
 
   # authorize worker
@@ -216,40 +198,60 @@ def mine(args, job_registry, workers):
   # init the test
   test = restart.RestartRoutine(talkusb.talkusb, args.clockrate, printer)
 
+  # metrics
+  if args.metrics_port:
+    exporter = MetricsExporter(test, args.metrics_port, host=args.metrics_host, printer=printer,
+                               collectors=[pool_manager.metrics_lines])
+    exporter.start()
+
+  # jobs are built args.work_batch at a time, args.nonce_split to a merkle
+  # root, and dropped when the pool sends a new job
+  work_queue = deque([])
+  work_source = [None]
   def get_job(die, core):
-    job = job_registry.getwork()
-    job['previous block hash'] = hf.reverse_every_four_bytes(job['previous block hash'])
-    job['merkle tree root']    = hf.reverse_every_four_bytes(job['merkle tree root'])
-    job['bits'] = hf.bebytes_to_int(job['bits'])
-    return job
+    if job_registry.last_job is not work_source[0]:
+      work_queue.clear()
+      work_source[0] = job_registry.last_job
+    if not work_queue:
+      roots = max(1, args.work_batch // args.nonce_split)
+      work_queue.extend(job_registry.getwork_split(roots, args.nonce_split, ntime_roll=args.ntime_roll))
+    if not work_queue:
+      # no job from the pool, e.g. just after switching pools
+      return None
+    return work_queue.popleft()
 
   test.get_job = get_job
   
-  valid_nonce_queue = deque([])
-  def is_valid_nonce(job, nonce):
+  # shares go to the pool from the reactor thread
+  submitter = submitter_lib.ShareSubmitter(job_registry, max_outstanding=args.max_submits)
+  def is_valid_nonce(job, nonce, ntime_offset=0, search_difficulty=None):
     # check nonce
-    zerobits, regen_hash_expanded = hf.check_nonce_work(job, nonce)
-    if (zerobits >= 39): #if (zerobits >= job_registry.difficulty):
-      job['previous block hash'] = hf.reverse_every_four_bytes(job['previous block hash'])
-      job['merkle tree root']    = hf.reverse_every_four_bytes(job['merkle tree root'])
-      #job['bits'] = hf.int_to_bebytes(job['bits'], 4)
-      #job_registry.submit(job, nonce, worker_name)
-      valid_nonce_queue.append( (job, nonce, worker_name) )
-    return (zerobits >= test.search_difficulty)
+    if ntime_offset > job['ntime loops'] or not hf.nonce_in_range(job, nonce):
+      return False
+    # hash once; the share carries the hash to JobRegistry.submit()
+    hash_bin = hf.nonce_hash(job, nonce, ntime_offset)
+    zerobits = hf.hash_zero_bits(hash_bin)
+    if job_registry.meets_target(hash_bin):
+      submitter.enqueue(submitter_lib.Share(job, nonce, worker_name, ntime_offset, hash_bin, zerobits))
+    if search_difficulty is None:
+      search_difficulty = test.search_difficulty
+    return (zerobits >= search_difficulty)
 
   test.is_valid_nonce = is_valid_nonce
 
-  def submit(job_registry):
-    while running:
-      time.sleep(0.1)
-      if len(valid_nonce_queue):
-        job, nonce, worker_name = valid_nonce_queue.popleft()
-        job_registry.submit(job, nonce, worker_name)
+  # new block: drop the old work on the device instead of letting it finish
+  if args.work_restart:
+    def on_block(result):
+      test.request_work_restart()
+      # add_template() replaced on_block before firing this one
+      job_registry.on_block.addCallback(on_block)
+      return result
+    # on_block is replaced on every new block, so look it up on the reactor
+    reactor.callFromThread(lambda: job_registry.on_block.addCallback(on_block))
 
-  # submit thread
-  submit_thread = threading.Thread(target=submit, args={job_registry})
-  #submit_thread.daemon = True
-  submit_thread.start()
+  # never search above the share difficulty, or the die would drop shares
+  if args.nonce_rate > 0:
+    test.enable_difficulty_control(target_rate=args.nonce_rate, ceiling=job_registry.share_zero_bits)
 
   def monitor(test):
     while running:
@@ -257,6 +259,8 @@ def mine(args, job_registry, workers):
       test.report_hashrate()
       time.sleep(4)
       test.report_errors()
+      submitter.report(printer)
+      pool_manager.report(printer)
 
   # thread
   thread = threading.Thread(target=monitor, args={test})
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2014, HashFast Technologies LLC
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#   1.  Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#   2.  Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#   3.  Neither the name of HashFast Technologies LLC nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL HASHFAST TECHNOLOGIES LLC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Index the results of surface.py, profiler.py and auto-profiler.py in SQLite and query the best operating points.')
+  parser.add_argument('paths', metavar='CSV', nargs='*', help='result files, or directories searched for them, to add to the index')
+  parser.add_argument('-d', '--database', dest='database', type=str, default='profiles.sqlite', help='index file')
+  parser.add_argument('-s', '--serial', dest='serial', type=str, default=None, help='board serial of the files added, default from their session journal; also restricts --best')
+  parser.add_argument('-b', '--best', dest='best', action='store_true', help='print the best points of each die')
+  parser.add_argument('-t', '--max-temperature', dest='max_temperature', type=float, default=None, help='only points below this die temperature, C')
+  parser.add_argument('-e', '--efficiency', dest='efficiency', action='store_true', help='rank by relative efficiency, GH/s per GHz*V^2, only comparable between points of the same board')
+  parser.add_argument('-n', '--limit', dest='limit', type=int, default=1, help='points to print for each die')
+  return parser.parse_args()
+
+if __name__ == '__main__':
+  # parse args before other imports
+  args = parse_args()
+
+import sys
+
+from hf.profiling import index
+
+def main(args):
+  db = index.ResultIndex(args.database)
+  try:
+    for path in index.find_csvs(args.paths):
+      added = db.ingest(path, args.serial)
+      if added:
+        print("{}: {} rows".format(path, added))
+    if args.best:
+      results = db.best(args.serial, args.max_temperature, args.efficiency, args.limit)
+      for r in results:
+        line = "{:s} die {:d}: {:.1f} GH/s at {:.1f} MHz {:.0f} mV, {:.1f} C".format(
+          r['serial'], int(r['die']), r['rate'] / 10**9, r['frequency'], r['voltage'], r['temperature'] or 0)
+        if args.efficiency:
+          line += ", relative efficiency {:.2f} GH/s per GHz*V^2".format(r['score'] / 10**6)
+        print(line)
+      if not results:
+        print("No matching points")
+        return 1
+  finally:
+    db.close()
+  return 0
+
+if __name__ == "__main__":
+   sys.exit(main(args))
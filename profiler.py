@@ -30,6 +30,7 @@ import argparse
 def parse_args():
   parser = argparse.ArgumentParser(description='Profile HashFast boards in order to find optimal operating points.')
   parser.add_argument('-r', '--revision', dest='revision', type=int, default=3, help='HashFast board major revision number')
+  parser.add_argument('--resume', dest='resume', type=str, default=None, help='continue the interrupted session that wrote this CSV')
   return parser.parse_args()
 
 if __name__ == '__main__':
@@ -50,7 +51,6 @@ VLT_STEP = 5
 import sys
 import time
 import threading
-import csv
 from collections import OrderedDict
 
 from abc import ABCMeta, abstractmethod
@@ -63,6 +63,7 @@ from hf.load.routines import settings
 from hf.load.routines import thermal
 from hf.usb import usbbulk
 from hf.usb import usbctrl
+from hf.profiling import store
 
 fn = OrderedDict([('die',None),('frequency',None),('voltage',None),('hashrate',None),('hashes',None),('jobs',None),('nonces',None),
                   ('lhw',None),('dhw',None),('chw',None),('temperature',None),('core_voltage',None),('thermal_cutoff',None),('elapsed',None)])
@@ -76,23 +77,35 @@ class HFProfilerBase(object):
     pass
 
 class HFProfilerInteractive(HFProfilerBase):
-  def __init__(self):
+  def __init__(self, resume=None, serial=None):
     self.frequency = [None]*4
     self.voltage   = [None]*4
-    self.csvfilename  = 'profiler_{}.csv'.format(int(time.time()))
-    with open(self.csvfilename, 'w') as csvfile:
-      csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
-      csvwriter.writeheader()
+    self.csvfilename  = resume or 'profiler_{}.csv'.format(int(time.time()))
+    # points are (die, frequency, voltage)
+    self.journal = store.SessionJournal(store.journal_filename(self.csvfilename),
+                                        {'tool': 'profiler', 'csv': self.csvfilename, 'serial': serial, 'started': int(time.time())})
+    self.store = store.ResultStore(self.csvfilename, fn, self.journal, batch=4)
 
   def start(self, ui, dev):
     talkusb.talkusb(hf.INIT, None, 0);
-    self.test(ui, dev)
+    try:
+      self.test(ui, dev)
+    finally:
+      self.store.close()
 
   def test(self, ui, dev):
-    option = ui.prompt_int_single("Option? 0=PROM 1=DEFAULTS")
-    if option is 1:
-      self.frequency = [FRQ_MIN]*4
-      self.voltage   = [VLT_MIN]*4
+    last = self.journal.last_points()
+    if len(last) == 4:
+      # carry on from the settings of the last completed round
+      option = 1
+      for x in range(4):
+        self.frequency[x], self.voltage[x] = last[x]
+      ui.log("Resuming {} at {}".format(self.csvfilename, ', '.join('{} MHz {} mV'.format(*last[x]) for x in range(4))))
+    else:
+      option = ui.prompt_int_single("Option? 0=PROM 1=DEFAULTS")
+      if option is 1:
+        self.frequency = [FRQ_MIN]*4
+        self.voltage   = [VLT_MIN]*4
     while True:
       try:
         time.sleep(1)
@@ -173,12 +186,11 @@ class HFProfilerInteractive(HFProfilerBase):
         if die['frequency'] is not None:
           self.frequency[x] = die['frequency']
     # write logfile
-    with open(self.csvfilename, 'a') as csvfile:
-      csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
-      for x in range(4):
-        if self.test.dies[x] is not None:
-          die = self.test.dies[x]
-          csvwriter.writerow(die)
+    for x in range(4):
+      if self.test.dies[x] is not None:
+        die = self.test.dies[x]
+        self.store.append(die, point=(x, self.frequency[x], self.voltage[x]))
+    self.store.flush()
     #if rslt is -2:
     #  self.run(ui, dev, clockrate)
     # cycle loop complete
@@ -250,7 +262,9 @@ def main(args):
 
     ret = ui.prompt("HashFast Profiling Tool. Press 's' to start", "s")
     if ret:
-      profiler = HFProfilerInteractive()
+      # recorded in the session journal for profile-index.py
+      serial = dev.serial(0)
+      profiler = HFProfilerInteractive(args.resume, serial.hfserial() if serial.serial else None)
       profiler.start(ui, dev)
 
   finally:
@@ -25,7 +25,23 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import sys
+import argparse
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Soak a board, throttling each die to hold a temperature.')
+  parser.add_argument('-s', '--setpoint', dest='setpoint', type=float, default=95.0, help='die temperature to hold, C')
+  parser.add_argument('-l', '--limit', dest='limit', type=float, default=104.0, help='throttle a die fully at this temperature, C')
+  parser.add_argument('--kp', dest='kp', type=float, default=4.0, help='throttled cores per C above setpoint')
+  parser.add_argument('--ki', dest='ki', type=float, default=0.5, help='throttled cores per C second above setpoint')
+  parser.add_argument('--kd', dest='kd', type=float, default=8.0, help='throttled cores per C/s of temperature rise')
+  parser.add_argument('-f', '--fan', dest='fan', action='store_true', help='also drive the fan, from the hottest die')
+  parser.add_argument('-r', '--report', dest='report', type=float, default=30.0, help='log the controller state every this many seconds, 0 for never')
+  return parser.parse_args()
+
+if __name__ == '__main__':
+  # parse args before other imports
+  args = parse_args()
+
 import time
 import threading
 
@@ -40,8 +56,8 @@ from hf.usb import usbbulk
 from hf.usb import usbctrl
 
 class HFSoakInteractive():
-  def __init__(self):
-    pass
+  def __init__(self, args):
+    self.args = args
 
   def start(self, ui, dev):
     self.soak(ui, dev)
@@ -70,9 +86,10 @@ class HFSoakInteractive():
     ui.prompt_show("Running at "+str(clockrate)+"MHz. Press board 'RESET' or ctrl+c to end.")
     self.cr = ui.current_round
     self.cr.clockrate = clockrate
-    # run soak with temperature monitor
-    self.getting_warm = False
-    self.throttle = 50
+    # run soak with temperature monitor, the controller throttles each die
+    # from its OP_STATUS temperature
+    self.controller = self.test.enable_thermal_control(setpoint=self.args.setpoint, limit=self.args.limit,
+                                                       kp=self.args.kp, ki=self.args.ki, kd=self.args.kd, fan=self.args.fan)
     rslt = True
 
     # thread
@@ -83,15 +100,7 @@ class HFSoakInteractive():
 
     # run
     while rslt:
-      if self.getting_warm is False:
-        self.throttle -= 1
-        if self.throttle < 0:
-          self.throttle = 0
-      else:
-        # getting warm
-        self.throttle = 50
-        self.getting_warm = False
-      rslt = self.test.one_cycle(self.throttle)
+      rslt = self.test.one_cycle()
     #if rslt is -2:
     #  self.run(ui, dev, clockrate)
     # cycle loop complete
@@ -99,8 +108,12 @@ class HFSoakInteractive():
     self.running = False
 
   def monitor_temp(self, ui):
+    last_report = time.time()
     while self.running:
       time.sleep(0.1)
+      if self.args.report > 0 and time.time() - last_report > self.args.report:
+        self.controller.report(ui.log)
+        last_report = time.time()
       self.cr.total_hashes = self.test.stats['hashes']
       self.cr.total_errors = self.test.stats['lhw']
       self.cr.hash_rate    = self.test.stats['hashrate']
@@ -116,8 +129,7 @@ class HFSoakInteractive():
               dinfo.pending = die['pending']
               dinfo.temp = die['temperature']
               dinfo.vm = die['core_voltage']
-              if dinfo.temp > 104:
-                self.getting_warm = True
+              dinfo.throttle = 100 * die['throttle'] / self.test.max_cores_per_die
 
   def input(self, msg):
     pass
@@ -144,7 +156,7 @@ class HFSoakUI(BaseUI):
   def refresh_ui(self):
     pass
 
-def main(argv):
+def main(args):
   ui = HFSoakUI()
   try:
     ui.setup()
@@ -155,11 +167,11 @@ def main(argv):
 
     ret = ui.prompt("HashFast Soak Tool. Press 's' to start", "s")
     if ret:
-      profiler = HFSoakInteractive()
+      profiler = HFSoakInteractive(args)
       profiler.start(ui, dev)
 
   finally:
     ui.end()
 
 if __name__ == "__main__":
-   main(sys.argv[1:])
+   main(args)
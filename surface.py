@@ -30,6 +30,12 @@ import argparse
 def parse_args():
   parser = argparse.ArgumentParser(description='Charactarize HashFast boards over a surface of frequencies and voltages.')
   parser.add_argument('-r', '--revision', dest='revision', type=int, default=3, help='HashFast board major revision number')
+  parser.add_argument('-a', '--adaptive', dest='adaptive', action='store_true', help='measure each point only until its hashrate is known, and skip points ruled out by failed neighbours')
+  parser.add_argument('-p', '--precision', dest='precision', type=float, default=0.05, help='adaptive: stop a point once the hashrate confidence interval is within this fraction')
+  parser.add_argument('-c', '--coarse', dest='coarse', type=int, default=2, help='adaptive: grid steps between points of the first pass')
+  parser.add_argument('-d', '--per-die', dest='per_die', action='store_true', help='adaptive: measure a different point of the surface on each die at once')
+  parser.add_argument('-i', '--independent', dest='independent', action='store_true', help='adaptive: sweep a separate surface for each die, each die at its own points')
+  parser.add_argument('-t', '--max-temperature', dest='max_temperature', type=float, default=100.0, help='adaptive: die temperature that fails a point')
   return parser.parse_args()
 
 if __name__ == '__main__':
@@ -71,12 +77,19 @@ from hf.load.routines import thermal
 from hf.load.routines import settings
 from hf.usb import usbbulk
 from hf.usb import usbctrl
+from hf.profiling import sweep
+from hf.profiling import scheduler
+from hf.profiling import store
 
 EXP_ASIC = 0.74108
 EXP_DIE  = 0.18527
 
 fn = OrderedDict([('die',None),('frequency',None),('voltage',None),('hashrate',None),('hashes',None),('jobs',None),('nonces',None),
                   ('lhw',None),('dhw',None),('chw',None),('temperature',None),('core_voltage',None),('thermal_cutoff',None),('elapsed',None)])
+# per die runs also record each point's outcome and what the whole module
+# was doing, for thermal coupling between dies
+fn_per_die = OrderedDict(list(fn.items()) + [('status',None)] +
+                         [('die{}_{}'.format(x, key),None) for x in range(4) for key in ['frequency', 'voltage', 'temperature']])
 
 class HFProfilerData:
   def __init__(self):
@@ -87,13 +100,25 @@ class HFProfilerBase(object):
     pass
 
 class HFProfilerInteractive(HFProfilerBase):
-  def __init__(self):
+  def __init__(self, adaptive=None, scheduler=None, serial=None):
     self.frequency = [800]*4
     self.voltage   = [940]*4
+    # sweep.AdaptiveSweep for all dies at the same point, or
+    # scheduler.DieScheduler for a point per die, or neither to walk the
+    # whole grid
+    self.adaptive  = adaptive
+    self.scheduler = scheduler
+    self.outcome   = None
+    self.dev       = None
     self.csvfilename  = 'surface_{}.csv'.format(int(time.time()))
+    self.fieldnames   = fn if scheduler is None else fn_per_die
     with open(self.csvfilename, 'w') as csvfile:
-      csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
+      csvwriter = csv.DictWriter(csvfile, self.fieldnames, extrasaction='ignore')
       csvwriter.writeheader()
+    # a journal with only the session header, for profile-index.py
+    journal = store.SessionJournal(store.journal_filename(self.csvfilename),
+                                   {'tool': 'surface', 'csv': self.csvfilename, 'serial': serial, 'started': int(time.time())})
+    journal.close()
 
   def start(self, ui, dev):
     talkusb.talkusb(hf.INIT, None, 0);
@@ -101,6 +126,12 @@ class HFProfilerInteractive(HFProfilerBase):
 
   def test(self, ui, dev):
     option = ui.prompt_int_single("Option?")
+    if self.adaptive is not None:
+      self.adaptive_test(ui, dev, option)
+      return
+    if self.scheduler is not None:
+      self.per_die_test(ui, dev, option)
+      return
     for frq in FRQS:
       ran_frq = False
       while not ran_frq:
@@ -140,6 +171,83 @@ class HFProfilerInteractive(HFProfilerBase):
         except:
           ui.log("Error in frq")
 
+  def adaptive_test(self, ui, dev, option):
+    while True:
+      point = self.adaptive.next_point()
+      if point is None:
+        break
+      frq, vlt = point
+      try:
+        time.sleep(1)
+        self.frequency = [frq]*4
+        self.voltage = [vlt]*4
+        self.set(ui)
+        dev = usbctrl.poll_hf_ctrl_device(printer=ui.log)
+        ui.log('{} point: {} MHz {} mV'.format(self.adaptive.phase, frq, vlt))
+        self.vset(ui, dev)
+        self.run(ui, dev, option)
+        result = self.adaptive.record(point, self.measurement(), self.outcome or sweep.OK)
+        ui.log('{} MHz {} mV: {} {:6.2f} GH/s in {:.0f} sec'.format(frq, vlt, result['status'], result['hashrate']/10**9, result['elapsed']))
+      except KeyboardInterrupt:
+        ui.log('exiting')
+        ui.end()
+        return
+      except:
+        ui.log("Error at point")
+        # measure it again
+        self.adaptive.release(point)
+    ui.log(self.adaptive.summary())
+    best = self.adaptive.best()
+    if best is not None:
+      ui.log('best efficiency: {} MHz {} mV {:6.2f} GH/s'.format(best['frequency'], best['voltage'], best['hashrate']/10**9))
+
+  def per_die_test(self, ui, dev, option):
+    while not self.scheduler.finished():
+      points = self.scheduler.next_step()
+      if all(point is None for point in points):
+        break
+      # dies with nothing to measure stay at their last point
+      for x in range(4):
+        self.frequency[x], self.voltage[x] = self.scheduler.last_points[x] or (FRQS[0], VLTS[0])
+      try:
+        time.sleep(1)
+        self.set(ui)
+        self.dev = usbctrl.poll_hf_ctrl_device(printer=ui.log)
+        ui.log('step {}: {}'.format(self.scheduler.steps, ', '.join('{} MHz {} mV'.format(*point) if point else 'idle' for point in points)))
+        self.vset(ui, self.dev)
+        self.run(ui, self.dev, option)
+        self.record_results(ui, self.scheduler.end_step(self.die_measurements(), self.outcome))
+      except KeyboardInterrupt:
+        ui.log('exiting')
+        ui.end()
+        return
+      except:
+        ui.log("Error in step")
+        self.scheduler.abandon_step()
+    sweeps = []
+    for s in self.scheduler.sweeps:
+      if s not in sweeps:
+        sweeps.append(s)
+    for s in sweeps:
+      ui.log(s.summary())
+
+  def record_results(self, ui, results):
+    with open(self.csvfilename, 'a') as csvfile:
+      csvwriter = csv.DictWriter(csvfile, self.fieldnames, extrasaction='ignore')
+      for result in results:
+        ui.log('die {} {} MHz {} mV: {} {:6.2f} GH/s in {:.0f} sec'.format(result['die'], result['frequency'], result['voltage'],
+               result['status'], result['hashrate']/10**9, result['elapsed']))
+        row = dict(result)
+        row.update(self.scheduler.module_columns(result))
+        csvwriter.writerow(row)
+
+  def die_measurements(self):
+    return [sweep.die_measurement(self.test.dies[x]) for x in range(4)]
+
+  def measurement(self):
+    return sweep.combine_measurements([sweep.die_measurement(self.test.dies[x]) for x in range(4)
+                                       if self.test.dies[x] is not None])
+
   def set(self, ui):
     ui.prompt_show("Updating Die Settings")
     talkusb.talkusb(hf.INIT, None, 0)
@@ -192,13 +300,14 @@ class HFProfilerInteractive(HFProfilerBase):
           self.voltage[x] = die['voltage']
         if die['frequency'] is not None:
           self.frequency[x] = die['frequency']
-    # write logfile
-    with open(self.csvfilename, 'a') as csvfile:
-      csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
-      for x in range(4):
-        if self.test.dies[x] is not None:
-          die = self.test.dies[x]
-          csvwriter.writerow(die)
+    # write logfile, per die runs write a row per point instead
+    if self.scheduler is None:
+      with open(self.csvfilename, 'a') as csvfile:
+        csvwriter = csv.DictWriter(csvfile, fn, extrasaction='ignore')
+        for x in range(4):
+          if self.test.dies[x] is not None:
+            die = self.test.dies[x]
+            csvwriter.writerow(die)
     #if rslt is -2:
     #  self.run(ui, dev, clockrate)
     # cycle loop complete
@@ -211,10 +320,24 @@ class HFProfilerInteractive(HFProfilerBase):
     runtime = 0
     step = 0.5
     self.req_stop = False
+    self.outcome = None
     while self.running:
       time.sleep(step)
       runtime += step
-      if runtime > STEP_TIME:
+      if self.adaptive is not None:
+        self.outcome = self.adaptive.should_stop(self.measurement())
+        if self.outcome is not None:
+          self.req_stop = True
+      elif self.scheduler is not None:
+        changes, results = self.scheduler.poll(self.die_measurements())
+        for die, vlt in changes:
+          ui.log('die {} to {} mV'.format(die, vlt))
+          self.dev.voltage_set(0, die, vlt)
+          self.voltage[die] = vlt
+        self.record_results(ui, results)
+        if self.scheduler.step_done():
+          self.req_stop = True
+      elif runtime > STEP_TIME:
         self.req_stop = True
       self.cr.total_hashes = self.test.stats['hashes']
       self.cr.total_errors = self.test.stats['lhw']
@@ -222,6 +345,8 @@ class HFProfilerInteractive(HFProfilerBase):
       if runtime > 20 and self.test.stats['hashes'] < 200*10**9:
         ui.log('req_stop low system hashes')
         self.req_stop = True
+        if self.adaptive is not None and self.outcome is None:
+          self.outcome = sweep.ERRORS
       if self.test.dies is not None:
         for dinfo in ui.die_info:
           if dinfo is not None:
@@ -272,7 +397,20 @@ def main(argv):
 
     ret = ui.prompt("HashFast Surface Tool. Press 's' to start", "s")
     if ret:
-      profiler = HFProfilerInteractive()
+      adaptive = None
+      die_scheduler = None
+      def new_sweep():
+        return sweep.AdaptiveSweep(FRQS, VLTS, coarse=args.coarse, precision=args.precision,
+                                   max_temperature=args.max_temperature)
+      if args.independent:
+        die_scheduler = scheduler.DieScheduler([new_sweep() for x in range(4)])
+      elif args.per_die:
+        die_scheduler = scheduler.DieScheduler([new_sweep()]*4)
+      elif args.adaptive:
+        adaptive = new_sweep()
+      # recorded in the session journal for profile-index.py
+      serial = dev.serial(0)
+      profiler = HFProfilerInteractive(adaptive, die_scheduler, serial.hfserial() if serial.serial else None)
       profiler.start(ui, dev)
 
   finally: